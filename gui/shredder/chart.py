@@ -9,8 +9,11 @@ The chart is drawn via cairo and a tiny bit of math.
 
 # Stdlib:
 import math
+import bisect
 import colorsys
 
+from collections import OrderedDict
+
 # Internal:
 from shredder.util import size_to_human_readable
 from shredder.tree import Column
@@ -29,6 +32,12 @@ from gi.repository import PangoCairo
 ANGLE_LIMIT_TOOLTIP = math.pi / 32
 ANGLE_LIMIT_VISIBLE = math.pi / 256
 
+# Segments with a shorter outer arc (in pixels) are not drawn:
+LOD_MIN_ARC_PX = 1.0
+
+# Number of chart roots whose segment geometry is kept around:
+GEOMETRY_CACHE_SIZE = 16
+
 
 ###########################################################
 # NOTE: This code is inspired by the baobab code,         #
@@ -258,41 +267,38 @@ class Chart(Gtk.DrawingArea):
 
 class Segment:
     """Helper and data class for a single segment in a RingChart."""
-    def __init__(self, node, layer, degree, size, tooltip=None):
+    __slots__ = ['node', 'layer', 'degree', 'size']
+
+    def __init__(self, node, layer, degree, size):
         self.node = node
-        self.children = []
         self.layer, self.degree, self.size = layer, degree, size
         self.degree = math.fmod(self.degree, math.pi * 2)
-        self.is_selected = False
 
-        # Cut off too long tooltips:
-        if tooltip is not None:
-            tooltip = GLib.markup_escape_text(tooltip, -1)
-            if len(tooltip) > 60:
-                self.tooltip = tooltip[:60] + '...'
-            else:
-                self.tooltip = tooltip
+    @property
+    def tooltip(self):
+        """Escaped path of the segment's node; cut off if too long."""
+        tooltip = GLib.markup_escape_text(self.node[Column.PATH], -1)
+        if len(tooltip) > 60:
+            return tooltip[:60] + '...'
+
+        return tooltip
 
-    def draw(self, ctx, alloc, max_layers, bg_col):
-        """Trigger the actual drawing of the segment."""
+    def draw(self, ctx, alloc, max_layers, bg_col, is_selected=False):
+        """Trigger the actual drawing of the segment.
+        Selected segments are drawn highlighted.
+        """
         _draw_segment(
             ctx, alloc,
             self.layer, max_layers,
             self.degree, self.degree + self.size,
-            self.is_selected,
+            is_selected,
             bg_col
         )
 
-    def hit(self, layer, deg):
-        """Check if the segment was hit by a click,
-        depending on a certain layer and angle.
-        """
-        if self.layer != layer:
-            self.is_selected = False
-        else:
-            self.is_selected = self.degree <= deg <= self.degree + self.size
-
-        return self.is_selected
+    def arc_length(self, alloc, max_layers):
+        """Length of the segment's outer arc in pixels."""
+        mid = min(alloc.width, alloc.height) / 2
+        return self.size * ((self.layer + 1) / (max_layers + 1)) * mid
 
     def middle_point(self, alloc, max_layers):
         """Calculate the middle point of the segment.
@@ -322,36 +328,41 @@ class Segment:
         return self.degree + self.size / 2
 
 
-class RingChart(Chart):
-    """Chart type for visualizing the node-tree as segmented ring.
-    Each depth becomes one ring. Each segment has 0 to one parent.
-    Size of the node determines the size of the segment.
-    """
-    def __init__(self):
-        Chart.__init__(self)
+class RingGeometry:
+    """Segments of a RingChart for a certain root node.
 
-        # Id of the tooltip timeout
-        self._timeout_id = None
-        self._segment_list = []
+    The segments are computed once and ordered by layer.
+    Segments of one layer never overlap, so each layer is indexed
+    by the start angles of its segments for fast hit tests.
+    """
+    def __init__(self, root):
+        self.segments = []
         self.max_layers = 0
-        self.total_size = 1
-        self._selected_segment = None
-        self._last_root = None
+        self.total_size = root[Column.SIZE]
+
+        self.recursive_angle(root, 2 * math.pi, 0, root.depth - 1)
+        self.segments.sort(key=lambda segment: segment.layer)
+
+        # layer -> (sorted start angles, segments in the same order)
+        self.layers = {}
+        for segment in self.segments:
+            self.layers.setdefault(segment.layer, []).append(segment)
+
+        for layer, segments in self.layers.items():
+            segments.sort(key=lambda segment: segment.degree)
+            self.layers[layer] = ([seg.degree for seg in segments], segments)
 
     def recursive_angle(self, node, angle, offset, layer_offset=0):
         """Calculates the angles of the segments and stores them in a
-        list that is ordered by Z-Depth, so the plot appears to be layered
-        with the root circle on top. This resembles a depth first traversal.
+        list. This resembles a depth first traversal.
         """
-        self._segment_list.append(Segment(
-            node, node.depth - layer_offset,
-            offset, angle, node[Column.PATH]
+        self.segments.append(Segment(
+            node, node.depth - layer_offset, offset, angle
         ))
 
         child_offset = offset
+        node_size = node[Column.SIZE]
         for child in node.indices:
-            node_size = node[Column.SIZE]
-
             if node_size != 0:
                 child_angle = (child[Column.SIZE] / node_size) * angle
             else:
@@ -370,30 +381,83 @@ class RingChart(Chart):
 
             child_offset += child_angle
 
+    def hit(self, layer, deg):
+        """Return the segment at `layer` covering the angle `deg` or None."""
+        starts, segments = self.layers.get(layer, ((), ()))
+        idx = bisect.bisect_right(starts, deg) - 1
+        if idx < 0:
+            return None
+
+        segment = segments[idx]
+        if deg <= segment.degree + segment.size:
+            return segment
+
+        return None
+
+
+class RingChart(Chart):
+    """Chart type for visualizing the node-tree as segmented ring.
+    Each depth becomes one ring. Each segment has 0 to one parent.
+    Size of the node determines the size of the segment.
+
+    The geometry of recently shown roots is cached until clear_cache()
+    is called, as is a raster of the rendered segments (never highlighted),
+    so that hovering only needs to draw the hovered segment and tooltips
+    on top.
+    """
+    def __init__(self):
+        Chart.__init__(self)
+
+        # Id of the tooltip timeout
+        self._timeout_id = None
+        self._geometry = None
+        self._geometry_cache = OrderedDict()
+        self._raster, self._raster_key = None, None
+        self._hovered_segment = None
+        self._selected_segment = None
+        self._last_root = None
+
+    @property
+    def max_layers(self):
+        """Number of layers of the currently shown chart."""
+        return self._geometry.max_layers if self._geometry else 0
+
+    @property
+    def total_size(self):
+        """Size shown in the center of the chart."""
+        return self._geometry.total_size if self._geometry else 1
+
     def find_root(self, node):
         """Iterate to the first child that has more than one children"""
-        if len(node.children) > 1:
+        if len(node.indices) > 1:
             return node
 
-        for child in node.children.values():
+        for child in node.indices:
             return self.find_root(child)
 
         # Default to the actual root:
         return node
 
+    def _lookup_geometry(self, root):
+        """Get the geometry of `root` from the cache or compute it."""
+        # Changed sizes of the root invalidate its geometry:
+        key = (root, root[Column.SIZE], root[Column.COUNT])
+        geometry = self._geometry_cache.pop(key, None)
+        if geometry is None:
+            geometry = RingGeometry(root)
+
+        self._geometry_cache[key] = geometry
+        while len(self._geometry_cache) > GEOMETRY_CACHE_SIZE:
+            self._geometry_cache.popitem(last=False)
+
+        return geometry
+
     def render(self, root, overwrite_root=True):
         """Render `root` and all children of it as chart."""
         # Skip over duplicate full circles:
-        virt_root = self.find_root(root)
-
-        # Reset the segment list, fill it again by dfs and sort it.
-        self._segment_list = []
-        self.max_layers = 0
-        self.recursive_angle(virt_root, 2 * math.pi, 0, virt_root.depth - 1)
-        self._segment_list.sort(key=lambda node: node.layer)
-
-        # Make sure we show the right total size
-        self.total_size = virt_root[Column.SIZE]
+        self._geometry = self._lookup_geometry(self.find_root(root))
+        self._hovered_segment = None
+        self._selected_segment = None
 
         if overwrite_root:
             self._last_root = root
@@ -401,19 +465,26 @@ class RingChart(Chart):
         # Make sure it gets rendered soon:
         self.queue_draw()
 
-    def on_draw(self, area, ctx):
-        """Actual signal callback that triggers all the drawing."""
+    def clear_cache(self):
+        """Forget the geometry of all roots but the current one.
+        Call this when the shown model changes, so old nodes can be freed.
+        """
+        self._geometry_cache.clear()
 
-        # May happen on empty charts:
-        max_layers = self.max_layers
-        if max_layers <= 0:
-            max_layers = 1
-            draw_empty = True
-        else:
-            draw_empty = False
+    def _render_raster(self, ctx, alloc, max_layers, bg_col):
+        """Render center text and all segments to a cached surface."""
+        key = (
+            self._geometry, alloc.width, alloc.height,
+            max_layers, bg_col.to_string()
+        )
 
-        # Figure out the background color of the drawing area
-        alloc = area.get_allocation()
+        if self._raster_key == key:
+            return self._raster
+
+        surface = ctx.get_target().create_similar(
+            cairo.CONTENT_COLOR_ALPHA, alloc.width, alloc.height
+        )
+        raster_ctx = cairo.Context(surface)
 
         # Calculate the font size of the inner label.
         # Make it smaller if not enough place but cut off at a size of 12
@@ -423,32 +494,59 @@ class RingChart(Chart):
 
         # Draw the center text:
         _draw_center_text(
-            ctx, alloc.width / 2, alloc.height / 2,
+            raster_ctx, alloc.width / 2, alloc.height / 2,
             '<span color="#333"><small>{size}</small></span>'.format(
                 size=size_to_human_readable(self.total_size)
             ),
             font_size=font_size
         )
 
-        bg = self.get_toplevel().get_style_context().get_background_color(0)
-
-        if not draw_empty:
-            for segment in reversed(self._segment_list):
-                segment.draw(ctx, alloc, max_layers, bg)
-        else:
-            ctx.arc(
+        if self.max_layers <= 0:
+            raster_ctx.arc(
                 alloc.width / 2, alloc.height / 2,
                 inner_circle / 2, 0, 2 * math.pi
             )
-            ctx.stroke()
+            raster_ctx.stroke()
+        else:
+            for segment in reversed(self._geometry.segments):
+                # Level of detail: skip what would not be visible anyways.
+                if segment.arc_length(alloc, max_layers) < LOD_MIN_ARC_PX:
+                    continue
+
+                segment.draw(raster_ctx, alloc, max_layers, bg_col)
+
+        self._raster, self._raster_key = surface, key
+        return surface
 
-        if self._selected_segment is None or draw_empty:
+    def on_draw(self, area, ctx):
+        """Actual signal callback that triggers all the drawing."""
+        # May happen on empty charts:
+        max_layers = max(1, self.max_layers)
+        draw_empty = self.max_layers <= 0
+
+        # Figure out the background color of the drawing area
+        alloc = area.get_allocation()
+        bg = self.get_toplevel().get_style_context().get_background_color(0)
+
+        ctx.set_source_surface(
+            self._render_raster(ctx, alloc, max_layers, bg), 0, 0
+        )
+        ctx.paint()
+
+        if draw_empty:
             return
 
-        for segment in self._segment_list:
-            if segment.layer != self._selected_segment.layer:
-                continue
+        # Only the hovered segment needs to be drawn again (highlighted):
+        if self._hovered_segment is not None:
+            self._hovered_segment.draw(
+                ctx, alloc, max_layers, bg, is_selected=True
+            )
+
+        if self._selected_segment is None:
+            return
 
+        _, layer_segments = self._geometry.layers[self._selected_segment.layer]
+        for segment in layer_segments:
             if segment is not self._selected_segment:
                 if segment.size < ANGLE_LIMIT_TOOLTIP:
                     continue
@@ -471,8 +569,11 @@ class RingChart(Chart):
         self.queue_draw()
         self._timeout_id = None
 
-    def _hit(self, area, event, click_only=False):
+    def _hit(self, area, event):
         """Check what segments were hitten by a GdkEvent"""
+        if self._geometry is None:
+            return (False, None)
+
         alloc = area.get_allocation()
         mid_x, mid_y = alloc.width / 2, alloc.height / 2
 
@@ -480,6 +581,9 @@ class RingChart(Chart):
         # a = (event.x + m, event.y + m) and (0, 1)
         x, y = event.x - mid_x, event.y - mid_y
         xy_abs = math.sqrt(x * x + y * y)
+        if xy_abs == 0:
+            return (True, None)
+
         cos = x / xy_abs
 
         if y < 0:
@@ -495,23 +599,23 @@ class RingChart(Chart):
         if selected_layer == 0:
             return (True, None)
 
-        hit_segment = None
-        for segment in self._segment_list:
-            if segment.hit(selected_layer, selected_deg):
-                hit_segment = segment
-                if click_only:
-                    break
-
+        hit_segment = self._geometry.hit(selected_layer, selected_deg)
         return bool(hit_segment), hit_segment
 
     def on_motion(self, area, event):
         """Called on pointer motion."""
         hit, segment = self._hit(area, event)
 
+        # Redraw only if something visible changed:
+        needs_redraw = self._selected_segment is not None
+        needs_redraw |= segment is not self._hovered_segment
+
         if self._timeout_id is not None:
             GLib.source_remove(self._timeout_id)
             self._timeout_id = None
-            self._selected_segment = None
+
+        self._selected_segment = None
+        self._hovered_segment = segment
 
         if hit and segment:
             id_ = GLib.timeout_add(
@@ -519,11 +623,12 @@ class RingChart(Chart):
             )
             self._timeout_id = id_
 
-        self.queue_draw()
+        if needs_redraw:
+            self.queue_draw()
 
     def on_button_press_event(self, area, event):
         """Called on pointer and keyboard events"""
-        hit, segment = self._hit(area, event, click_only=True)
+        hit, segment = self._hit(area, event)
         if hit:
             if segment is not None:
                 self.render(segment.node, overwrite_root=False)
@@ -568,6 +673,10 @@ class ChartStack(Gtk.Stack):
         """Trigger all render procedure"""
         self.chart.render(root)
 
+    def clear_cache(self):
+        """The shown model changed; see RingChart.clear_cache()"""
+        self.chart.clear_cache()
+
 
 if __name__ == '__main__':
     def main():
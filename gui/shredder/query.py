@@ -12,7 +12,11 @@ This is a valid example for example:
 
 # Stdlib:
 import re
+import time
+import bisect
 import logging
+
+from array import array
 from collections import defaultdict
 
 try:
@@ -99,6 +103,245 @@ class Query:
         return True
 
 
+# Length of the substrings names are indexed by:
+NGRAM_SIZE = 3
+
+# Minimum seconds between two partial results of SearchGeneration.search():
+SEARCH_PARTIAL_INTERVAL = 0.1
+
+
+def _ngrams(text):
+    """Set of all NGRAM_SIZE long substrings of `text`."""
+    last = len(text) - NGRAM_SIZE + 1
+    return {text[idx:idx + NGRAM_SIZE] for idx in range(last)}
+
+
+def _make_handle_list(int_handles):
+    """Container for handles; compact if handles are ints."""
+    return array('l') if int_handles else []
+
+
+class NameIndex:
+    """N-gram index over a set of names, for substring search.
+
+    Every name gets an id; each n-gram maps to the ids of the names
+    containing it. A search only checks the names that contain the
+    rarest n-gram of the search term.
+    """
+    def __init__(self):
+        self.names, self._ids = [], {}
+        self._ngrams = defaultdict(lambda: array('l'))
+
+    def add(self, name):
+        """Add `name` (if new) and return its id."""
+        name_id = self._ids.get(name)
+        if name_id is not None:
+            return name_id
+
+        name_id = self._ids[name] = len(self.names)
+        self.names.append(name)
+        for ngram in _ngrams(name):
+            self._ngrams[ngram].append(name_id)
+
+        return name_id
+
+    def find(self, term, limit=None):
+        """Return the ids of all names containing `term`.
+        Only the first `limit` names are checked, if given.
+        """
+        if limit is None:
+            limit = len(self.names)
+
+        if len(term) < NGRAM_SIZE:
+            candidates = range(limit)
+        else:
+            postings = [self._ngrams.get(ngram, ()) for ngram in _ngrams(term)]
+            candidates = min(postings, key=len)
+
+        names = self.names
+        return [
+            idx for idx in candidates
+            if idx < limit and term in names[idx]
+        ]
+
+
+class RangeIndex:
+    """Numeric values of many handles, sorted on demand for range lookups.
+
+    Sorting happens on the first lookup after handles were added
+    or after invalidate() was called, i.e. when values changed.
+    """
+    def __init__(self, value_of, int_handles=False):
+        self._value_of = value_of
+        self.handles = _make_handle_list(int_handles)
+        self._keys = self._sorted = None
+        self._int_handles = int_handles
+
+    def add(self, handle):
+        self.handles.append(handle)
+        self._sorted = None
+
+    def invalidate(self):
+        """Values changed; sort again on the next lookup."""
+        self._sorted = None
+
+    def _sort(self):
+        handles = self.handles[:]
+        values = [self._value_of(handle) for handle in handles]
+        order = sorted(range(len(values)), key=values.__getitem__)
+
+        self._keys = array('d', (values[idx] for idx in order))
+        self._sorted = _make_handle_list(self._int_handles)
+        self._sorted.extend(handles[idx] for idx in order)
+
+    def sorted(self):
+        """Return the values and the handles, both sorted by value.
+        The returned arrays are never modified; sorting again replaces them.
+        """
+        if self._sorted is None:
+            self._sort()
+
+        return self._keys, self._sorted
+
+    def find(self, matches):
+        """Return the set of handles matching one of `matches`.
+        See check_numeric() for the format of `matches`.
+        """
+        return _find_range(*self.sorted(), matches)
+
+
+def _find_range(keys, handles, matches):
+    """Return the set of `handles` whose sorted `keys` match one of `matches`.
+    """
+    result = set()
+    for match in matches:
+        if len(match) == 1:
+            vmin = vmax = match[0]
+        elif len(match) == 2:
+            vmin, vmax = match
+        else:
+            continue
+
+        lo = bisect.bisect_left(keys, vmin)
+        hi = bisect.bisect_right(keys, vmax)
+        result.update(handles[lo:hi])
+
+    return result
+
+
+class SearchIndex:
+    """Index over the nodes of a PathTrie to evaluate Queries quickly.
+
+    Handles are whatever the trie uses to reference its nodes.
+    `value_of(handle, attr)` returns the size, mtime or count of a leaf.
+    Name matches are expanded to leaves by `leaves_below(handle)`
+    at search time.
+    """
+    def __init__(self, value_of, int_handles=False):
+        self.names = NameIndex()
+        self._int_handles = int_handles
+        self._nodes_by_name, self._name_counts = [], array('l')
+        self._ranges = {
+            attr: RangeIndex(
+                lambda handle, attr=attr: value_of(handle, attr), int_handles
+            ) for attr in VALID_ATTRS
+        }
+
+    def add_node(self, handle, name):
+        """Index a node by its (lower-cased) name."""
+        name_id = self.names.add(name.lower())
+        if name_id == len(self._nodes_by_name):
+            self._nodes_by_name.append(_make_handle_list(self._int_handles))
+            self._name_counts.append(0)
+
+        self._nodes_by_name[name_id].append(handle)
+        self._name_counts[name_id] += 1
+
+    def add_leaf(self, handle):
+        """Index a leaf by its size, mtime and count."""
+        for index in self._ranges.values():
+            index.add(handle)
+
+    def invalidate(self, attr=None):
+        """Values of `attr` (or all attributes, if None) have changed."""
+        for name, index in self._ranges.items():
+            if attr is None or name == attr:
+                index.invalidate()
+
+    def generation(self):
+        """Return a SearchGeneration with the current contents of the index.
+
+        Call this while no nodes are added or changed; the generation
+        can then be searched while the index keeps growing.
+        """
+        return SearchGeneration(
+            self.names, self._nodes_by_name, self._name_counts[:],
+            {attr: index.sorted() for attr, index in self._ranges.items()}
+        )
+
+    def search(self, query, leaves_below, cancelled=None, partial=None):
+        """Search the current generation, see SearchGeneration.search()"""
+        return self.generation().search(query, leaves_below, cancelled, partial)
+
+
+class SearchGeneration:
+    """State of a SearchIndex at one point in time.
+
+    The index only ever appends to names and handle lists and replaces
+    the sorted range arrays, so this just remembers how far those went.
+    """
+    def __init__(self, names, nodes_by_name, name_counts, ranges):
+        self._names, self._nodes_by_name = names, nodes_by_name
+        self._name_counts, self._ranges = name_counts, ranges
+
+    def search(self, query, leaves_below, cancelled=None, partial=None):
+        """Return the set of leaf handles matching `query`.
+
+        For use in a separate thread, `cancelled` may be a callable that
+        tells if the result is still needed; None is returned if not.
+        `partial` is called with the matches found so far every now
+        and then, if given.
+        """
+        result = None
+        for attr, matches in (
+                ('size', query.sizes),
+                ('mtime', query.mtimes),
+                ('count', query.amounts)):
+            if not matches:
+                continue
+
+            found = _find_range(*self._ranges[attr], matches)
+            result = found if result is None else result & found
+            if not result:
+                return set()
+
+        if query.name:
+            # Leaves match if the name of any node above them matches:
+            found, last_partial = set(), time.monotonic()
+            name_ids = self._names.find(
+                query.name, limit=len(self._name_counts)
+            )
+
+            for name_id in name_ids:
+                if cancelled is not None and cancelled():
+                    return None
+
+                handles = self._nodes_by_name[name_id]
+                for idx in range(self._name_counts[name_id]):
+                    found.update(leaves_below(handles[idx]))
+
+                now = time.monotonic()
+                if partial and now - last_partial > SEARCH_PARTIAL_INTERVAL:
+                    partial(found if result is None else result & found)
+                    last_partial = now
+
+            result = found if result is None else result & found
+        elif result is None:
+            result = set(self._ranges['size'][1])
+
+        return result
+
+
 def parse_generic_range(value, converter):
     """Parse number collections in the form N[-N[,N[-N]]]...
 
@@ -13,13 +13,19 @@ The settings are described and defined in the settings schema.
 # Stdlib:
 import os
 import re
+import mmap
 import json
+import time
+import queue
 import errno
 import shutil
-import codecs
+import bisect
+import hashlib
 import logging
 import tempfile
+import threading
 
+from array import array
 from enum import Enum
 
 # External:
@@ -31,6 +37,20 @@ from gi.repository import GObject
 LOGGER = logging.getLogger('runner')
 ASCII_COLOR_REGEX = re.compile(r'\x1B\[\d+(.*?)m')
 
+# Number of bytes read from rmlint's stdout at once.
+# The json is split into lines and decoded in a separate thread,
+# the main loop only sees one batch of elements per chunk.
+RUNNER_CHUNK_SIZE = 256 * 1024
+
+# Number of bytes of a script looked at once when indexing or searching.
+SCRIPT_SCAN_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Number of bytes read from a running script's stdout at once.
+SCRIPT_CHUNK_SIZE = 64 * 1024
+
+# Progress of a running script is reported at most every this many ms.
+SCRIPT_PROGRESS_INTERVAL_MS = 100
+
 
 class AlgorithmType(Enum):
     """Key: computation-algorithm"""
@@ -136,83 +156,93 @@ def map_cfg(option, val):
     return option.MAPPING.value.get(val, [])
 
 
-def _create_rmlint_process(
-        cfg, cwd, untagged, tagged, replay_path=None, outputs=None
-):
-    """Create a correctly configured rmlint GSuprocess for gui purposes.
+def _rmlint_cmdline(cfg, untagged, tagged, replay_path=None, outputs=None):
+    """Build the command line of rmlint for the settings in `cfg`.
     If `replay_path` is not None, "--replay `replay_path`" will be appended.
     """
-    try:
-        launcher = Gio.SubprocessLauncher.new(
-            Gio.SubprocessFlags.STDOUT_PIPE | Gio.SubprocessFlags.STDERR_PIPE
+    extra_options = [
+        map_cfg(MatchType,
+                cfg.get_enum('traverse-match')),
+        map_cfg(SymlinkType,
+                cfg.get_enum('general-find-symlinks')),
+        map_cfg(HiddenType,
+                cfg.get_enum('traverse-hidden')),
+        map_cfg(KeepAllType,
+                cfg.get_enum('computation-keep-all-tagged')),
+        map_cfg(MustMatchType,
+                cfg.get_enum('computation-must-match-tagged')),
+        map_cfg(HandlerType,
+                cfg.get_enum('general-handler-type')),
+        map_cfg(HardlinkType,
+                cfg.get_boolean('general-find-hardlinks')),
+        map_cfg(CrossMountType,
+                cfg.get_boolean('traverse-cross-mounts')),
+        map_cfg(AlgorithmType,
+                cfg.get_enum('computation-algorithm'))
+    ]
+
+    # Flatten list:
+    extra_options = [item for sublist in extra_options for item in sublist]
+
+    min_size, max_size = cfg.get_value('traverse-size-limits')
+    extra_options += [
+        '--size', '{a}-{b}'.format(
+            a=min_size,
+            b=max_size
         )
+    ]
 
-        launcher.set_cwd(cwd)
-
-        extra_options = [
-            map_cfg(MatchType,
-                    cfg.get_enum('traverse-match')),
-            map_cfg(SymlinkType,
-                    cfg.get_enum('general-find-symlinks')),
-            map_cfg(HiddenType,
-                    cfg.get_enum('traverse-hidden')),
-            map_cfg(KeepAllType,
-                    cfg.get_enum('computation-keep-all-tagged')),
-            map_cfg(MustMatchType,
-                    cfg.get_enum('computation-must-match-tagged')),
-            map_cfg(HandlerType,
-                    cfg.get_enum('general-handler-type')),
-            map_cfg(HardlinkType,
-                    cfg.get_boolean('general-find-hardlinks')),
-            map_cfg(CrossMountType,
-                    cfg.get_boolean('traverse-cross-mounts')),
-            map_cfg(AlgorithmType,
-                    cfg.get_enum('computation-algorithm'))
-        ]
+    extra_options += [
+        '--max-depth', str(cfg.get_int('traverse-max-depth'))
+    ]
 
-        # Flatten list:
-        extra_options = [item for sublist in extra_options for item in sublist]
+    if replay_path:
+        extra_options += ['--replay', replay_path]
 
-        min_size, max_size = cfg.get_value('traverse-size-limits')
+    if outputs:
+        for output, path in outputs or []:
+            extra_options += [
+                '-o', ':'.join([output, path])
+            ]
+    else:
+        # Default to json parsing.
         extra_options += [
-            '--size', '{a}-{b}'.format(
-                a=min_size,
-                b=max_size
-            )
+            '-o', 'json',
+            '-c', 'json:oneline',
         ]
 
-        extra_options += [
-            '--max-depth', str(cfg.get_int('traverse-max-depth'))
-        ]
+    # Get rid of empty options:
+    extra_options = [opt for opt in extra_options if opt]
 
-        if replay_path:
-            extra_options += ['--replay', replay_path]
+    cmdline = [
+        'rmlint',
+        '--no-with-color',
+        '-T', 'duplicates'
+    ] + extra_options + untagged
 
-        if outputs:
-            for output, path in outputs or []:
-                extra_options += [
-                    '-o', ':'.join([output, path])
-                ]
-        else:
-            # Default to json parsing.
-            extra_options += [
-                '-o', 'json',
-                '-c', 'json:oneline',
-            ]
+    if tagged:
+        cmdline.append('//')
+        cmdline += tagged
+
+    return cmdline
 
-        # Get rid of empty options:
-        extra_options = [opt for opt in extra_options if opt]
 
-        cmdline = [
-            'rmlint',
-            '--no-with-color',
-            '-T', 'duplicates'
-        ] + extra_options + untagged
+def _create_rmlint_process(
+        cfg, cwd, untagged, tagged, replay_path=None, outputs=None
+):
+    """Create a correctly configured rmlint GSuprocess for gui purposes.
+    See _rmlint_cmdline() for the arguments.
+    """
+    try:
+        launcher = Gio.SubprocessLauncher.new(
+            Gio.SubprocessFlags.STDOUT_PIPE | Gio.SubprocessFlags.STDERR_PIPE
+        )
 
-        if tagged:
-            cmdline.append('//')
-            cmdline += tagged
+        launcher.set_cwd(cwd)
 
+        cmdline = _rmlint_cmdline(
+            cfg, untagged, tagged, replay_path=replay_path, outputs=outputs
+        )
         LOGGER.info('Running: ' + ' '.join(cmdline))
         process = launcher.spawnv(cmdline)
     except GLib.Error as err:
@@ -230,7 +260,7 @@ def _create_rmlint_process(
 class Runner(GObject.Object):
     """Wrapper class for a process of rmlint."""
     __gsignals__ = {
-        'lint-added': (GObject.SIGNAL_RUN_FIRST, None, ()),
+        'lints-added': (GObject.SIGNAL_RUN_FIRST, None, (object, )),
         'replay-finished': (GObject.SIGNAL_RUN_FIRST, None, ()),
         'process-finished': (GObject.SIGNAL_RUN_FIRST, None, (str, ))
     }
@@ -242,15 +272,27 @@ class Runner(GObject.Object):
         self.tagged_paths = tagged_paths
         self.untagged_paths = untagged_paths
         self._data_stream = self.process = self._message = None
+        self._chunks = self._parser = None
 
         # Temporary directory for storing formatted files
         self._tmpdir = tempfile.TemporaryDirectory(prefix='shredder-')
 
         # Metadata about the run:
-        self.element, self.header, self.footer = {}, {}, {}
+        self.header, self.footer = {}, {}
         self.objects = []
         self.was_replayed = False
 
+        # When the results were scanned; kept when they are only refreshed.
+        self.scan_time = None
+
+        # path -> index of its json document in self.objects
+        self._path_index = {}
+
+        # Selection of the last replay and the formats generated for it.
+        # The serial changes whenever the replay input is rewritten.
+        self._replay_selection, self._replay_formats = None, set()
+        self._replay_serial = 0
+
     def on_process_termination(self, process, result):
         """Called once GSuprocess sees its child die."""
         # We don't emit process-finished yet here.
@@ -269,73 +311,127 @@ class Runner(GObject.Object):
                 # Nothing concrete to say it seems
                 self._message = err.message
 
-    def on_replay_finish(self, process, result):
-        """Called once rmlint --replay finished running."""
+    def on_replay_finish(self, process, result, serial, formats):
+        """Called once rmlint --replay finished running.
+        `formats` were generated if it succeeded for the current selection.
+        """
         try:
             process.wait_check_finish(result)
             LOGGER.info('`rmlint --replay` finished.')
+            if serial == self._replay_serial:
+                self._replay_formats.update(formats)
         except GLib.Error:
             LOGGER.exception('Replay process failed')
         finally:
             self.emit('replay-finished')
 
     def _queue_read(self):
-        """Schedule an async read on process's stdout"""
+        """Schedule an async read of the next chunk of process's stdout"""
         if self.process is None:
             return
 
-        self._data_stream.read_line_async(
-            io_priority=GLib.PRIORITY_HIGH,
-            cancellable=None,
-            callback=self.on_io_event
+        self._data_stream.read_bytes_async(
+            RUNNER_CHUNK_SIZE,
+            GLib.PRIORITY_HIGH,
+            None,
+            self.on_io_event
         )
 
     def on_io_event(self, source, result):
         """Called on every async io event."""
-        line, _ = source.read_line_finish_utf8(result)
+        try:
+            bytes_ = source.read_bytes_finish(result)
+        except GLib.Error:
+            LOGGER.exception('Could not read from rmlint')
+            bytes_ = None
 
-        # last block of data it seems:
-        if not line:
-            self.emit('process-finished', self._message)
-            self._message = None
-            self.process = None
+        # Hand the chunk to the parser thread; an empty chunk means EOF.
+        if not bytes_ or not bytes_.get_size():
+            self._chunks.put(None)
             return
 
-        line = line.strip(', ')
-        if line in ['[', ']']:
-            self._queue_read()
-            return
+        self._chunks.put(bytes_.get_data())
+        self._queue_read()
 
-        try:
-            json_doc = json.loads(line)
-        except ValueError:
-            LOGGER.exception('Parsing json document failed')
-        else:
+    def _parse_chunks(self, chunks):
+        """Split and decode the json stream. Runs in a separate thread."""
+        rest = b''
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                lines, rest = [rest], b''
+            else:
+                lines = (rest + chunk).split(b'\n')
+                rest = lines.pop()
+
+            batch = []
+            for line in lines:
+                line = line.decode('utf-8', errors='replace').strip(', \n')
+                if not line or line in ['[', ']']:
+                    continue
+
+                try:
+                    batch.append(json.loads(line))
+                except ValueError:
+                    LOGGER.exception('Parsing json document failed')
+
+            # GLib runs idle sources of equal priority in order of addition:
+            if batch:
+                GLib.idle_add(self._on_batch_parsed, batch)
+
+            if chunk is None:
+                GLib.idle_add(self._on_parse_finished)
+                return
+
+    def _on_batch_parsed(self, batch):
+        """Called in the main loop with the json documents of one chunk."""
+        elements = []
+        for idx, json_doc in enumerate(batch, len(self.objects)):
             if 'path' in json_doc:
-                self.element = json_doc
-                self.emit('lint-added')
+                elements.append(json_doc)
+                if json_doc['path'] is not None:
+                    self._path_index[json_doc['path']] = idx
             elif 'description' in json_doc:
                 self.header = json_doc
             elif 'aborted' in json_doc:
                 self.footer = json_doc
 
-            self.objects.append(json_doc)
+        self.objects.extend(batch)
+        if elements:
+            self.emit('lints-added', elements)
 
-        # Schedule another read:
-        self._queue_read()
+        return False
+
+    def _on_parse_finished(self):
+        """Called in the main loop once all output was parsed."""
+        self.emit('process-finished', self._message)
+        self._message = None
+        self.process = None
+        return False
 
-    def run(self):
+    def run(self, replay_path=None):
         """Trigger the run of the rmlint process.
-        Returns: a `Script` instance.
+
+        If `replay_path` is given, the json documents in there are checked
+        again by `rmlint --replay` instead of scanning from scratch.
+        Files that vanished or were modified since are left out.
         """
         self.was_replayed = False
+        if replay_path is None or self.scan_time is None:
+            self.scan_time = time.time()
+
         self.process = _create_rmlint_process(
             self.settings, self._tmpdir.name,
-            self.untagged_paths, self.tagged_paths
+            self.untagged_paths, self.tagged_paths,
+            replay_path=replay_path
         )
-        self._data_stream = Gio.DataInputStream.new(
-            self.process.get_stdout_pipe()
+        self._data_stream = self.process.get_stdout_pipe()
+
+        self._chunks = queue.Queue()
+        self._parser = threading.Thread(
+            target=self._parse_chunks, args=(self._chunks, ), daemon=True
         )
+        self._parser.start()
 
         # We want to get notified once the child dies
         self.process.wait_check_async(None, self.on_process_termination)
@@ -343,6 +439,26 @@ class Runner(GObject.Object):
         # Schedule some reads from stdout (where the json gets written)
         self._queue_read()
 
+    def snapshot_key(self):
+        """Identify the results by the paths and settings they came from."""
+        cmdline = _rmlint_cmdline(
+            self.settings, self.untagged_paths, self.tagged_paths
+        )
+        return hashlib.sha1('\0'.join(cmdline).encode('utf-8')).hexdigest()
+
+    def restore(self, snapshot):
+        """Take over the results of an earlier run from `snapshot`.
+        The runner can be replayed afterwards, without being run.
+        """
+        self.header, self.footer = snapshot.header, snapshot.footer
+        self.objects = snapshot.documents
+        self._path_index = snapshot.path_index()
+        self.scan_time = snapshot.scan_time
+
+    def lint_paths(self):
+        """Return the paths of all lint found by the run."""
+        return self._path_index.keys()
+
     def get_json_path(self):
         """Return /tmp/.../shredder.json if replay() was called in prior."""
         return os.path.join(self._tmpdir.name, 'shredder.json')
@@ -355,58 +471,127 @@ class Runner(GObject.Object):
         """Return /tmp/.../shredder.sh if replay() was called in prior."""
         return os.path.join(self._tmpdir.name, 'shredder.sh')
 
-    def replay(self, allowed_paths=None):
-        """Replay the last run using --replay.
+    def get_replay_path(self):
+        """Return /tmp/.../shredder.replay.json, the input of replay()"""
+        return os.path.join(self._tmpdir.name, 'shredder.replay.json')
 
-        Together with `allowed_paths` this allows easy filtering
-        and re-formatting of the outputted files.
-        `allowed_paths` is a dictionary of paths to booleans (is_original).
-        """
-        # Filter the data points we want in the result.
+    def _get_output_path(self, file_type):
+        """Path of the replayed output in the format `file_type`."""
+        return os.path.join(self._tmpdir.name, 'shredder.' + file_type)
 
-        try:
-            header, *data, footer = self.objects
-        except ValueError:
-            # Not enough values to unpack:
-            LOGGER.exception('Could not replay')
-            return
+    def _write_replay_input(self, allowed_paths):
+        """Write the json documents of `allowed_paths` for --replay.
 
-        self.was_replayed = True
-        results = [header]
+        Documents are looked up by path and written one at a time,
+        in the order rmlint gave them to us.
+        """
+        if allowed_paths is None:
+            indices = sorted(self._path_index.values())
+        else:
+            indices = sorted(
+                self._path_index[path] for path in allowed_paths
+                if path in self._path_index
+            )
 
-        for point in data:
-            path = point['path']
-            if path is None:
-                continue
+        with open(self.get_replay_path(), 'w') as handle:
+            handle.write('[\n')
+            json.dump(self.header, handle)
 
-            if allowed_paths is None or path in allowed_paths:
-                point['is_original'] = allowed_paths[path]
-                results.append(point)
+            for idx in indices:
+                point = self.objects[idx]
+                if allowed_paths is not None:
+                    point['is_original'] = allowed_paths[point['path']]
 
-        results.append(footer)
+                handle.write(',\n')
+                json.dump(point, handle)
 
-        # Write the replay script to filter the input.
-        replay_path = os.path.join(self._tmpdir.name, 'shredder.replay.json')
-        with open(replay_path, 'w') as handle:
-            handle.write(json.dumps(results))
+            handle.write(',\n')
+            json.dump(self.footer, handle)
+            handle.write('\n]\n')
 
-        # Regenerate output formatters by calling rmlint:
-        process = _create_rmlint_process(
+    def _create_replay_process(self, formats):
+        """Let rmlint --replay generate `formats` from the replay input."""
+        return _create_rmlint_process(
             self.settings,
             self._tmpdir.name,
             self.untagged_paths, self.tagged_paths,
-            replay_path=replay_path,
+            replay_path=self.get_replay_path(),
             outputs=[
-                ('sh', self.get_sh_path()),
-                ('csv', self.get_csv_path()),
-                ('json', self.get_json_path())
+                (file_type, self._get_output_path(file_type))
+                for file_type in formats
             ]
         )
-        process.wait_check_async(None, self.on_replay_finish)
+
+    def replay(self, allowed_paths=None, formats=('sh', )):
+        """Replay the last run using --replay.
+
+        Together with `allowed_paths` this allows easy filtering
+        and re-formatting of the outputted files.
+        `allowed_paths` is a dictionary of paths to booleans (is_original).
+
+        Only `formats` are generated; others are generated by save()
+        when needed. Nothing is done if the selection did not change.
+        """
+        if not self.header or not self.footer:
+            LOGGER.error('Could not replay: run did not finish.')
+            return
+
+        selection = None if allowed_paths is None else dict(allowed_paths)
+        if selection != self._replay_selection or not self.was_replayed:
+            self._write_replay_input(selection)
+            self._replay_selection, self._replay_formats = selection, set()
+            self._replay_serial += 1
+
+        self.was_replayed = True
+
+        missing = [fmt for fmt in formats if fmt not in self._replay_formats]
+        if not missing:
+            LOGGER.info('Selection did not change; not replaying.')
+            GLib.idle_add(lambda: self.emit('replay-finished'))
+            return
+
+        # Regenerate output formatters by calling rmlint:
+        process = self._create_replay_process(missing)
+        if process is None:
+            self.emit('replay-finished')
+            return
+
+        process.wait_check_async(
+            None, self.on_replay_finish, self._replay_serial, missing
+        )
+
+    def _ensure_output(self, file_type, callback):
+        """Generate `file_type` for the last replay, if not done yet.
+        `callback(success)` is called once it is there.
+        """
+        if file_type in self._replay_formats:
+            callback(True)
+            return
+
+        process = self._create_replay_process([file_type])
+        if process is None:
+            callback(False)
+            return
+
+        def _on_finish(process, result, serial):
+            try:
+                process.wait_check_finish(result)
+            except GLib.Error:
+                LOGGER.exception('Replay process failed')
+                callback(False)
+                return
+
+            if serial == self._replay_serial:
+                self._replay_formats.add(file_type)
+
+            callback(True)
+
+        process.wait_check_async(None, _on_finish, self._replay_serial)
 
     def save(self, dest_path, file_type='sh'):
         """Save the output to `path`.
-        The script can be converted to a different format if necessary.
+        The script can be converted to a different format if necessary;
+        in this case the file is written once rmlint generated it.
         Valid formats are:
 
             - sh
@@ -427,13 +612,20 @@ class Runner(GObject.Object):
             LOGGER.error('No valid file type `%s`.', file_type)
             return
 
-        try:
-            source_path = source_path_func()
-            shutil.copy(source_path, dest_path)
-            if file_type == "sh":
-                _fix_shell_auto_remove_path(dest_path, source_path)
-        except OSError:
-            LOGGER.exception('Could not save')
+        def _copy(success):
+            if not success:
+                LOGGER.error('Could not generate `%s` output.', file_type)
+                return
+
+            try:
+                source_path = source_path_func()
+                shutil.copy(source_path, dest_path)
+                if file_type == "sh":
+                    _fix_shell_auto_remove_path(dest_path, source_path)
+            except OSError:
+                LOGGER.exception('Could not save')
+
+        self._ensure_output(file_type, _copy)
 
 
 def _fix_shell_auto_remove_path(sh_path, temp_path):
@@ -453,20 +645,254 @@ def _strip_ascii_colors(text):
     return ASCII_COLOR_REGEX.sub('', text)
 
 
+def _lower(text):
+    """Lower case `text`, keeping the position of every character."""
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+
+    # A few characters (like the turkish İ) grow when lowered:
+    return ''.join(
+        char if len(char.lower()) != 1 else char.lower() for char in text
+    )
+
+
+class ScriptMap:
+    """Memory mapped, line indexed view on a (possibly huge) script.
+
+    The offsets of the lines are found by a background thread;
+    `n_lines` grows until `is_indexed` is True.
+    Only requested lines are decoded and stripped from colors.
+    """
+    def __init__(self, path):
+        self.offsets = array('q', [0])
+        self.is_indexed = self._is_closed = False
+
+        # Number of threads reading the map; it is only closed
+        # once the indexer and all searches are done with it.
+        self._n_users, self._users_lock = 0, threading.Lock()
+
+        with open(path, 'rb') as handle:
+            self.size = os.fstat(handle.fileno()).st_size
+            if self.size:
+                self._map = mmap.mmap(
+                    handle.fileno(), 0, access=mmap.ACCESS_READ
+                )
+            else:
+                self._map = b''
+
+        self._acquire()
+        self._indexer = threading.Thread(target=self._index, daemon=True)
+        self._indexer.start()
+
+    def _acquire(self):
+        """Mark the map as used; False if it was closed already."""
+        with self._users_lock:
+            if self._is_closed:
+                return False
+
+            self._n_users += 1
+            return True
+
+    def _release(self):
+        """Counterpart to _acquire(); closes the map if it is unused."""
+        with self._users_lock:
+            self._n_users -= 1
+            self._close_if_unused()
+
+    def _close_if_unused(self):
+        """Close the map once close() was called and nobody reads it."""
+        if self._is_closed and not self._n_users and self.size:
+            self._map.close()
+
+    def _index(self):
+        """Find the start offsets of all lines. Runs in a separate thread."""
+        try:
+            self._index_lines()
+        finally:
+            self._release()
+
+    def _index_lines(self):
+        offsets, data = self.offsets, self._map
+        for start in range(0, self.size, SCRIPT_SCAN_CHUNK_SIZE):
+            if self._is_closed:
+                return
+
+            end = min(start + SCRIPT_SCAN_CHUNK_SIZE, self.size)
+            pos = data.find(b'\n', start, end)
+            while pos >= 0:
+                offsets.append(pos + 1)
+                pos = data.find(b'\n', pos + 1, end)
+
+        # The last line might not end with a newline:
+        if offsets[-1] != self.size:
+            offsets.append(self.size)
+
+        self.is_indexed = True
+
+    @property
+    def n_lines(self):
+        """Number of lines indexed so far."""
+        return len(self.offsets) - 1
+
+    def lines(self, start, stop):
+        """Return the lines [start, stop) as string without colors."""
+        stop = min(stop, self.n_lines)
+        if start >= stop:
+            return ''
+
+        data = self._map[self.offsets[start]:self.offsets[stop]]
+        return _strip_ascii_colors(data.decode('utf-8', errors='ignore'))
+
+    def is_line_indexed(self, offset):
+        """Check if the line containing the byte at `offset` was indexed."""
+        return self.is_indexed or offset < self.offsets[-1]
+
+    def line_of(self, offset):
+        """Index of the line containing the byte at `offset`."""
+        return max(0, bisect.bisect_right(self.offsets, offset) - 1)
+
+    def column_of(self, offset):
+        """Position of the byte at `offset` in its line, as shown by lines()
+        """
+        line_start = self.offsets[self.line_of(offset)]
+        prefix = self._map[line_start:offset].decode('utf-8', errors='ignore')
+        return len(_strip_ascii_colors(prefix))
+
+    def _line_end(self, offset):
+        """Offset right after the line containing the byte at `offset`."""
+        pos = self._map.find(b'\n', offset)
+        return self.size if pos < 0 else pos + 1
+
+    def _offset_of(self, line_start, column):
+        """Byte offset of the shown `column` in the line at `line_start`.
+
+        Inverse of column_of(); the line is decoded the same way
+        as in find(), so the offset can be mapped back to bytes exactly.
+        """
+        line = self._map[line_start:self._line_end(line_start)]
+        text = line.decode('utf-8', errors='surrogateescape')
+
+        # Skip over the color codes in front of the column:
+        pos = column
+        for match in ASCII_COLOR_REGEX.finditer(text):
+            if match.start() > pos:
+                break
+            pos += match.end() - match.start()
+
+        prefix = text[:pos].encode('utf-8', errors='surrogateescape')
+        return line_start + len(prefix)
+
+    def find(self, query, start=0, cancelled=None):
+        """Find `query` in the shown text from byte offset `start` on.
+
+        The text is searched like lines() returns it: without colors
+        and ignoring the case. It is looked at in chunks of whole lines;
+        if `cancelled` returns True in between, the search stops.
+        Returns the byte offset of the match or -1.
+        """
+        needle = _lower(query)
+        if not needle or not self._acquire():
+            return -1
+
+        try:
+            return self._find(needle, start, cancelled)
+        finally:
+            self._release()
+
+    def _find(self, needle, start, cancelled):
+        # Matches never span lines, so chunks of whole lines
+        # can be searched one after the other without overlap.
+        pos = self._map.rfind(b'\n', 0, start) + 1
+        while pos < self.size:
+            if self._is_closed or (cancelled is not None and cancelled()):
+                return -1
+
+            end = self._line_end(min(pos + SCRIPT_SCAN_CHUNK_SIZE, self.size))
+            data = self._map[pos:end]
+            text = _lower(_strip_ascii_colors(
+                data.decode('utf-8', errors='surrogateescape')
+            ))
+
+            idx, line_start, line_idx = text.find(needle), pos, 0
+            while idx >= 0:
+                # Go to the start of the line containing the match:
+                column_start = text.rfind('\n', 0, idx) + 1
+                while line_idx < column_start:
+                    line_idx = text.index('\n', line_idx) + 1
+                    line_start = data.index(b'\n', line_start - pos) + pos + 1
+
+                offset = self._offset_of(line_start, idx - column_start)
+                if offset >= start:
+                    return offset
+
+                idx = text.find(needle, idx + 1)
+
+            pos = end
+
+        return -1
+
+    def close(self):
+        """Stop indexing; the map is released once nobody uses it anymore."""
+        with self._users_lock:
+            self._is_closed = True
+            self._close_if_unused()
+
+
+class ScriptProgress:
+    """Summary of the lines a running script printed so far."""
+    __slots__ = ['counts', 'size', 'prefix', 'path']
+
+    def __init__(self):
+        # prefix -> number of lines, summed up size of the mentioned paths
+        # (except for kept ones) and the last line that was not kept.
+        self.counts, self.size = {}, 0
+        self.prefix = self.path = ''
+
+    def copy(self):
+        progress = ScriptProgress()
+        progress.counts = dict(self.counts)
+        progress.size, progress.prefix, progress.path = \
+            self.size, self.prefix, self.path
+        return progress
+
+    @property
+    def n_handled(self):
+        """Number of paths that were not kept."""
+        return sum(
+            count for prefix, count in self.counts.items()
+            if prefix.lower() != 'keeping'
+        )
+
+    def add(self, prefix, path, size):
+        """Account a single line of the script's output."""
+        self.counts[prefix] = self.counts.get(prefix, 0) + 1
+        if prefix.lower() == 'keeping':
+            return
+
+        self.size += size
+        self.prefix, self.path = prefix, path
+
+
 class Script(GObject.Object):
     """Wrapper around the shell script generated by an rmlint run.
     `run()` will execute the script (either dry or for real)
     """
     __gsignals__ = {
-        'line-read': (GObject.SIGNAL_RUN_FIRST, None, (str, str)),
+        'progress': (GObject.SIGNAL_RUN_FIRST, None, (object, )),
         'script-finished': (GObject.SIGNAL_RUN_FIRST, None, ())
     }
 
     def __init__(self, script_file):
         GObject.Object.__init__(self)
-        self._incomplete_chunk = self._process = self._stream = None
+        self._process = self._chunks = None
         self.script_file = script_file
 
+        # Guards the progress, which is updated by the parser thread:
+        self._lock = threading.Lock()
+        self._progress, self._progress_changed = ScriptProgress(), False
+        self._is_finished = False
+
     @staticmethod
     def create_dummy():
         """Create an empty dummy script for testing purpose"""
@@ -476,26 +902,19 @@ class Script(GObject.Object):
 
         return Script(path)
 
-    def read(self):
-        """Read the script from disk and return it as string.
-        """
-        # Do not reuse the file descriptor, since it is only valid once.
-        # Be a bit careful, since the script might contain weird encoding,
-        # since there is no path encoding guaranteed in Unix usually:
-        opts = dict(encoding='utf-8', errors='ignore')
-        with codecs.open(self.script_file, 'r', **opts) as handle:
-            return _strip_ascii_colors(handle.read())
+    def map(self):
+        """Return a ScriptMap of the script, for reading it line by line."""
+        return ScriptMap(self.script_file)
 
     def read_bytes(self):
-        """Same as read() but do not not attempt conversion to string.
-        Return raw bytes instead.
-        """
+        """Read the script from disk and return it as raw bytes."""
         with open(self.script_file, 'rb') as handle:
             return handle.read()
 
     def run(self, dry_run=True):
         """Run the script.
-        Will trigger a `line-read` signal for each line it processed
+        Will trigger a `progress` signal with a ScriptProgress every
+        SCRIPT_PROGRESS_INTERVAL_MS while new lines were processed
         and one `script-finished` signal once all lines are done.
         """
         flags = Gio.SubprocessFlags
@@ -504,52 +923,112 @@ class Script(GObject.Object):
             [self.script_file, '-d', '-x', '-q', '-p', '-n' if dry_run else ''],
             flags.STDERR_SILENCE | flags.STDOUT_PIPE
         )
-        self._stream = None
+
+        with self._lock:
+            self._progress, self._progress_changed = ScriptProgress(), False
+            self._is_finished = False
+
+        self._chunks = queue.Queue()
+        threading.Thread(
+            target=self._parse_chunks, args=(self._chunks, ), daemon=True
+        ).start()
+
+        GLib.timeout_add(SCRIPT_PROGRESS_INTERVAL_MS, self._report_progress)
         self._queue_read()
 
     def _queue_read(self):
-        """Schedule a read from rmlint's stdout stream."""
-        if self._stream is None:
-            self._stream = Gio.DataInputStream.new(
-                self._process.get_stdout_pipe()
-            )
-
-        self._stream.read_line_async(
-            io_priority=GLib.PRIORITY_HIGH,
-            cancellable=None,
-            callback=self._read_chunk
+        """Schedule a read from the script's stdout stream."""
+        self._process.get_stdout_pipe().read_bytes_async(
+            SCRIPT_CHUNK_SIZE,
+            GLib.PRIORITY_HIGH,
+            None,
+            self._read_chunk
         )
 
-    def _report_line(self, line):
-        """Postprocess and signal the receival of a single line."""
-        if not line or line.strip().startswith("#"):
+    def _read_chunk(self, source, result):
+        """Called once a new chunk of output is ready."""
+        try:
+            bytes_ = source.read_bytes_finish(result)
+        except GLib.Error:
+            LOGGER.exception('Could not read from script:')
+            bytes_ = None
+
+        # Hand the chunk to the parser thread; an empty chunk means EOF.
+        if not bytes_ or not bytes_.get_size():
+            self._chunks.put(None)
             return
 
+        self._chunks.put(bytes_.get_data())
+        self._queue_read()
+
+    @staticmethod
+    def _parse_line(line):
+        """Split a line of output into prefix, path and the size of path.
+        Returns None for lines that do not mention a path.
+        """
+        if not line or line.strip().startswith("#"):
+            return None
+
         line_split = line.split(':', maxsplit=1)
         if len(line_split) < 2:
             LOGGER.warning('Invalid line fed: ' + line)
-            return
+            return None
 
         prefix, path = line_split
-        prefix = _strip_ascii_colors(prefix)
-        path = _strip_ascii_colors(path)
+        prefix = _strip_ascii_colors(prefix).strip()
+        path = _strip_ascii_colors(path).strip()
 
-        self.emit('line-read', prefix.strip(), path.strip())
+        size = 0
+        if prefix.lower() != 'keeping':
+            try:
+                size = os.stat(path).st_size
+            except OSError:
+                pass
 
-    def _read_chunk(self, source, result):
-        """Called once a new line is ready to be read."""
-        try:
-            line, _ = source.read_line_finish_utf8(result)
-        except GLib.Error:
-            LOGGER.exception('Could not read line from script:')
-            self.emit('script-finished')
-            return
+        return prefix, path, size
 
-        if line:
-            self._report_line(line)
-            self._queue_read()
-        else:
+    def _parse_chunks(self, chunks):
+        """Split and account the script's output. Runs in a separate thread.
+        """
+        rest = b''
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                lines, rest = [rest], b''
+            else:
+                lines = (rest + chunk).split(b'\n')
+                rest = lines.pop()
+
+            parsed = [
+                self._parse_line(line.decode('utf-8', errors='replace'))
+                for line in lines
+            ]
+
+            with self._lock:
+                for line in parsed:
+                    if line is not None:
+                        self._progress.add(*line)
+                        self._progress_changed = True
+
+                if chunk is None:
+                    self._is_finished = True
+                    return
+
+    def _report_progress(self):
+        """Hand out the progress made since the last call."""
+        with self._lock:
+            progress = self._progress.copy()
+            changed, finished = self._progress_changed, self._is_finished
+            self._progress_changed = False
+
+        if changed:
+            self.emit('progress', progress)
+
+        if finished:
             self.emit('script-finished')
+            return False
+
+        return True
 
 
 if __name__ == '__main__':
@@ -559,7 +1038,10 @@ if __name__ == '__main__':
         loop = GLib.MainLoop()
 
         runner = Runner(settings, ['/usr/'], [])
-        runner.connect('lint-added', lambda _: print(runner.element))
+        runner.connect(
+            'lints-added',
+            lambda _, elements: [print(elem) for elem in elements]
+        )
         runner.connect(
             'process-finished',
             lambda _, msg: print('Status:', msg)
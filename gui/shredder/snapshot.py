@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Persistent snapshots of finished runs.
+
+A snapshot stores everything needed to show the results of a run again
+without running rmlint: header and footer, the json documents of all lint
+and the CompactPathTrie built from them, including rows and checksum groups.
+Snapshots are keyed by the paths and settings of the run (see
+Runner.snapshot_key()) and live in the user's cache directory.
+
+On disk, a snapshot is a small json table of contents followed by binary
+sections: typed arrays, NUL separated strings and the raw json documents.
+It is read via mmap; arrays are copied out, documents are decoded on demand.
+"""
+
+# Stdlib:
+import os
+import json
+import mmap
+import time
+import struct
+import logging
+import tempfile
+import threading
+
+from array import array
+
+# External:
+from gi.repository import GLib
+
+# Internal:
+from shredder.tree import CompactPathTrie, Column
+
+
+LOGGER = logging.getLogger('snapshot')
+
+SNAPSHOT_MAGIC = b'SHREDSNP'
+SNAPSHOT_VERSION = 2
+
+# magic, version, length of the table of contents:
+SNAPSHOT_HEADER = struct.Struct('<8sII')
+
+# Results older than this many seconds are scanned again instead.
+# --replay only drops lint that vanished; it does not find new lint.
+SNAPSHOT_MAX_AGE = 24 * 60 * 60
+
+# Keep only this many snapshots around, the least recently written go first.
+SNAPSHOT_MAX_COUNT = 8
+
+
+def snapshot_dir_path():
+    return os.path.join(
+        GLib.get_user_cache_dir(),
+        "shredder",
+        "snapshots"
+    )
+
+
+def snapshot_file_path(key):
+    return os.path.join(snapshot_dir_path(), key + ".snapshot")
+
+
+def _stat_roots(paths):
+    """Remember the root paths, so changes to them can be noticed."""
+    roots = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+
+        roots[path] = [stat.st_dev, stat.st_ino, stat.st_mtime]
+
+    return roots
+
+
+def _encode_strings(strings):
+    return b'\0'.join(
+        string.encode('utf-8', 'surrogatepass') for string in strings
+    )
+
+
+def _decode_strings(data, count):
+    if not count:
+        return []
+
+    return [
+        string.decode('utf-8', 'surrogatepass')
+        for string in data.split(b'\0')
+    ]
+
+
+class SnapshotDocuments:
+    """Read-only, list-like view on the json documents of a snapshot.
+
+    Documents are decoded on every access; callers may modify the result.
+    """
+    def __init__(self, buffer, start, offsets):
+        # Offsets of the documents are relative to `start`:
+        self._buffer, self._start, self._offsets = buffer, start, offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, idx):
+        return json.loads(self.raw(idx).decode('utf-8'))
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def raw(self, idx):
+        """Return the encoded json of the document at `idx`."""
+        return self._buffer[
+            self._start + self._offsets[idx]:
+            self._start + self._offsets[idx + 1]
+        ]
+
+
+class Snapshot:
+    """A snapshot, read back from disk.
+
+    Raises OSError or ValueError if the file is missing or unusable.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as handle:
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, toc_length = SNAPSHOT_HEADER.unpack_from(self._map)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError('Not a snapshot or an old version')
+
+        self._data_offset = SNAPSHOT_HEADER.size + toc_length
+        toc = json.loads(
+            self._map[SNAPSHOT_HEADER.size:self._data_offset].decode('utf-8')
+        )
+
+        self.path = path
+        self.key, self.scan_time = toc['key'], toc['scan_time']
+        self.root_paths, self.roots = toc['root_paths'], toc['roots']
+        self.header, self.footer = toc['header'], toc['footer']
+        self._sections = toc['sections']
+
+        self.documents = SnapshotDocuments(
+            self._map, self._start('documents'),
+            self._array('document_offsets')
+        )
+
+    def _start(self, name):
+        return self._data_offset + self._sections[name]['offset']
+
+    def _bytes(self, name):
+        start = self._start(name)
+        return self._map[start:start + self._sections[name]['length']]
+
+    def _array(self, name):
+        section = self._sections[name]
+        values = array(section['typecode'])
+        if values.itemsize != section['itemsize']:
+            raise ValueError('Snapshot was written on another platform')
+
+        values.frombytes(self._bytes(name))
+        return values
+
+    def _strings(self, name):
+        count = self._sections[name]['count']
+        return _decode_strings(self._bytes(name), count)
+
+    def _section(self, name):
+        if self._sections[name]['kind'] == 'strings':
+            return self._strings(name)
+
+        return self._array(name)
+
+    def is_outdated(self):
+        """Check if the snapshot is too old or its root paths changed."""
+        if time.time() - self.scan_time > SNAPSHOT_MAX_AGE:
+            return True
+
+        return _stat_roots(self.root_paths) != self.roots
+
+    def load_trie(self):
+        """Create the CompactPathTrie of the snapshot."""
+        return CompactPathTrie.load(
+            self.root_paths,
+            {
+                name: self._section(name) for name in self._sections
+                if not name.startswith('document')
+            }
+        )
+
+    def path_index(self):
+        """Map the path of each document to its index."""
+        return {
+            path: idx
+            for idx, path in enumerate(self._strings('document_paths'))
+            if path
+        }
+
+    def write_replay_input(self, path):
+        """Write all documents as input for `rmlint --replay` to `path`."""
+        with open(path, 'wb') as handle:
+            handle.write(b'[\n')
+            handle.write(json.dumps(self.header).encode('utf-8'))
+            for idx in range(len(self.documents)):
+                handle.write(b',\n')
+                handle.write(self.documents.raw(idx))
+
+            handle.write(b',\n')
+            handle.write(json.dumps(self.footer).encode('utf-8'))
+            handle.write(b'\n]\n')
+
+
+def find_snapshot(key):
+    """Return the up-to-date Snapshot stored under `key` or None."""
+    try:
+        snapshot = Snapshot(snapshot_file_path(key))
+    except OSError as exc:
+        LOGGER.debug("No snapshot: {}".format(exc))
+        return None
+    except (ValueError, KeyError, struct.error):
+        LOGGER.exception("Failed to read snapshot")
+        return None
+
+    if snapshot.key != key or snapshot.is_outdated():
+        LOGGER.info("Snapshot is outdated; scanning again.")
+        return None
+
+    return snapshot
+
+
+def _build_sections(root_paths, documents):
+    """Build the trie of `documents` and return the sections to write."""
+    trie = CompactPathTrie(root_paths)
+    lints, paths = [], []
+
+    for doc in documents:
+        lints.append(json.dumps(doc).encode('utf-8'))
+        paths.append(doc['path'] or '')
+        if doc['path'] is not None:
+            trie.insert(doc['path'], Column.make_row(doc))
+
+    trie.flush()
+
+    offsets = array('q', [0])
+    for lint in lints:
+        offsets.append(offsets[-1] + len(lint))
+
+    sections = trie.dump()
+    sections['documents'] = b''.join(lints)
+    sections['document_offsets'] = offsets
+    sections['document_paths'] = paths
+    return sections
+
+
+def write_snapshot(key, scan_time, root_paths, header, footer, documents):
+    """Write the results of a run as snapshot stored under `key`.
+    `documents` are the json documents of all lint, without header and footer.
+    """
+    toc, chunks, offset = {}, [], 0
+    for name, section in _build_sections(root_paths, documents).items():
+        if isinstance(section, array):
+            data = section.tobytes()
+            toc[name] = {
+                'kind': 'array',
+                'typecode': section.typecode,
+                'itemsize': section.itemsize
+            }
+        elif isinstance(section, bytes):
+            data = section
+            toc[name] = {'kind': 'bytes'}
+        else:
+            data = _encode_strings(section)
+            toc[name] = {'kind': 'strings', 'count': len(section)}
+
+        toc[name].update(offset=offset, length=len(data))
+
+        # Keep sections aligned, just in case:
+        padding = b'\0' * (-len(data) % 8)
+        chunks += [data, padding]
+        offset += len(data) + len(padding)
+
+    toc_data = json.dumps({
+        'key': key,
+        'scan_time': scan_time,
+        'root_paths': root_paths,
+        'roots': _stat_roots(root_paths),
+        'header': header,
+        'footer': footer,
+        'sections': toc
+    }).encode('utf-8')
+
+    dir_path = snapshot_dir_path()
+    os.makedirs(dir_path, mode=0o700, exist_ok=True)
+
+    # Write to a temporary file first, so readers never see half of it:
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path, suffix='.tmp')
+    try:
+        with open(fd, 'wb') as handle:
+            handle.write(SNAPSHOT_HEADER.pack(
+                SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(toc_data)
+            ))
+            handle.write(toc_data)
+            for chunk in chunks:
+                handle.write(chunk)
+
+        os.replace(tmp_path, snapshot_file_path(key))
+    except OSError:
+        os.unlink(tmp_path)
+        raise
+
+    _prune_snapshots(dir_path)
+
+
+def _prune_snapshots(dir_path):
+    """Remove the oldest snapshots, keeping SNAPSHOT_MAX_COUNT."""
+    paths = [
+        os.path.join(dir_path, name) for name in os.listdir(dir_path)
+        if name.endswith('.snapshot')
+    ]
+
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for path in paths[SNAPSHOT_MAX_COUNT:]:
+        os.unlink(path)
+
+
+def save_snapshot(runner):
+    """Write a snapshot of the finished `runner` in a separate thread."""
+    if not runner.header or not runner.footer:
+        return
+
+    if runner.footer.get('aborted'):
+        LOGGER.info("Run was aborted; not writing a snapshot.")
+        return
+
+    args = (
+        runner.snapshot_key(),
+        runner.scan_time,
+        runner.untagged_paths + runner.tagged_paths,
+        runner.header,
+        runner.footer,
+        [doc for doc in runner.objects if 'path' in doc]
+    )
+
+    def _write():
+        try:
+            write_snapshot(*args)
+        except OSError:
+            LOGGER.exception("Failed to write snapshot")
+        else:
+            LOGGER.info("Wrote snapshot %s.", args[0])
+
+    threading.Thread(target=_write, daemon=True).start()
@@ -18,8 +18,12 @@ If you don't find it, that's good. If you do, blame @sahib.
 # Stdlib:
 import os
 import time
+import queue
+import weakref
 import logging
+import threading
 
+from array import array
 from collections import OrderedDict, defaultdict, deque
 
 # External:
@@ -36,7 +40,7 @@ from shredder.util import CellRendererCount
 from shredder.util import CellRendererLint
 from shredder.util import PopupMenu, NodeState
 
-from shredder.query import Query
+from shredder.query import Query, SearchIndex
 
 
 LOGGER = logging.getLogger('tree')
@@ -47,15 +51,26 @@ LOGGER = logging.getLogger('tree')
 # not come from our own model and may be invalid.
 PATH_MODEL_STAMP = 0xDEAD
 
-# Process at max work items before letting the
-# mainloop run for a short time. This is to prevent
-# lagging in the user interface.
-# This does not speed up the operation itself of course.
-PATH_MODEL_CHUNK_SIZE = 500
+# Paths are inserted into the trie by a background thread.
+# The main loop only announces the new rows to GTK, for at most
+# this much ms at a time. This is to prevent lagging in the user interface.
+PATH_MODEL_FRAME_BUDGET_MS = 10
 
-# Wait this much ms before processing the next chunk.
+# Wait this much ms before announcing the next batch of rows.
 PATH_MODEL_TIMEOUT_MS = 50
 
+# Stop the insertion thread after it was idle for this many seconds.
+PATH_MODEL_IDLE_TIMEOUT = 1.0
+
+# Missing mtimes are read by at most this many threads.
+STAT_SERVICE_WORKERS = 4
+
+# Number of paths whose mtime is remembered by the StatService.
+STAT_SERVICE_CACHE_SIZE = 65536
+
+# Collect stat results for this many ms before handing them out.
+STAT_SERVICE_BATCH_MS = 100
+
 
 class Column:
     """Column Enumeration to avoid using direct indices.
@@ -99,7 +114,7 @@ class PathNode:
         'name', 'parent', 'children', 'row',
 
         # Private:
-        'is_leaf', 'idx', 'indices', 'depth'
+        'is_leaf', 'idx', 'indices', 'depth', 'iter_path'
     ]
 
     def __init__(self, name, parent, metadata=None, children=None):
@@ -114,9 +129,15 @@ class PathNode:
         # Private:
         self.indices = deque()
         self.idx = 0
+        self.iter_path = None
         self.is_leaf = False
         self.depth = (parent.depth + 1) if parent else 0
 
+    @property
+    def key(self):
+        """Unique, non-zero id of this node, usable as GtkTreeIter data."""
+        return id(self)
+
     def __getitem__(self, idx):
         """Get a column value by its column index.
 
@@ -129,47 +150,60 @@ class PathNode:
         else:
             return self.row[idx]
 
-    def append(self, name):
+    def append(self, name, visible=True):
         """Append a node as child of this node.
 
-        If is_leaf is True the size/count of all intermediate
-        non-leaf nodes above are updated.
+        If visible is False, the node can be found by its name,
+        but is not part of `indices` until reveal() is called on it.
         """
         node = PathNode(name, self)
-        node.idx = len(self.indices)
-
         self.children[name] = node
-        self.indices.append(node)
+        if visible:
+            node.reveal()
 
         return node
 
+    def reveal(self):
+        """Make this node visible as last one in the indices of its parent."""
+        self.idx = len(self.parent.indices)
+        self.iter_path = None
+        self.parent.indices.append(self)
+
     def make_leaf(self, row):
         """Convert the node to a leaf node.
 
-        Metadata will be copied to the node and intermediate
-        directories above will be updated with count & size.
+        Metadata will be copied to the node. Count & size of the
+        intermediate directories above are updated by PathTrie.flush().
         """
         self.is_leaf = True
         self.row = row
 
-        # Update intermediate directories top of it:
-        for parent in (node for node in self.up() if not node.is_leaf):
-            parent.row[Column.COUNT] += 1
-            parent.row[Column.SIZE] += row[Column.SIZE]
-
     def up(self):
         """Iterate the trie up to root."""
-        yield self
-        if self.parent is not None:
-            yield from self.parent.up()
+        node = self
+        while node is not None:
+            yield node
+            node = node.parent
 
     def build_path(self):
         """Recursively build the absolute path of this node"""
         return os.path.join(*reversed([n.name for n in self.up()]))
 
     def build_iter_path(self):
-        """Recursively build an iter path suitable for GtkTreePath"""
-        return list(reversed([n.idx for n in self.up()]))
+        """Build an iter path suitable for GtkTreePath.
+        The paths of directories are cached until the next sort.
+        """
+        if self.iter_path is not None:
+            return self.iter_path
+
+        path = (self.idx, )
+        if self.parent is not None:
+            path = self.parent.build_iter_path() + path
+
+        if not self.is_leaf:
+            self.iter_path = path
+
+        return path
 
     def neighbor(self, offset):
         """Get the neighbor of this node by a certain offset"""
@@ -204,38 +238,137 @@ def _lookup_root_path_index(index, components):
         if curr_map is None:
             return None
 
-        if isinstance(curr_map, PathNode):
+        if not isinstance(curr_map, dict):
             del components[:idx + 1]
             return curr_map
 
     return None
 
 
+class GroupIndex:
+    """Members and aggregate stats of the checksum groups of a trie.
+
+    Checksums are interned to integer group ids, by `intern_checksum` if
+    given. Total size, number of members and reclaimable size (of members
+    tagged as duplicate) are updated on insert and on tag changes,
+    so they can be looked up without iterating over the members.
+    """
+    def __init__(self, intern_checksum=None, int_handles=False):
+        self._int_handles = int_handles
+        self._ids = {}
+        self.intern = intern_checksum or self._intern
+
+        # group id -> handles of the members and their stats:
+        self.members = {}
+        self.sizes, self.counts = array('d'), array('q')
+        self.reclaimable = array('d')
+
+    def _intern(self, cksum, add=True):
+        """Return the group id of `cksum`. See RowStore.intern_checksum()"""
+        group_id = self._ids.get(cksum)
+        if group_id is None and add:
+            group_id = self._ids[cksum] = len(self._ids)
+
+        return group_id
+
+    def add(self, group_id, handle, size, tag):
+        """Add the leaf `handle` with `size` and `tag` to a group."""
+        members = self.members.get(group_id)
+        if members is None:
+            members = self.members[group_id] = \
+                array('l') if self._int_handles else []
+
+            missing = group_id + 1 - len(self.sizes)
+            if missing > 0:
+                for stats in (self.sizes, self.counts, self.reclaimable):
+                    stats.extend([0] * missing)
+
+        members.append(handle)
+        self.sizes[group_id] += size
+        self.counts[group_id] += 1
+        if tag == NodeState.DUPLICATE:
+            self.reclaimable[group_id] += size
+
+    def retag(self, group_id, size, old_tag, new_tag):
+        """A member of `size` was tagged `new_tag` instead of `old_tag`."""
+        was_dupe = old_tag == NodeState.DUPLICATE
+        is_dupe = new_tag == NodeState.DUPLICATE
+        if was_dupe != is_dupe and group_id in self.members:
+            self.reclaimable[group_id] += size if is_dupe else -size
+
+    def get(self, cksum):
+        """Handles of the members of the group of `cksum`."""
+        group_id = self.intern(cksum, add=False)
+        return self.members.get(group_id, ())
+
+    def stats(self, cksum):
+        """Return (size, count, reclaimable size) of the group of `cksum`
+        or None if there is no such group.
+        """
+        group_id = self.intern(cksum, add=False)
+        if group_id not in self.members:
+            return None
+
+        return (
+            self.sizes[group_id],
+            self.counts[group_id],
+            self.reclaimable[group_id]
+        )
+
+
 class PathTrie(GObject.Object):
     """Python version of rmlint's pathtricia trie."""
     __gsignals__ = {
         'node-updated': (GObject.SIGNAL_RUN_FIRST, None, (GObject.TYPE_UINT64, ))
     }
 
-    def __init__(self, root_paths=None):
+    def __init__(self, root_paths=None, **kwargs):
         GObject.Object.__init__(self)
 
-        self.root = PathNode('/', None, {})
+        self.paths = list(root_paths or [])
+        self._init_storage(**kwargs)
+
+        # (column_id, reverse) of the last sort and the nodes
+        # whose children are already sorted that way:
+        self._sort_spec, self._sorted = None, set()
+
+        self.root = self._create_root()
         self.sub_roots = []
-        self.nodes = {id(self.root): self.root}
         self.max_depth = 0
 
         self.root_paths = {}
-        for root_path in root_paths or []:
+        for root_path in self.paths:
             # Append the sub root node manually:
             sub_root_node = self.root.append(root_path.strip('/'))
-            self.nodes[id(sub_root_node)] = sub_root_node
+            self._register(sub_root_node)
             self.sub_roots.append(sub_root_node)
 
             # Also add it to the "special" index.
             _create_root_path_index(self.root_paths, root_path, sub_root_node)
 
-        self._groups = defaultdict(list)
+    def _init_storage(self):
+        """Set up the node storage of this trie."""
+        self.nodes = {}
+        self.group_index = GroupIndex()
+        self._deltas = {}
+        self.search_index = SearchIndex(self._search_value)
+
+    def _create_root(self):
+        """Create the root node."""
+        root = PathNode('/', None, {})
+        self._register(root)
+        return root
+
+    def _register(self, node):
+        """Make `node` findable by its key and by search()."""
+        self.nodes[node.key] = node
+        self.search_index.add_node(node, node.name)
+
+    def derive(self):
+        """Create an empty trie with the same root paths and backend.
+        Rows inserted from this trie into the derived one are shared.
+        """
+        return PathTrie(self.paths)
 
     def __iter__(self):
         return self.iterate(None)
@@ -256,6 +389,7 @@ class PathTrie(GObject.Object):
 
     def __setitem__(self, path, value):
         self.insert(path, value)
+        self.flush()
 
     def iterate(self, node=None):
         """Iterate trie down from node.
@@ -268,20 +402,39 @@ class PathTrie(GObject.Object):
             yield from self.iterate(child)
 
     def lookup_node_id(self, node_id):
-        """Lookup a node by its id."""
+        """Lookup a node by its key."""
         return self.nodes.get(node_id)
 
     def update_node(self, node, column_id, value):
         """Update a PathNode *and* emit a node-updated signal."""
+        if column_id == Column.TAG and node.is_leaf:
+            self.group_index.retag(
+                self.group_index.intern(node[Column.CKSUM], add=False),
+                node[Column.SIZE], node[Column.TAG], value
+            )
+
         node.row[column_id] = value
-        self.emit('node-updated', id(node))
+        self.emit('node-updated', node.key)
 
     def group(self, cksum):
         """Get a list of nodes that have the same checksum."""
-        return self._groups.get(cksum, [])
+        return [
+            self._node_of(handle) for handle in self.group_index.get(cksum)
+        ]
+
+    def group_stats(self, cksum):
+        """(size, count, reclaimable size) of the nodes with `cksum`.
+        See GroupIndex.stats()
+        """
+        return self.group_index.stats(cksum)
+
+    def insert(self, path, row, visible=True):
+        """Insert a path into the trie, with metadata in `row`
 
-    def insert(self, path, row):
-        """Insert a path into the trie, with metadata in `row`"""
+        If visible is False, newly created nodes need to be revealed later,
+        in the order they are returned. The directories above the new leaf
+        show its size and count only after the next flush().
+        """
         components = [comp for comp in path.split('/') if comp]
         curr = _lookup_root_path_index(
             self.root_paths,
@@ -292,8 +445,8 @@ class PathTrie(GObject.Object):
         for idx, name in enumerate(components):
             node = curr.children.get(name)
             if node is None:
-                node = curr.append(name)
-                self.nodes[id(node)] = node
+                node = curr.append(name, visible)
+                self._register(node)
                 new_nodes.append((node, True))
             else:
                 new_nodes.append((node, False))
@@ -301,15 +454,127 @@ class PathTrie(GObject.Object):
             curr = node
 
         curr.make_leaf(row)
+        self._add_delta(curr.parent, row[Column.SIZE])
+        self.search_index.add_leaf(curr)
 
-        self._groups[row[Column.CKSUM]].append(curr)
+        self.group_index.add(
+            self.group_index.intern(row[Column.CKSUM]), curr,
+            row[Column.SIZE], row[Column.TAG]
+        )
         self.max_depth = max(self.max_depth, curr.depth)
         return new_nodes
 
+    def _add_delta(self, handle, size):
+        """Remember a new leaf of `size` below the node `handle`."""
+        delta = self._deltas.get(handle)
+        if delta is None:
+            delta = self._deltas[handle] = [0, 0]
+
+        delta[0] += 1
+        delta[1] += size
+
+    def _handle_depth(self, node):
+        return node.depth
+
+    def _apply_delta(self, node, count, size):
+        """Add count and size to `node`, unless it's a leaf.
+        Returns the parent to pass the delta to next.
+        """
+        if not node.is_leaf:
+            node.row[Column.COUNT] += count
+            node.row[Column.SIZE] += size
+
+        return node.parent
+
+    def flush(self):
+        """Update count & size of all directories above leaves inserted since
+        the last flush. This goes bottom-up, level by level; leaves below
+        the same directory are merged, so each directory is visited once.
+        """
+        levels = defaultdict(dict)
+        for handle, delta in self._deltas.items():
+            levels[self._handle_depth(handle)][handle] = delta
+
+        self._deltas = {}
+
+        depth = max(levels, default=-1)
+        while depth >= 0:
+            for handle, (count, size) in levels.pop(depth, {}).items():
+                parent = self._apply_delta(handle, count, size)
+                if parent is None:
+                    continue
+
+                delta = levels[depth - 1].get(parent)
+                if delta is None:
+                    delta = levels[depth - 1][parent] = [0, 0]
+
+                delta[0] += count
+                delta[1] += size
+
+            depth -= 1
+
+    def _search_value(self, node, attr):
+        """Value of a leaf for the search attribute `attr`."""
+        if attr == 'size':
+            return node[Column.SIZE]
+        elif attr == 'mtime':
+            return node[Column.MTIME]
+
+        return -node[Column.COUNT]
+
+    def _leaves_below(self, node):
+        """Iterate over all visible leaves below and including `node`."""
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.is_leaf:
+                yield node
+
+            stack.extend(node.indices)
+
+    def _node_of(self, handle):
+        """Convert a handle of the search index to a node."""
+        return handle
+
+    def search(self, query, ordered=True, cancelled=None, partial=None,
+               generation=None):
+        """Return all leaves matching the Query `query`.
+
+        If `ordered` is True, the leaves are returned in tree order.
+        This uses cached iter paths, so do not use it outside the main loop.
+        See SearchGeneration.search() for `cancelled` and `partial`.
+        `generation` is searched instead of the current search index,
+        if given (see SearchIndex.generation()).
+        """
+        def _to_nodes(handles):
+            return [self._node_of(handle) for handle in handles]
+
+        if generation is None:
+            generation = self.search_index.generation()
+
+        handles = generation.search(
+            query, self._leaves_below, cancelled,
+            partial and (lambda handles: partial(_to_nodes(handles)))
+        )
+
+        if handles is None:
+            return None
+
+        nodes = _to_nodes(handles)
+        if ordered:
+            nodes.sort(key=lambda node: node.build_iter_path())
+
+        return nodes
+
     def find(self, path):
         """Find a PathNode in the trie by its path"""
-        curr = self.root
-        for name in (comp for comp in path.split('/') if comp):
+        # Sub roots might span several path components:
+        components = [comp for comp in path.split('/') if comp]
+        curr = _lookup_root_path_index(
+            self.root_paths,
+            components) or self.root
+
+        for name in components:
             curr = curr.children.get(name)
             if curr is None:
                 return None
@@ -334,35 +599,79 @@ class PathTrie(GObject.Object):
 
         return curr
 
-    def sort(self, column_id, reverse=False, root=None):
+    def sort(self, column_id, reverse=False, root=None, expanded=None):
         """Sort the trie nodes by their value in at `column_id`.
         If reverse is True, bigger values appear first.
 
-        This implementation is a generator that yields
-        each visited node after sorting and a mapping from
-        the new position to their old position
+        This implementation is a generator that yields each node whose
+        children were reordered and a mapping from the new position of
+        the children to their old position.
+
+        If given, only the children of nodes for which `expanded(node)`
+        is True are sorted right away. The others are sorted by
+        sort_children() once they get shown.
         """
-        # Do the actual sorting:
-        root = root or self.root
-        children = deque(root.children.values())
-
-        root.indices = sorted(
-            children,
-            key=lambda node: node[column_id],
-            reverse=reverse
-        )
+        self._sort_spec, self._sorted = (column_id, reverse), set()
+        self._reset_iter_paths(None)
+
+        stack = [root or self.root]
+        while stack:
+            node = stack.pop()
+            if not node.indices:
+                continue
 
-        # Remember what changed:
-        old_indices = []
-        for idx, child in enumerate(root.indices):
-            old_indices.append(child.idx)
+            if expanded is not None and not expanded(node):
+                continue
+
+            old_indices = self.sort_children(node)
+            if old_indices is not None:
+                yield node, old_indices
+
+            stack.extend(reversed(node.indices))
+
+    def sort_children(self, node):
+        """Sort the children of `node` if sort() deferred it.
+
+        Returns a mapping from new to old positions,
+        or None if nothing was moved.
+        """
+        if self._sort_spec is None or node.key in self._sorted:
+            return None
+
+        self._sorted.add(node.key)
+        old_indices = self._sort_level(node, *self._sort_spec)
+        if old_indices is not None:
+            self._reset_iter_paths(node)
+
+        return old_indices
+
+    def _sort_level(self, node, column_id, reverse):
+        """Sort the children of `node`. See sort_children()"""
+        children = node.indices
+        keys = [child[column_id] for child in children]
+        order = _sort_order(keys, reverse)
+        if order is None:
+            return None
+
+        node.indices = [children[idx] for idx in order]
+        for idx, child in enumerate(node.indices):
             child.idx = idx
 
-        yield root, old_indices
+        return order
+
+    def _reset_iter_paths(self, node):
+        """Forget the cached iter paths below `node` (all if None)."""
+        if node is None:
+            for node in self.nodes.values():
+                node.iter_path = None
+            return
 
-        # Propagate to children:
-        for child in children:
-            yield from self.sort(column_id, reverse, child)
+        stack = list(node.indices)
+        while stack:
+            node = stack.pop()
+            if not node.is_leaf:
+                node.iter_path = None
+                stack.extend(node.indices)
 
     def has_leaves(self):
         """Check if this trie has any leaf nodes.
@@ -376,14 +685,1006 @@ class PathTrie(GObject.Object):
         return False
 
 
+class RowStore:
+    """Rows of many nodes, stored column-wise in typed arrays.
+
+    A row is referenced by its index, wrapped in a RowView.
+    Checksums are interned, since all files of a group share one.
+    """
+    def __init__(self):
+        # Same order as the first columns of Column:
+        self.columns = [array('d'), array('q'), array('d'), array('b')]
+        self.cksum_ids = array('l')
+        self.checksums, self._checksum_ids = [], {}
+
+    def __len__(self):
+        return len(self.cksum_ids)
+
+    def intern_checksum(self, cksum, add=True):
+        """Return the id of `cksum`, adding it if necessary and `add` is True.
+        Returns None for an unknown checksum otherwise.
+        """
+        cksum_id = self._checksum_ids.get(cksum)
+        if cksum_id is None and add:
+            cksum_id = self._checksum_ids[cksum] = len(self.checksums)
+            self.checksums.append(cksum)
+
+        return cksum_id
+
+    def add(self, row):
+        """Copy `row` (a list or a RowView) and return its index."""
+        for column_id, column in enumerate(self.columns):
+            column.append(row[column_id])
+
+        self.cksum_ids.append(self.intern_checksum(row[Column.CKSUM]))
+        return len(self) - 1
+
+    def get(self, row_id, column_id):
+        """Get the value of `column_id` in the row `row_id`."""
+        if column_id == Column.CKSUM:
+            return self.checksums[self.cksum_ids[row_id]]
+
+        return self.columns[column_id][row_id]
+
+    def set(self, row_id, column_id, value):
+        """Set the value of `column_id` in the row `row_id`."""
+        if column_id == Column.CKSUM:
+            self.cksum_ids[row_id] = self.intern_checksum(value)
+        else:
+            self.columns[column_id][row_id] = value
+
+    def dump(self):
+        """Return the store as dict of section names to arrays or lists."""
+        sections = {
+            'row_column_{}'.format(column_id): column
+            for column_id, column in enumerate(self.columns)
+        }
+        sections['row_cksum_ids'] = self.cksum_ids
+        sections['row_checksums'] = self.checksums
+        return sections
+
+    @staticmethod
+    def load(sections):
+        """Create a RowStore from the sections returned by dump()."""
+        store = RowStore()
+        store.columns = [
+            sections['row_column_{}'.format(column_id)]
+            for column_id in range(len(store.columns))
+        ]
+        store.cksum_ids = sections['row_cksum_ids']
+        store.checksums = sections['row_checksums']
+        store._checksum_ids = {
+            cksum: cksum_id for cksum_id, cksum in enumerate(store.checksums)
+        }
+        return store
+
+
+class RowView:
+    """List-like access to a single row of a RowStore."""
+    __slots__ = ['store', 'row_id']
+
+    def __init__(self, store, row_id):
+        self.store, self.row_id = store, row_id
+
+    def __getitem__(self, column_id):
+        return self.store.get(self.row_id, column_id)
+
+    def __setitem__(self, column_id, value):
+        self.store.set(self.row_id, column_id, value)
+
+    def __len__(self):
+        return Column.CKSUM + 1
+
+    @property
+    def key(self):
+        """Same for all views on the same row."""
+        return (id(self.store), self.row_id)
+
+
+def row_key(row):
+    """Hashable identity of a row, which might be a list or a RowView."""
+    return row.key if isinstance(row, RowView) else id(row)
+
+
+class _CompactChildren:
+    """Read-only, dict-like view on the children of a CompactNode."""
+    __slots__ = ['trie', 'index']
+
+    def __init__(self, trie, index):
+        self.trie, self.index = trie, index
+
+    def __len__(self):
+        return self.trie.n_children[self.index]
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def get(self, name, default=None):
+        child = self.trie.find_child(self.index, name)
+        if child < 0:
+            return default
+
+        return CompactNode(self.trie, child)
+
+
+class _CompactIndices:
+    """Read-only, list-like view on the visible children of a CompactNode."""
+    __slots__ = ['trie', 'index']
+
+    def __init__(self, trie, index):
+        self.trie, self.index = trie, index
+
+    def _children(self):
+        return self.trie.child_lists.get(self.index, ())
+
+    def __len__(self):
+        return len(self._children())
+
+    def __getitem__(self, idx):
+        return CompactNode(self.trie, self._children()[idx])
+
+    def __iter__(self):
+        for child in self._children():
+            yield CompactNode(self.trie, child)
+
+
+class CompactNode:
+    """PathNode interface to a single node of a CompactPathTrie.
+
+    Instances are created on demand and only reference the node,
+    so they have to be compared by == instead of `is`.
+    """
+    __slots__ = ['trie', 'index']
+
+    def __init__(self, trie, index):
+        self.trie, self.index = trie, index
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, CompactNode) and
+            other.trie is self.trie and
+            other.index == self.index
+        )
+
+    def __hash__(self):
+        return hash(self.index)
+
+    @property
+    def key(self):
+        """Unique, non-zero id of this node, usable as GtkTreeIter data."""
+        return self.index + 1
+
+    @property
+    def name(self):
+        return self.trie.names[self.trie.name_of[self.index]]
+
+    @property
+    def parent(self):
+        parent = self.trie.parent_of[self.index]
+        return None if parent < 0 else CompactNode(self.trie, parent)
+
+    @property
+    def children(self):
+        return _CompactChildren(self.trie, self.index)
+
+    @property
+    def indices(self):
+        return _CompactIndices(self.trie, self.index)
+
+    @property
+    def row(self):
+        return RowView(self.trie.rows, self.trie.row_of[self.index])
+
+    @property
+    def is_leaf(self):
+        return bool(self.trie.is_leaf[self.index])
+
+    @property
+    def idx(self):
+        return self.trie.idx_of[self.index]
+
+    @property
+    def depth(self):
+        return self.trie.depth_of[self.index]
+
+    def __getitem__(self, idx):
+        """Get a column value by its column index."""
+        if idx is Column.PATH:
+            return self.name
+        elif idx is Column.TOOLTIP:
+            return GLib.markup_escape_text(self.build_path(), -1)
+        else:
+            return self.trie.rows.get(self.trie.row_of[self.index], idx)
+
+    def append(self, name, visible=True):
+        """Append a node as child of this node. See PathNode.append()"""
+        child = self.trie.add_node(
+            self.index, name, self.trie.rows.add(Column.make_row({})), visible
+        )
+        return CompactNode(self.trie, child)
+
+    def reveal(self):
+        """Make this node visible as last one in the indices of its parent."""
+        self.trie.reveal(self.index)
+
+    def make_leaf(self, row):
+        """Convert the node to a leaf node. See PathNode.make_leaf()"""
+        self.trie.make_leaf(self.index, self.trie.row_id(row))
+
+    def build_iter_path(self):
+        """Build an iter path suitable for GtkTreePath."""
+        return self.trie.iter_path(self.index)
+
+    up = PathNode.up
+    build_path = PathNode.build_path
+    neighbor = PathNode.neighbor
+
+
+# Arrays of a CompactPathTrie, as returned by dump():
+COMPACT_TRIE_ARRAYS = [
+    'name_of', 'parent_of', 'idx_of', 'depth_of',
+    'row_of', 'n_children', 'is_leaf'
+]
+
+
+class CompactPathTrie(PathTrie):
+    """PathTrie that stores its nodes in parallel arrays.
+
+    Nodes are indices into these arrays; names and checksums are interned
+    and rows live in a RowStore that can be shared with derived tries.
+    CompactNode provides the PathNode interface on top of it, so the
+    trie can be used in place of a PathTrie, at a fraction of the memory.
+    """
+    def _init_storage(self, rows=None):
+        self.rows = rows if rows is not None else RowStore()
+        self.names, self._name_ids = [], {}
+
+        self.name_of, self.parent_of = array('l'), array('l')
+        self.idx_of, self.depth_of = array('l'), array('l')
+        self.row_of, self.n_children = array('l'), array('l')
+        self.is_leaf = array('b')
+
+        # (parent << 32 | name id) -> child and parent -> visible children:
+        self._child_map, self.child_lists = {}, {}
+        self.group_index = GroupIndex(
+            self.rows.intern_checksum, int_handles=True
+        )
+        self._deltas = {}
+
+        # Cached iter paths of directories, until the next sort:
+        self._iter_paths = {}
+        self.search_index = SearchIndex(self._search_value, int_handles=True)
+
+    def _create_root(self):
+        self.add_node(-1, '/', self.rows.add(Column.make_row({})))
+        return CompactNode(self, 0)
+
+    def _register(self, node):
+        pass
+
+    def derive(self):
+        return CompactPathTrie(self.paths, rows=self.rows)
+
+    def __len__(self):
+        return len(self.parent_of)
+
+    def row_id(self, row):
+        """Index of `row` in our RowStore; added if it is not in there yet."""
+        if isinstance(row, RowView) and row.store is self.rows:
+            return row.row_id
+
+        return self.rows.add(row)
+
+    def find_child(self, parent, name):
+        """Index of the child `name` of `parent` or -1"""
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            return -1
+
+        return self._child_map.get((parent << 32) | name_id, -1)
+
+    def add_node(self, parent, name, row_id, visible=True):
+        """Add a new node below `parent` and return its index."""
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = self._name_ids[name] = len(self.names)
+            self.names.append(name)
+
+        index = len(self.parent_of)
+        self.search_index.add_node(index, name)
+        self.name_of.append(name_id)
+        self.parent_of.append(parent)
+        self.idx_of.append(0)
+        self.depth_of.append(self.depth_of[parent] + 1 if parent >= 0 else 0)
+        self.row_of.append(row_id)
+        self.n_children.append(0)
+        self.is_leaf.append(0)
+
+        if parent >= 0:
+            self._child_map[(parent << 32) | name_id] = index
+            self.n_children[parent] += 1
+            if visible:
+                self.reveal(index)
+
+        return index
+
+    def reveal(self, index):
+        """Append node `index` to the visible children of its parent."""
+        parent = self.parent_of[index]
+        children = self.child_lists.get(parent)
+        if children is None:
+            children = self.child_lists[parent] = array('l')
+
+        self.idx_of[index] = len(children)
+        self._iter_paths.pop(index, None)
+        children.append(index)
+
+    def iter_path(self, index):
+        """Iter path of node `index`. See PathNode.build_iter_path()"""
+        path = self._iter_paths.get(index)
+        if path is not None:
+            return path
+
+        path = (self.idx_of[index], )
+        parent = self.parent_of[index]
+        if parent >= 0:
+            path = self.iter_path(parent) + path
+
+        if not self.is_leaf[index]:
+            self._iter_paths[index] = path
+
+        return path
+
+    def make_leaf(self, index, row_id):
+        """Convert the node to a leaf node. See PathNode.make_leaf()"""
+        self.is_leaf[index] = 1
+        self.row_of[index] = row_id
+        self._iter_paths.pop(index, None)
+
+        if self.parent_of[index] >= 0:
+            self._add_delta(
+                self.parent_of[index], self.rows.columns[Column.SIZE][row_id]
+            )
+
+    def _handle_depth(self, index):
+        return self.depth_of[index]
+
+    def _apply_delta(self, index, count, size):
+        if not self.is_leaf[index]:
+            row_id = self.row_of[index]
+            self.rows.columns[Column.COUNT][row_id] += count
+            self.rows.columns[Column.SIZE][row_id] += size
+
+        parent = self.parent_of[index]
+        return parent if parent >= 0 else None
+
+    def _search_value(self, index, attr):
+        row_id = self.row_of[index]
+        if attr == 'size':
+            return self.rows.get(row_id, Column.SIZE)
+        elif attr == 'mtime':
+            return self.rows.get(row_id, Column.MTIME)
+
+        return -self.rows.get(row_id, Column.COUNT)
+
+    def _leaves_below(self, index):
+        stack = [index]
+        while stack:
+            index = stack.pop()
+            if self.is_leaf[index]:
+                yield index
+
+            stack.extend(self.child_lists.get(index, ()))
+
+    def _node_of(self, handle):
+        return CompactNode(self, handle)
+
+    def lookup_node_id(self, node_id):
+        if 0 < node_id <= len(self.parent_of):
+            return CompactNode(self, node_id - 1)
+
+        return None
+
+    def insert(self, path, row, visible=True):
+        components = [comp for comp in path.split('/') if comp]
+        start = _lookup_root_path_index(self.root_paths, components)
+        curr = start.index if start is not None else 0
+
+        row_id = self.row_id(row)
+        new_nodes = [(curr, False)]
+
+        for idx, name in enumerate(components):
+            node = self.find_child(curr, name)
+            if node < 0:
+                if idx == len(components) - 1:
+                    node_row_id = row_id
+                else:
+                    node_row_id = self.rows.add(Column.make_row({}))
+
+                node = self.add_node(curr, name, node_row_id, visible)
+                new_nodes.append((node, True))
+            else:
+                new_nodes.append((node, False))
+
+            curr = node
+
+        self.make_leaf(curr, row_id)
+        self.search_index.add_leaf(curr)
+
+        rows = self.rows
+        self.group_index.add(
+            rows.cksum_ids[row_id], curr,
+            rows.columns[Column.SIZE][row_id], rows.columns[Column.TAG][row_id]
+        )
+        self.max_depth = max(self.max_depth, self.depth_of[curr])
+        return [(CompactNode(self, idx), new) for idx, new in new_nodes]
+
+    def _sort_level(self, node, column_id, reverse):
+        children = self.child_lists.get(node.index)
+        if not children:
+            return None
+
+        # Look the keys up in the arrays directly:
+        row_of = self.row_of
+        if column_id == Column.PATH:
+            names, name_of = self.names, self.name_of
+            keys = [names[name_of[child]] for child in children]
+        elif column_id < len(self.rows.columns):
+            column = self.rows.columns[column_id]
+            keys = [column[row_of[child]] for child in children]
+        else:
+            keys = [self.rows.get(row_of[child], column_id)
+                    for child in children]
+
+        order = _sort_order(keys, reverse)
+        if order is None:
+            return None
+
+        children = array('l', (children[idx] for idx in order))
+        self.child_lists[node.index] = children
+        for idx, child in enumerate(children):
+            self.idx_of[child] = idx
+
+        return order
+
+    def _reset_iter_paths(self, node):
+        self._iter_paths.clear()
+
+    def dump(self):
+        """Return the trie as dict of section names to arrays or lists.
+        Together with the root paths, load() turns it into a trie again.
+        Insertions must be flushed and revealed beforehand.
+        """
+        sections = self.rows.dump()
+        for name in COMPACT_TRIE_ARRAYS:
+            sections[name] = getattr(self, name)
+
+        sections['names'] = self.names
+
+        # Visible children and groups, each concatenated into one array:
+        groups = self.group_index
+        for name, lists in (
+                ('children', self.child_lists), ('groups', groups.members)):
+            keys, starts, members = array('l'), array('l'), array('l')
+            for key, items in lists.items():
+                keys.append(key)
+                starts.append(len(members))
+                members.extend(items)
+
+            starts.append(len(members))
+            sections[name + '_keys'] = keys
+            sections[name + '_starts'] = starts
+            sections[name] = members
+
+        sections['group_sizes'] = groups.sizes
+        sections['group_counts'] = groups.counts
+        sections['group_reclaimable'] = groups.reclaimable
+        return sections
+
+    @staticmethod
+    def load(paths, sections):
+        """Create a trie from the sections returned by dump().
+        `paths` must be the root paths of the dumped trie.
+        """
+        # Root and sub roots are created like before, with the same indices:
+        trie = CompactPathTrie(paths)
+        trie.rows = RowStore.load(sections)
+        for name in COMPACT_TRIE_ARRAYS:
+            setattr(trie, name, sections[name])
+
+        names = trie.names = sections['names']
+        trie._name_ids = {name: name_id for name_id, name in enumerate(names)}
+        trie._child_map = {
+            (parent << 32) | name_id: index
+            for index, (parent, name_id) in enumerate(
+                zip(trie.parent_of, trie.name_of)
+            ) if parent >= 0
+        }
+
+        groups = trie.group_index = GroupIndex(
+            trie.rows.intern_checksum, int_handles=True
+        )
+        groups.sizes = sections['group_sizes']
+        groups.counts = sections['group_counts']
+        groups.reclaimable = sections['group_reclaimable']
+
+        for name, lists in (
+                ('children', trie.child_lists), ('groups', groups.members)):
+            lists.clear()
+            members, starts = sections[name], sections[name + '_starts']
+            for idx, key in enumerate(sections[name + '_keys']):
+                lists[key] = members[starts[idx]:starts[idx + 1]]
+
+        trie.search_index = SearchIndex(trie._search_value, int_handles=True)
+        for index, name_id in enumerate(trie.name_of):
+            trie.search_index.add_node(index, names[name_id])
+
+        for index, is_leaf in enumerate(trie.is_leaf):
+            if is_leaf:
+                trie.search_index.add_leaf(index)
+                trie.max_depth = max(trie.max_depth, trie.depth_of[index])
+
+        return trie
+
+
+def _sort_order(keys, reverse):
+    """Positions of `keys` in sorted order or None if already sorted."""
+    order = sorted(range(len(keys)), key=keys.__getitem__, reverse=reverse)
+    for idx, old_idx in enumerate(order):
+        if idx != old_idx:
+            return order
+
+    return None
+
+
+class _FilteredIndices:
+    """Read-only, list-like view on the visible children of a FilteredNode.
+    Wrappers are only created for the children that are asked for.
+    """
+    __slots__ = ['view', 'children']
+
+    def __init__(self, view, children):
+        self.view, self.children = view, children
+
+    def __len__(self):
+        return len(self.children)
+
+    def __getitem__(self, idx):
+        return FilteredNode(self.view, self.children[idx])
+
+    def __iter__(self):
+        for child in self.children:
+            yield FilteredNode(self.view, child)
+
+
+class FilteredNode:
+    """PathNode interface to a node of a FilteredTrie.
+
+    Rows are the ones of the wrapped node, but indices, position and the
+    size & count of directories only take visible nodes into account.
+    """
+    __slots__ = ['view', 'node']
+
+    def __init__(self, view, node):
+        self.view, self.node = view, node
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, FilteredNode) and
+            other.view is self.view and
+            other.node == self.node
+        )
+
+    def __hash__(self):
+        return hash(self.node)
+
+    @property
+    def key(self):
+        return self.node.key
+
+    @property
+    def name(self):
+        return self.node.name
+
+    @property
+    def row(self):
+        return self.node.row
+
+    @property
+    def is_leaf(self):
+        return self.node.is_leaf
+
+    @property
+    def depth(self):
+        return self.node.depth
+
+    @property
+    def parent(self):
+        parent = self.node.parent
+        return None if parent is None else FilteredNode(self.view, parent)
+
+    @property
+    def indices(self):
+        return _FilteredIndices(self.view, self.view.children_of(self.node))
+
+    # Only used for checking if there are any:
+    children = indices
+
+    @property
+    def idx(self):
+        return self.view.idx_of(self.node)
+
+    def neighbor(self, offset):
+        """Get the neighbor of this node by a certain offset"""
+        parent = self.node.parent
+        if parent is None:
+            return None
+
+        siblings = self.view.children_of(parent)
+        neighbor_idx = self.view.idx_of(self.node) + offset
+        if 0 <= neighbor_idx < len(siblings):
+            return FilteredNode(self.view, siblings[neighbor_idx])
+
+        return None
+
+    def __getitem__(self, idx):
+        """Get a column value by its column index."""
+        if not self.node.is_leaf:
+            if idx is Column.SIZE:
+                return self.view.aggregate(self.node)[0]
+            elif idx is Column.COUNT:
+                return self.view.aggregate(self.node)[1]
+
+        return self.node[idx]
+
+    def build_path(self):
+        return self.node.build_path()
+
+    def build_iter_path(self):
+        """Build an iter path suitable for GtkTreePath."""
+        return tuple(reversed([node.idx for node in self.up()]))
+
+    up = PathNode.up
+
+
+class FilteredTrie:
+    """Read-only view on some leaves of a trie and the directories above.
+
+    Nothing is copied: Visible nodes are remembered by their key;
+    the visible children, positions and sizes of a directory are
+    computed when they are first asked for.
+    """
+    def __init__(self, trie, leaves):
+        self.trie = trie
+        self.paths = trie.paths
+        self.max_depth = trie.max_depth
+        self.n_leaves = len(leaves)
+
+        # Visibility set: mark all leaves and their parents.
+        self._visible = {trie.root.key}
+        for leaf in leaves:
+            for node in leaf.up():
+                if node.key in self._visible:
+                    break
+
+                self._visible.add(node.key)
+
+        self._children, self._indices, self._aggregates = {}, {}, {}
+        self._sort_column, self._sort_reverse = None, False
+
+        self.root = FilteredNode(self, trie.root)
+        self.sub_roots = [
+            FilteredNode(self, node) for node in trie.sub_roots
+            if node.key in self._visible
+        ]
+
+    def __iter__(self):
+        return self.iterate(None)
+
+    def __len__(self):
+        return len(self._visible)
+
+    def is_visible(self, node):
+        """Check if a node of the underlying trie is visible."""
+        return node.key in self._visible
+
+    @property
+    def search_index(self):
+        """Search index of the underlying trie."""
+        return self.trie.search_index
+
+    def children_of(self, node):
+        """Visible children of the underlying `node`, in display order."""
+        children = self._children.get(node.key)
+        if children is None:
+            children = [
+                child for child in node.indices
+                if child.key in self._visible
+            ]
+
+            if self._sort_column is not None:
+                children.sort(
+                    key=lambda child: FilteredNode(self, child)[
+                        self._sort_column
+                    ],
+                    reverse=self._sort_reverse
+                )
+
+            self._children[node.key] = children
+            for idx, child in enumerate(children):
+                self._indices[child.key] = idx
+
+        return children
+
+    def idx_of(self, node):
+        """Position of the underlying `node` among the visible siblings."""
+        if node.parent is None:
+            return 0
+
+        idx = self._indices.get(node.key)
+        if idx is None:
+            self.children_of(node.parent)
+            idx = self._indices[node.key]
+
+        return idx
+
+    def aggregate(self, node):
+        """(size, count) of all visible leaves below the underlying `node`"""
+        result = self._aggregates.get(node.key)
+        if result is not None:
+            return result
+
+        size, count = 0, 0
+        for child in self.children_of(node):
+            if child.is_leaf:
+                size += child[Column.SIZE]
+                count += 1
+
+            child_size, child_count = self.aggregate(child)
+            size += child_size
+            count += child_count
+
+        result = self._aggregates[node.key] = (size, count)
+        return result
+
+    def iterate(self, node=None):
+        """Iterate the visible nodes down from node (root if None)."""
+        node = node or self.root
+        yield node
+
+        for child in node.indices:
+            yield from self.iterate(child)
+
+    def lookup_node_id(self, node_id):
+        if node_id not in self._visible:
+            return None
+
+        node = self.trie.lookup_node_id(node_id)
+        return None if node is None else FilteredNode(self, node)
+
+    def update_node(self, node, column_id, value):
+        """Update the underlying node; all models of the trie get notified"""
+        if isinstance(node, FilteredNode):
+            node = node.node
+
+        self.trie.update_node(node, column_id, value)
+
+    def connect(self, signal, callback, *args):
+        """Connect to a signal of the underlying trie.
+
+        The callback gets this view instead of the trie and is only
+        weakly referenced, so a discarded view is not kept alive.
+        """
+        try:
+            callback_ref = weakref.WeakMethod(callback)
+        except TypeError:
+            # Not a bound method; keep a strong reference.
+            callback_ref = lambda: callback
+        self_ref = weakref.ref(self)
+
+        def _forward(trie, *rest):
+            view, func = self_ref(), callback_ref()
+            if view is None or func is None:
+                trie.disconnect(handler_id)
+                return
+
+            func(view, *rest)
+
+        handler_id = self.trie.connect(signal, _forward, *args)
+        return handler_id
+
+    def disconnect(self, handler_id):
+        """Disconnect a handler returned by connect()."""
+        self.trie.disconnect(handler_id)
+
+    def group(self, cksum):
+        return [
+            FilteredNode(self, node) for node in self.trie.group(cksum)
+            if node.key in self._visible
+        ]
+
+    def group_stats(self, cksum):
+        """Stats of the whole group, including invisible members."""
+        return self.trie.group_stats(cksum)
+
+    def has_leaves(self):
+        return self.n_leaves > 0
+
+    def derive(self):
+        return self.trie.derive()
+
+    def flush(self):
+        pass
+
+    def resolve(self, iter_path):
+        """See PathTrie.resolve()"""
+        curr = self.root
+        for idx in iter_path[1:]:
+            curr = curr.indices[idx]
+
+        return curr
+
+    def find(self, path):
+        node = self.trie.find(path)
+        if node is None or node.key not in self._visible:
+            return None
+
+        return FilteredNode(self, node)
+
+    def sort(self, column_id, reverse=False, root=None, expanded=None):
+        """Sort the visible children of the directories shown so far.
+        Others get sorted when they are computed. See PathTrie.sort()
+        """
+        self._sort_column, self._sort_reverse = column_id, reverse
+
+        # Parents need to be reordered before their children:
+        parents = sorted(
+            (self.trie.lookup_node_id(key) for key in self._children),
+            key=lambda node: node.depth
+        )
+
+        for parent in parents:
+            children = self._children.get(parent.key)
+            if children is None:
+                continue
+
+            view_parent = FilteredNode(self, parent)
+            if expanded is not None and not expanded(view_parent):
+                # Not shown; compute it again when asked for.
+                del self._children[parent.key]
+                for child in children:
+                    self._indices.pop(child.key, None)
+                continue
+
+            keys = [FilteredNode(self, child)[column_id] for child in children]
+            order = _sort_order(keys, reverse)
+            if order is None:
+                continue
+
+            children = [children[idx] for idx in order]
+            self._children[parent.key] = children
+            for idx, child in enumerate(children):
+                self._indices[child.key] = idx
+
+            yield view_parent, order
+
+    def sort_children(self, node):
+        """Children are sorted when computed, see children_of()"""
+        return None
+
+
+class StatService:
+    """Read the mtime of paths in a few background threads.
+
+    Results are cached by path (dropping the least recently used ones)
+    and handed to the callbacks in batches on the main loop, so that
+    slow filesystems (e.g. network mounts) never block the user interface.
+    """
+    def __init__(
+            self,
+            max_workers=STAT_SERVICE_WORKERS,
+            cache_size=STAT_SERVICE_CACHE_SIZE):
+        self._max_workers, self._cache_size = max_workers, cache_size
+
+        # path -> mtime or None if the path could not be stat'd.
+        self._cache = OrderedDict()
+        self._pending, self._results = deque(), []
+        self._n_workers, self._flush_timeout_id = 0, None
+        self._cond = threading.Condition()
+
+    def request(self, path, callback, data):
+        """Read the mtime of `path` in the background.
+
+        `callback` is later called on the main loop with a list of
+        (data, mtime) tuples; mtime is None if stat failed.
+        """
+        with self._cond:
+            if path in self._cache:
+                self._cache.move_to_end(path)
+                self._add_result(callback, data, self._cache[path])
+                return
+
+            self._pending.append((path, callback, data))
+            if self._n_workers < self._max_workers:
+                self._n_workers += 1
+                threading.Thread(target=self._work, daemon=True).start()
+            else:
+                self._cond.notify()
+
+    def _work(self):
+        """Worker thread: stat pending paths until idle for a while."""
+        while True:
+            with self._cond:
+                if not self._pending:
+                    self._cond.wait(PATH_MODEL_IDLE_TIMEOUT)
+
+                if not self._pending:
+                    self._n_workers -= 1
+                    return
+
+                path, callback, data = self._pending.popleft()
+
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError as err:
+                LOGGER.debug('stat: %s', str(err))
+                mtime = None
+
+            with self._cond:
+                self._cache[path] = mtime
+                while len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+
+                self._add_result(callback, data, mtime)
+
+    def _add_result(self, callback, data, mtime):
+        """Queue a result and make sure it gets delivered soon.
+        Needs to be called with the lock held.
+        """
+        self._results.append((callback, data, mtime))
+        if self._flush_timeout_id is None:
+            self._flush_timeout_id = GLib.timeout_add(
+                STAT_SERVICE_BATCH_MS, self._flush
+            )
+
+    def _flush(self):
+        """Hand out the queued results, one call per callback."""
+        with self._cond:
+            results, self._results = self._results, []
+            self._flush_timeout_id = None
+
+        batches = OrderedDict()
+        for callback, data, mtime in results:
+            batches.setdefault(callback, []).append((data, mtime))
+
+        for callback, batch in batches.items():
+            callback(batch)
+
+        return False
+
+
+# Shared by all models, so that the cache is too:
+STAT_SERVICE = StatService()
+
+
 def make_iter(node):
     """Make a GtkTreeIter, suitable for our PathTreeModel."""
     iter_ = Gtk.TreeIter()
     iter_.stamp = PATH_MODEL_STAMP
-    iter_.user_data = id(node)
+    iter_.user_data = node.key
     return iter_
 
 
+def _is_revealed(node):
+    """Check if `node` is part of the indices of its parent."""
+    parent = node.parent
+    if parent is None:
+        return True
+
+    indices = parent.indices
+    return node.idx < len(indices) and indices[node.idx] == node
+
+
 class PathTreeModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeSortable):
     """Pack lint nodes into a tree structure compatible with Gtk
 
@@ -396,40 +1697,62 @@ class PathTreeModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeSortable):
         as user_data as workaround. (see make_iter())
     """
 
-    def __init__(self, paths):
+    def __init__(self, paths, trie=None):
         super(PathTreeModel, self).__init__()
 
         # Actual data storage:
         self.paths = paths
-        self.trie = PathTrie(paths)
+        self.trie = trie if trie is not None else PathTrie(paths)
 
         # Manually insert the root path (we need one for working normally):
         path = Gtk.TreePath.new_from_indices([0])
         self.row_inserted(path, make_iter(self.trie.root))
 
-        # Pack of files that are inserted to the trie at once.
+        # Paths waiting to be inserted by the insertion thread and
+        # the nodes it created, waiting to be revealed to GTK.
         # This is a speed optimization to make the ui less blocking.
-        self._file_pack, self._pack_timeout_id = [], None
-
-        # Search optimization:
-        # When typing '.pyo' after searching for '.py' we
-        # can just filter the previous results.
-        self._partial_model, self._last_query = None, None
+        self._pending, self._staged = queue.Queue(), deque()
+        self._insert_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._inserter, self._reveal_timeout_id = None, None
 
         # Last column we sorted by or None (needed for GtkTreeSortable)
         self._sort_last_id = None
         self._sort_last_order = Gtk.SortType.DESCENDING
 
+        # PathTreeViews showing this model; used to find expanded rows.
+        self._views = weakref.WeakSet()
+
         # Set of nodes that need to get updated periodically.
         # It would be expensive to do that on every insert
         # (causing one row redraw each), therefore we do it every second.
         self._intermediate_nodes = set()
         self._mtime_cache = set()
-        GLib.timeout_add(1000, self._update_intermediate_nodes)
+        self._update_timeout_id = self._start_updates()
 
         # A node was updated from the outside, i.e. by another model,
         # or by directly modifying a PathNode or PathTrie.
-        self.trie.connect('node-updated', self.on_node_updated)
+        self._node_updated_id = self.trie.connect(
+            'node-updated', self.on_node_updated
+        )
+
+    def _start_updates(self):
+        """Update the intermediate nodes every second.
+        Returns the id of the GLib source doing that.
+        """
+        return GLib.timeout_add(1000, self._update_intermediate_nodes)
+
+    def destroy(self):
+        """Stop all updates of this model, so it can be freed.
+        Call this once the model is not shown anymore.
+        """
+        if self._update_timeout_id is not None:
+            GLib.source_remove(self._update_timeout_id)
+            self._update_timeout_id = None
+
+        if self._node_updated_id is not None:
+            self.trie.disconnect(self._node_updated_id)
+            self._node_updated_id = None
 
     def _update_intermediate_nodes(self):
         """Make sure the intermediate nodes get updated in a slow
@@ -442,8 +1765,7 @@ class PathTreeModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeSortable):
             indices = node.build_iter_path()
             path = Gtk.TreePath.new_from_indices(indices)
 
-            if id(node.row) not in self._mtime_cache:
-                self._update_mtime(node.build_path(), node.row)
+            self._update_mtime(node.build_path(), node.row)
 
             self.row_changed(path, make_iter(node))
 
@@ -458,38 +1780,71 @@ class PathTreeModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeSortable):
     def add_path(self, path, row, immediately=False):
         """Add a path, including metadata, to the model.
 
-        If immediately is False, the path will be cached and
-        added after a small timeout as performance optimization.
+        If immediately is False, the path will be inserted in the
+        background and shown after a small timeout as performance optimization.
         """
-        self._update_mtime(path, row)
-
         if immediately:
             # Add it it immediately.
+            self._update_mtime(path, row)
             self._add_and_signal(path, row)
         else:
-            # Defer the addition a bit more.
-            self._file_pack.append((path, row))
-            if self._pack_timeout_id is None:
-                self._pack_timeout_id = GLib.timeout_add(
-                    PATH_MODEL_TIMEOUT_MS, self._add_defer
+            self.add_paths([(path, row)])
+
+    def add_paths(self, items):
+        """Add a list of (path, row) tuples in the background."""
+        self._pending.put(items)
+
+        with self._state_lock:
+            if self._inserter is None:
+                self._inserter = threading.Thread(
+                    target=self._insert_pending, daemon=True
                 )
+                self._inserter.start()
 
     def _update_mtime(self, path, row):
-        """Update the mtime by reading it from disk."""
-        if row[Column.MTIME] <= 0 and id(row) not in self._mtime_cache:
-            # Attempt to read the mtime from file:
-            try:
-                row[Column.MTIME] = os.stat(path).st_mtime
-            except OSError as err:
-                LOGGER.debug('stat: %s', str(err))
+        """Update the mtime by reading it from disk in the background."""
+        if row[Column.MTIME] <= 0 and row_key(row) not in self._mtime_cache:
+            self._mtime_cache.add(row_key(row))
+            STAT_SERVICE.request(path, self._on_mtimes_read, (path, row))
+
+    def _on_mtimes_read(self, results):
+        """Called by the StatService with a batch of read mtimes."""
+        changed, leaves_changed = [], False
+
+        with self._insert_lock:
+            for (path, row), mtime in results:
+                if mtime is None:
+                    continue
+
+                # Rows might have been copied on insertion (CompactPathTrie),
+                # so prefer the row of the node if it exists already.
+                node = self.trie.find(path)
+                if node is None:
+                    row[Column.MTIME] = mtime
+                    continue
+
+                node.row[Column.MTIME] = mtime
+                leaves_changed |= node.is_leaf
+                changed.append(node)
+
+        if leaves_changed:
+            self.trie.search_index.invalidate('mtime')
+
+        for node in changed:
+            # Hidden nodes get read once they are revealed.
+            if not _is_revealed(node):
+                continue
 
-            self._mtime_cache.add(id(row))
+            path = Gtk.TreePath.new_from_indices(node.build_iter_path())
+            self.row_changed(path, make_iter(node))
 
     def _add_and_signal(self, path, row):
         """Actually add the path and its metadata here.
         Also signal the GtkTreeView to update if necessary.
         """
-        parents = self.trie.insert(path, row)
+        with self._insert_lock:
+            parents = self.trie.insert(path, row)
+            self.trie.flush()
 
         for node, was_new in parents:
             indices = node.build_iter_path()
@@ -500,29 +1855,70 @@ class PathTreeModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeSortable):
 
             self._intermediate_nodes.add(node)
 
-    def _add_defer(self):
-        """Add a pack of paths to the trie, max 500 at the same time."""
-        LOGGER.info(
-            'Adding pack: %d/%d',
-            min(PATH_MODEL_CHUNK_SIZE, len(self._file_pack)),
-            PATH_MODEL_CHUNK_SIZE
-        )
+    def _insert_pending(self):
+        """Insert pending paths into the trie. Runs in a separate thread.
 
-        for path, row in self._file_pack[:PATH_MODEL_CHUNK_SIZE]:
-            self._add_and_signal(path, row)
+        New nodes are created invisible; _reveal_staged() makes them
+        visible to GTK later on the main loop.
+        """
+        while True:
+            try:
+                items = self._pending.get(timeout=PATH_MODEL_IDLE_TIMEOUT)
+            except queue.Empty:
+                with self._state_lock:
+                    if self._pending.empty():
+                        self._inserter = None
+                        return
+                continue
 
-        self._file_pack = self._file_pack[PATH_MODEL_CHUNK_SIZE:]
+            for path, row in items:
+                self._update_mtime(path, row)
 
-        if self._file_pack:
-            # If we had some leftovers we need to schedule a new _add_defer.
-            self._pack_timeout_id = GLib.timeout_add(
-                PATH_MODEL_TIMEOUT_MS, self._add_defer
-            )
-        else:
-            # Finished for now, new paths might come later.
-            self._pack_timeout_id = None
+            # Directory sizes are updated once per batch:
+            with self._insert_lock:
+                staged = [
+                    self.trie.insert(path, row, visible=False)
+                    for path, row in items
+                ]
+                self.trie.flush()
 
-        return False
+            self._staged.extend(staged)
+
+            with self._state_lock:
+                if self._reveal_timeout_id is None:
+                    self._reveal_timeout_id = GLib.timeout_add(
+                        PATH_MODEL_TIMEOUT_MS, self._reveal_staged
+                    )
+
+    def _reveal_staged(self):
+        """Show the nodes created by the insertion thread to GTK.
+        Stops after PATH_MODEL_FRAME_BUDGET_MS and continues later.
+        """
+        deadline = time.monotonic() + PATH_MODEL_FRAME_BUDGET_MS / 1000.0
+        revealed = 0
+
+        while self._staged and time.monotonic() < deadline:
+            for node, was_new in self._staged.popleft():
+                if was_new:
+                    node.reveal()
+                    path = Gtk.TreePath.new_from_indices(
+                        node.build_iter_path()
+                    )
+                    self.row_inserted(path, make_iter(node))
+
+                self._intermediate_nodes.add(node)
+
+            revealed += 1
+
+        LOGGER.debug('Revealed %d paths, %d left', revealed, len(self._staged))
+
+        with self._state_lock:
+            if self._staged:
+                return True
+
+            # Finished for now, new paths might come later.
+            self._reveal_timeout_id = None
+            return False
 
     def lookup_by_path(self, path):
         """Calls trie.find() to find the node attached to a path"""
@@ -537,50 +1933,37 @@ class PathTreeModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeSortable):
         Instead of modifying the model, a new model is returned,
         which shows only contains the filtered nodes.
 
-        This is surprisingly the most efficient method here, and comes with
-        very little effort.  Small drawback: External code cannot rely on a
-        single model
+        The new model shares the nodes and rows of this one, see
+        FilteredPathTreeModel. Small drawback: External code cannot
+        rely on a single model
         """
         if len(term) < 2:
             LOGGER.debug('too short, showing full model')
             return self
 
-        term = term.lower()
-        partial_model = PathTreeModel(self.paths)
-        partial_model._mtime_cache = self._mtime_cache
-
-        query = Query.parse(term)
+        query = Query.parse(term.lower())
         if query is None:
             return
 
-        # Find out which trie to filter.
-        # If we had a search query with matching prefix before we can just
-        # use the previous resulting model.
-        base_trie = self.trie
-        if self._partial_model and query.issubset(self._last_query):
-            base_trie = self._partial_model.trie
+        return FilteredPathTreeModel(self, self.search(query))
 
-        # Iterate over the trie; do not add unmatched.
-        for node in base_trie:
-            # For now we only search through leafs.
-            if not node.is_leaf:
-                continue
-
-            if not query.matches(
-                    node,
-                    node[Column.SIZE],
-                    node[Column.MTIME],
-                    -node[Column.COUNT]
-            ):
-                continue
+    def search(self, query, cancelled=None, partial=None):
+        """Return the leaves matching the Query `query` or None if cancelled.
 
-            # Do not copy the rows, just ref them.
-            path = node.build_path()
-            partial_model.add_path(path, node.row, True)
-
-        # Remember for the next step:
-        self._partial_model, self._last_query = partial_model, query
-        return partial_model
+        Safe to call from other threads. Insertions only wait while the
+        current generation of the search index is taken; paths added
+        afterwards might not be found. The leaves are not ordered.
+        See SearchGeneration.search() for `cancelled` and `partial`.
+        """
+        with self._insert_lock:
+            self.trie.flush()
+            generation = self.trie.search_index.generation()
+
+        # The trie's search index does the actual work:
+        return self.trie.search(
+            query, ordered=False, cancelled=cancelled, partial=partial,
+            generation=generation
+        )
 
     ###################################
     # PyGObject convenience interface #
@@ -592,7 +1975,7 @@ class PathTreeModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeSortable):
         PyGObject seems to expect a method with this name,
         when setting the value of a row.
         """
-        node = self.trie.nodes[iter_.user_data]
+        node = self.trie.lookup_node_id(iter_.user_data)
         node.row[column] = value
 
         # Find out which path to update:
@@ -611,7 +1994,7 @@ class PathTreeModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeSortable):
 
         # Mark for updating:
         if node is not None:
-            self._intermediate_nodes.add(node)
+            self.mark_for_update(node)
 
     def mark_for_update(self, node):
         """Mark this node to be updated soon."""
@@ -635,13 +2018,13 @@ class PathTreeModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeSortable):
 
     def _iter_move(self, iter_, offset):
         """Move iter_ by a certain offset."""
-        node = self.trie.nodes[iter_.user_data]
+        node = self.trie.lookup_node_id(iter_.user_data)
         next_node = node.neighbor(offset)
 
         if next_node is None:
             return (False, None)
         else:
-            iter_.user_data = id(next_node)
+            iter_.user_data = next_node.key
             return (True, iter_)
 
     def do_iter_next(self, iter_):
@@ -660,7 +2043,7 @@ class PathTreeModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeSortable):
 
     def do_iter_parent(self, child_iter):
         """Returns an iter pointing to the parent of child_iter or None."""
-        node = self.trie.nodes[child_iter.user_data]
+        node = self.trie.lookup_node_id(child_iter.user_data)
         if node.parent:
             return (True, make_iter(node.parent))
         else:
@@ -668,14 +2051,14 @@ class PathTreeModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeSortable):
 
     def do_iter_has_child(self, iter_):
         """True if iter has children."""
-        return len(self.trie.nodes[iter_.user_data].children) > 0
+        return len(self.trie.lookup_node_id(iter_.user_data).indices) > 0
 
     def do_iter_n_children(self, iter_):
         """Returns the number of children of iter_"""
         if iter_ is None:
             return 0
         else:
-            return len(self.trie.nodes[iter_.user_data].children)
+            return len(self.trie.lookup_node_id(iter_.user_data).indices)
 
     def do_iter_children(self, parent):
         """Return first child or (False|None)"""
@@ -690,7 +2073,7 @@ class PathTreeModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeSortable):
             # It has no user_data and an invalid stamp field.
             return (False, None)
         else:
-            node = self.trie.nodes[parent.user_data]
+            node = self.trie.lookup_node_id(parent.user_data)
 
         if nth < len(node.indices):
             return (True, make_iter(node.indices[nth]))
@@ -699,12 +2082,12 @@ class PathTreeModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeSortable):
 
     def do_get_path(self, iter_):
         """Returns tree path references by iter."""
-        node = self.trie.nodes[iter_.user_data]
-        return Gtk.TreePath(reversed([parent.idx for parent in node.up()]))
+        node = self.trie.lookup_node_id(iter_.user_data)
+        return Gtk.TreePath.new_from_indices(node.build_iter_path())
 
     def do_get_value(self, iter_, column):
         """Returns the value for iter and column."""
-        node = self.trie.nodes[iter_.user_data]
+        node = self.trie.lookup_node_id(iter_.user_data)
         return Column.TYPES[column](node[column])
 
     def do_get_n_columns(self):
@@ -725,7 +2108,7 @@ class PathTreeModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeSortable):
 
     def iter_to_node(self, iter_):
         """Convert a GtkTreeIter to the related PathNode"""
-        return self.trie.nodes.get(iter_.user_data)
+        return self.trie.lookup_node_id(iter_.user_data)
 
     ###########################
     # GtkTreeSortable methods #
@@ -758,15 +2141,48 @@ class PathTreeModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeSortable):
         # Indicate the sort column was changed *before* sorting.
         self.emit('sort-column-changed')
 
-        # Do the actual sort:
+        # Do the actual sort. Rows that are not expanded in any view
+        # get sorted once they are expanded, see sort_children().
+        # The inserter thread must not add nodes meanwhile.
         reverse = order is Gtk.SortType.DESCENDING
-        for node, old_ind in self.trie.sort(id_, reverse):
-            indices = node.build_iter_path()
-            path = Gtk.TreePath.new_from_indices(indices)
+        expanded = self._is_expanded if self._views else None
+        with self._insert_lock:
+            self.trie.flush()
+            reordered = list(self.trie.sort(id_, reverse, expanded=expanded))
+
+        for node, old_ind in reordered:
+            self._emit_reordered(node, old_ind)
 
-            # Update the treeview:
-            if old_ind:
-                self.rows_reordered(path, make_iter(node), old_ind)
+    def _emit_reordered(self, node, old_ind):
+        """Tell GTK that the children of `node` were reordered."""
+        indices = node.build_iter_path()
+        path = Gtk.TreePath.new_from_indices(indices)
+        self.rows_reordered(path, make_iter(node), old_ind)
+
+    def _is_expanded(self, node):
+        """Check if the row of `node` is expanded in any view."""
+        path = Gtk.TreePath.new_from_indices(node.build_iter_path())
+        return any(view.row_expanded(path) for view in self._views)
+
+    def attach_view(self, view):
+        """Remember that `view` shows this model. See sort_children()"""
+        self._views.add(view)
+
+    def detach_view(self, view):
+        """`view` does not show this model anymore."""
+        self._views.discard(view)
+
+    def sort_children(self, iter_):
+        """Sort the children of `iter_` if that was deferred by sorting."""
+        node = self.iter_to_node(iter_)
+        if node is None:
+            return
+
+        with self._insert_lock:
+            old_ind = self.trie.sort_children(node)
+
+        if old_ind is not None:
+            self._emit_reordered(node, old_ind)
 
     def do_set_sort_func(self, id_, func):
         """Custom sort functions are hard to implement with tries."""
@@ -785,6 +2201,53 @@ class PathTreeModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeSortable):
         self.do_set_sort_column_id(id_, order)
 
 
+class FilteredPathTreeModel(PathTreeModel):
+    """PathTreeModel showing only some leaves of another model,
+    including the directories above them.
+
+    It is backed by a FilteredTrie: Nodes and rows are shared with
+    the other model and rows are only looked at when GTK asks for them.
+    New paths cannot be added.
+    """
+    def __init__(self, model, leaves):
+        PathTreeModel.__init__(
+            self, model.paths, FilteredTrie(model.trie, leaves)
+        )
+
+        self.base_model = model
+        self._mtime_cache = model._mtime_cache
+
+    def _start_updates(self):
+        """Nothing is inserted into filtered models, so they are only
+        updated after mark_for_update(). A periodic update would also
+        keep discarded models alive forever.
+        """
+        return None
+
+    def mark_for_update(self, node):
+        """Mark this node to be updated soon."""
+        PathTreeModel.mark_for_update(self, node)
+        if self._update_timeout_id is None:
+            self._update_timeout_id = GLib.timeout_add(
+                1000, self._on_update_timeout
+            )
+
+    def _on_update_timeout(self):
+        self._update_timeout_id = None
+        self._update_intermediate_nodes()
+        return False
+
+    def add_path(self, path, row, immediately=False):
+        raise NotImplementedError('Filtered models are read-only.')
+
+    def add_paths(self, items):
+        raise NotImplementedError('Filtered models are read-only.')
+
+    def filter_model(self, term):
+        """Filter the full model, not only the visible part."""
+        return self.base_model.filter_model(term)
+
+
 def _create_column(title, id_, renderers, fixed_width=100):
     """Convenience method for creating a TreeView Column.
     Several renderers can be given with certain options.
@@ -854,15 +2317,29 @@ class PathTreeView(Gtk.TreeView):
             'button-press-event',
             PathTreeView.on_button_press_event
         )
+        self.connect('row-expanded', PathTreeView.on_row_expanded)
 
         # Shut up, pylint.
         self._menu = None
 
     def set_model(self, model):
         """Overwrite Gtk.TreeView.set_model, but expand sub root paths"""
+        old_model = self.get_model()
+        if isinstance(old_model, PathTreeModel):
+            old_model.detach_view(self)
+
+        if isinstance(model, PathTreeModel):
+            model.attach_view(self)
+
         Gtk.TreeView.set_model(self, model)
         self.expand_all()
 
+    def on_row_expanded(self, iter_, path):
+        """Sort the children of newly shown rows, if not done yet."""
+        model = self.get_model()
+        if isinstance(model, PathTreeModel):
+            model.sort_children(iter_)
+
     def get_selected_nodes(self):
         """Extra convenience method for getting the currently selected nodes"""
         model, rows = self.get_selection().get_selected_rows()
@@ -977,7 +2454,7 @@ class PathTreeView(Gtk.TreeView):
 
             # No original in group, set first twin as original.
             for twin_node in group:
-                if twin_node is not node:
+                if twin_node != node:
                     self.update_node(twin_node, Column.TAG, NodeState.ORIGINAL)
                     break
 
@@ -1016,11 +2493,12 @@ if __name__ == '__main__':
 
         runner = Runner(settings, sys.argv[1:], [])
         runner.connect(
-            'lint-added',
-            lambda *_: model.add_path(
-                runner.element['path'],
-                Column.make_row(
-                    runner.element)))
+            'lints-added',
+            lambda _, elements: [
+                model.add_path(elem['path'], Column.make_row(elem))
+                for elem in elements
+            ]
+        )
 
         runner.connect(
             'process-finished',
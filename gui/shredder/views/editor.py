@@ -15,6 +15,7 @@ of killed files in terms of size.
 import os
 import time
 import logging
+import threading
 
 # External:
 from gi.repository import Gtk
@@ -30,13 +31,22 @@ except ImportError:
 # Internal:
 from shredder.util import View, IconButton, scrolled, size_to_human_readable
 from shredder.util import MultipleChoiceButton, SuggestedButton
-from shredder.runner import Script
+from shredder.runner import Script, ScriptProgress
 
 
 LOGGER = logging.getLogger('editor')
 
 
-REMOVED_LABEL = '''<big>{s}</big><small> {n} removed</small>
+# Scripts are shown in pages of this many lines; only
+# SCRIPT_WINDOW_PAGES pages around the visible part are in the buffer.
+SCRIPT_PAGE_LINES = 2000
+SCRIPT_WINDOW_PAGES = 3
+
+# Retry showing the script after this many ms, while it is being indexed.
+SCRIPT_INDEX_POLL_MS = 50
+
+
+REMOVED_LABEL = '''<big>{s}</big><small> in {c} files {n} removed</small>
 <small>Currently {t}</small> <b><big>{p}</big></b>
 '''
 
@@ -62,8 +72,10 @@ try:
 
         return view, buffer_
 
-    class _SearchRun:
-        """Represent a run through all matches relative a query."""
+    class _SearchHighlight:
+        """Highlight all matches of a query in the shown part of a script.
+        Jumping between matches is done by EditorView on the whole script.
+        """
         def __init__(self, buffer_, query):
             settings = GtkSource.SearchSettings()
             settings.set_search_text(query)
@@ -72,39 +84,6 @@ try:
             self.ctx = GtkSource.SearchContext.new(buffer_, settings)
             self.ctx.set_highlight(True)
             self.ctx.set_match_style(GtkSource.Style(underline=True))
-            self._last_mark = None
-
-        @property
-        def query(self):
-            """Query of this search run"""
-            return self.ctx.get_settings().get_search_text()
-
-        def next_hop(self, view):
-            """Return a GtkTextMark pointing at the next find or None.
-
-            All matching items will be highlighted by default.
-            """
-            # Find out at which position we were last:
-            buffer_ = self.ctx.props.buffer
-            if self._last_mark is None:
-                offset = buffer_.get_start_iter()
-            else:
-                offset = buffer_.get_iter_at_mark(self._last_mark)
-
-            # Trigger actual searching:
-            self.ctx.forward_async(offset, None, self.on_forward_finish, view)
-
-        def on_forward_finish(self, source, result, view):
-            """Called once GtkSourceSearchContext has finished processing."""
-            valid, start, end = self.ctx.forward_finish(result)
-            self._last_mark = None
-
-            # Select & remember mark for next hop
-            if valid:
-                buffer_ = self.ctx.props.buffer
-                buffer_.select_range(start, end)
-                self._last_mark = buffer_.create_mark(None, end, True)
-                view.scroll_mark_onscreen(self._last_mark)
 
     def _set_source_style(view, style_name):
         """If supported, set a color scheme by name."""
@@ -134,13 +113,9 @@ except ImportError:
         view = Gtk.TextView()
         return view, buffer_
 
-    class _SearchRun:
-        """Dummy search functor that does nothing."""
+    class _SearchHighlight:
+        """Dummy highlighter that does nothing."""
         def __init__(self, *_):
-            self.query = None
-
-        def next_hop(self, *_):
-            """No-op"""
             pass
 
     def _set_source_style(*_):
@@ -211,29 +186,20 @@ class RunningLabel(Gtk.Label):
         """If it is a dry run, don't scare the user"""
         self._is_dry_run = is_it
 
-    def push(self, prefix, path):
-        """Push a new path to the label, removing the old one."""
-        if prefix.lower() == 'keeping':
-            return
-
-        try:
-            buf = os.stat(path)
-            self._size_sum += buf.st_size
-        except OSError:
-            pass
-
+    def update(self, progress):
+        """Show the summed up size and latest path of a ScriptProgress."""
         text = REMOVED_LABEL.format(
-            t=prefix.lower(),
-            s=size_to_human_readable(self._size_sum),
-            p=GLib.markup_escape_text(path),
+            t=progress.prefix.lower(),
+            s=size_to_human_readable(progress.size),
+            c=progress.n_handled,
+            p=GLib.markup_escape_text(progress.path),
             n="<b>would be</b>" if self._is_dry_run else ""
         )
         self.set_markup(text)
 
     def reset(self):
         """Reset the counter to initial state (zero)"""
-        self._size_sum = 0
-        self.push('', '')
+        self.update(ScriptProgress())
 
 
 class RunButton(IconButton):
@@ -488,6 +454,10 @@ class EditorView(View):
         self._last_runner = None
         self.script = Script.create_dummy()
 
+        # Shown part of the script: ScriptMap and first line in the buffer
+        self._script_map, self._window_start = None, 0
+        self._fill_timeout_id, self._is_filling = None, False
+
         control_grid = Gtk.Grid()
         control_grid.set_hexpand(False)
         control_grid.set_vexpand(False)
@@ -620,7 +590,14 @@ class EditorView(View):
         paned.props.position = 920
         self.add(paned)
 
-        self._last_search = None
+        self.text_view.get_vadjustment().connect(
+            'value-changed', self.on_script_scrolled
+        )
+
+        # Query, byte offset of the last match and the generation
+        # of the running search (newer searches supersede older ones).
+        self._last_query, self._last_match = None, -1
+        self._search_generation, self._highlight = 0, None
         self.search_entry.connect(
             'search-changed', self.on_search_changed
         )
@@ -697,8 +674,14 @@ Or you can replay the output later with:
         GLib.idle_add(
             lambda: self.left_stack.set_visible_child_name('script')
         )
-        buffer_ = self.text_view.get_buffer()
-        buffer_.set_text(self.script.read())
+        # Only map the script; the shown lines are read when needed.
+        if self._script_map is not None:
+            self._script_map.close()
+
+        self._script_map = self.script.map()
+        self._last_query, self._last_match = None, -1
+        self._search_generation += 1
+        self._fill_window(0)
 
         # Make sure it gets colored again:
         _set_source_style(self.text_view, 'solarized-light')
@@ -706,24 +689,158 @@ Or you can replay the output later with:
         self.stack.set_visible_child_name('danger')
         self.stack.set_sensitive(True)
 
+    def _fill_window(self, start, top_line=None):
+        """Show the lines of the script around `start` in the buffer.
+
+        If given, `top_line` (of the whole script) is scrolled to the top.
+        While the script is still being indexed, lines that are not
+        indexed yet are shown once they are.
+        """
+        script_map = self._script_map
+        window_lines = SCRIPT_PAGE_LINES * SCRIPT_WINDOW_PAGES
+
+        if self._fill_timeout_id is not None:
+            GLib.source_remove(self._fill_timeout_id)
+            self._fill_timeout_id = None
+
+        is_complete = script_map.n_lines >= start + window_lines
+        if not script_map.is_indexed and not is_complete:
+            self._fill_timeout_id = GLib.timeout_add(
+                SCRIPT_INDEX_POLL_MS, self._on_fill_timeout, start, top_line
+            )
+
+        start = max(0, min(start, script_map.n_lines - window_lines))
+        stop = start + window_lines
+
+        # Line numbers would be wrong if not starting at the first line:
+        if hasattr(self.text_view, 'set_show_line_numbers'):
+            self.text_view.set_show_line_numbers(
+                script_map.is_indexed and script_map.n_lines <= window_lines
+            )
+
+        self._is_filling = True
+        try:
+            self._window_start = start
+            self.text_view.get_buffer().set_text(script_map.lines(start, stop))
+            if top_line is not None:
+                self._scroll_to_line(top_line)
+        finally:
+            self._is_filling = False
+
+    def _on_fill_timeout(self, start, top_line):
+        """Show newly indexed lines."""
+        self._fill_timeout_id = None
+        self._fill_window(start, top_line)
+        return False
+
+    def _buffer_iter_at_line(self, line):
+        """GtkTextIter at `line` of the script, which needs to be shown."""
+        buffer_ = self.text_view.get_buffer()
+        return buffer_.get_iter_at_line(line - self._window_start)
+
+    def _scroll_to_line(self, line):
+        # Marks get scrolled to once the new lines have been measured:
+        buffer_ = self.text_view.get_buffer()
+        mark = buffer_.create_mark(None, self._buffer_iter_at_line(line))
+        self.text_view.scroll_to_mark(mark, 0, True, 0, 0)
+        buffer_.delete_mark(mark)
+
+    def on_script_scrolled(self, adjustment):
+        """Move the shown lines along when scrolling near their border."""
+        if self._is_filling or self._script_map is None:
+            return
+
+        value, upper = adjustment.get_value(), adjustment.get_upper()
+        page_size = adjustment.get_page_size()
+        margin = page_size / 2
+
+        end = self._window_start + SCRIPT_PAGE_LINES * SCRIPT_WINDOW_PAGES
+        if value + page_size + margin >= upper:
+            if end >= self._script_map.n_lines:
+                return
+            offset = SCRIPT_PAGE_LINES
+        elif value <= margin:
+            if self._window_start == 0:
+                return
+            offset = -SCRIPT_PAGE_LINES
+        else:
+            return
+
+        # Keep the line at the top where it is:
+        top_iter, _ = self.text_view.get_line_at_y(int(value))
+        top_line = self._window_start + top_iter.get_line()
+        self._fill_window(self._window_start + offset, top_line)
+
     def on_search_changed(self, _):
-        """Called once the user enteres a new search query."""
+        """Called once the user enteres a new search query.
+
+        The next match is searched in the whole script, in a separate
+        thread. Matches in the shown lines are highlighted.
+        """
         query = self.search_entry.get_text().lower()
         buffer_ = self.text_view.get_buffer()
+        self._search_generation += 1
 
         # If query is empty, just deselect everything.
-        if not query:
+        if not query or self._script_map is None:
             buffer_.select_range(
                 buffer_.get_start_iter(),
                 buffer_.get_start_iter()
             )
+            self._last_query, self._highlight = None, None
+            return
+
+        # Start from the beginning for new queries:
+        if query != self._last_query:
+            self._last_query, self._last_match = query, -1
+            self._highlight = _SearchHighlight(buffer_, query)
+
+        generation, script_map = self._search_generation, self._script_map
+        start = self._last_match + 1
+
+        def _search():
+            def _cancelled():
+                return generation != self._search_generation
+
+            offset = script_map.find(query, start, _cancelled)
+            if offset < 0 and start > 0 and not _cancelled():
+                # Wrap around:
+                offset = script_map.find(query, 0, _cancelled)
+
+            GLib.idle_add(self._on_search_finished, generation, query, offset)
 
-        # Check if query changed and if we need to get a new search ctx
-        if self._last_search is None or self._last_search.query != query:
-            self._last_search = _SearchRun(buffer_, query)
+        threading.Thread(target=_search, daemon=True).start()
 
-        # Jump one position ahead (or do initial search)
-        self._last_search.next_hop(self.text_view)
+    def _on_search_finished(self, generation, query, offset):
+        """Select the match of the last search at byte `offset`.
+        If the indexer did not reach the match yet, wait for it.
+        """
+        if generation != self._search_generation or offset < 0:
+            return False
+
+        if not self._script_map.is_line_indexed(offset):
+            GLib.timeout_add(
+                SCRIPT_INDEX_POLL_MS, self._on_search_finished,
+                generation, query, offset
+            )
+            return False
+
+        self._last_match = offset
+        line = self._script_map.line_of(offset)
+        window_end = self._window_start
+        window_end += SCRIPT_PAGE_LINES * SCRIPT_WINDOW_PAGES
+        if not self._window_start <= line < window_end:
+            self._fill_window(line - SCRIPT_PAGE_LINES)
+
+        start = self._buffer_iter_at_line(line)
+        start.forward_chars(self._script_map.column_of(offset))
+        end = start.copy()
+        end.forward_chars(len(query))
+
+        buffer_ = self.text_view.get_buffer()
+        buffer_.select_range(start, end)
+        self.text_view.scroll_to_mark(buffer_.get_insert(), 0.1, False, 0, 0)
+        return False
 
     def on_run_script_clicked(self, _):
         """The critical function callback that is run when action is done."""
@@ -768,8 +885,8 @@ Or you can replay the output later with:
         self.script = script
 
         self.script.connect(
-            'line-read',
-            lambda _, prefix, line: self.run_label.push(prefix, line)
+            'progress',
+            lambda _, progress: self.run_label.update(progress)
         )
 
         self.script.connect(
@@ -14,7 +14,10 @@ Also show the directory size alongside.
 # Stdlib:
 import os
 import json
+import time
+import queue
 import logging
+import threading
 
 # External:
 from gi.repository import Gtk
@@ -29,11 +32,328 @@ from shredder.util import View, IconButton, size_to_human_readable
 LOGGER = logging.getLogger('locations')
 
 
+# Number of threads walking directories for DirSizeService.
+DIR_SIZE_WORKERS = 4
+
+# Interval in ms in which size estimates are handed out while walking.
+DIR_SIZE_UPDATE_MS = 250
+
+# Sizes cached on disk are shown for this many seconds, as long as
+# mtime and inode of the directory did not change. Changes below its
+# direct entries do not touch that mtime, so a cached size is only
+# an estimate until the directory was walked again.
+DIR_SIZE_CACHE_MAX_AGE = 60 * 60
+
+# Stop a walker thread after it was idle for this many seconds.
+DIR_SIZE_IDLE_TIMEOUT = 1.0
+
+
+def size_cache_file_path():
+    return os.path.join(
+        GLib.get_user_cache_dir(),
+        "shredder",
+        "dirsizes.json"
+    )
+
+
+class _DirNode:
+    """Walk state of a single directory.
+
+    `size` and `pending` include all subdirectories found so far;
+    the directory is completely walked once `pending` drops to 0.
+    Requested directories remember the hardlinked files counted in them
+    in `links`, (st_dev, st_ino) -> size. Nodes are shared between
+    all walks of the same `scope`.
+    """
+    __slots__ = ['parent', 'size', 'pending', 'links', 'scope']
+
+    def __init__(self, parent, scope):
+        self.parent, self.size, self.pending = parent, 0, 1
+        self.links, self.scope = None, scope
+
+
+class DirSizeService:
+    """Calculate the disk usage of directories like `du -s`.
+
+    Directories are walked by a few threads with os.scandir().
+    Every directory (identified by device and inode) is only walked once,
+    so overlapping locations share the work of their common subtrees.
+    Hardlinked files are counted once per requested directory.
+    A directory that is requested after the walk of another location
+    reached it is walked on its own, since it did not track its hardlinks.
+    Final sizes are cached on disk and handed out as estimate while
+    the directory is walked again, see DIR_SIZE_CACHE_MAX_AGE.
+    """
+    def __init__(self, max_workers=DIR_SIZE_WORKERS):
+        self._max_workers, self._n_workers = max_workers, 0
+        self._lock = threading.Lock()
+        self._tasks = queue.Queue()
+
+        # (scope, st_dev, st_ino) -> _DirNode
+        self._nodes = {}
+
+        # (path, node, stat result, callbacks, cached size)
+        # of unfinished requests:
+        self._requests, self._timeout_id = [], None
+        self._disk_cache = None
+
+    def request(self, path, callback):
+        """Calculate the size of `path` in the background.
+
+        `callback(size, done)` is called on the main loop
+        with estimates while walking and once more with done=True.
+        A cached size is the first estimate; later ones do not go
+        below it until the walk is done.
+        `size` is None if `path` could not be read.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError as err:
+            LOGGER.debug('Cannot get size of %s: %s', path, err)
+            GLib.idle_add(callback, None, True)
+            return
+
+        cached = self._lookup_disk_cache(path, stat)
+        if cached is not None:
+            GLib.idle_add(callback, cached, False)
+
+        node = self._enqueue(path, stat, None)
+        for _, req_node, _, callbacks, _ in self._requests:
+            if req_node is node:
+                callbacks.append(callback)
+                break
+        else:
+            self._requests.append((path, node, stat, [callback], cached))
+
+        if self._timeout_id is None:
+            self._timeout_id = GLib.timeout_add(
+                DIR_SIZE_UPDATE_MS, self._report_progress
+            )
+
+    def _enqueue(self, path, stat, parent):
+        """Schedule walking the directory `path` below `parent`.
+        Requested directories have no parent.
+        """
+        key = (stat.st_dev, stat.st_ino)
+        scope = 0 if parent is None else parent.scope
+        with self._lock:
+            node = self._nodes.get((scope, ) + key)
+            if node is not None and parent is None and node.links is None:
+                # Part of another walk; see if it was requested before:
+                scope = key
+                node = self._nodes.get((scope, ) + key)
+
+            if node is not None:
+                # Walked already or being walked; share its results.
+                if parent is not None and node.parent is None:
+                    if not self._is_ancestor(node, parent):
+                        self._adopt(node, parent)
+                return node
+
+            node = self._nodes[(scope, ) + key] = _DirNode(parent, scope)
+            if parent is None:
+                node.links = {}
+
+            self._propagate(parent, 0, 1)
+
+            if self._n_workers < self._max_workers:
+                self._n_workers += 1
+                threading.Thread(target=self._work, daemon=True).start()
+
+        self._tasks.put((path, stat, node))
+        return node
+
+    @staticmethod
+    def _is_ancestor(node, other):
+        """Check if `node` is `other` or above it."""
+        while other is not None:
+            if other is node:
+                return True
+            other = other.parent
+
+        return False
+
+    def _adopt(self, node, parent):
+        """Let the requested `node` become a subdirectory of `parent`.
+        Needs to be called with the lock held.
+        """
+        node.parent = parent
+        self._propagate(parent, node.size, node.pending)
+
+        # Hardlinks counted in both were added twice above:
+        for key, size in node.links.items():
+            counted = self._count_link(parent, key, 0)
+            self._propagate(counted, -size, 0)
+
+    @staticmethod
+    def _count_link(node, key, size):
+        """Add a hardlinked file to `node` and all nodes above it,
+        up to the first requested directory that counted it already.
+        That directory is returned, or None.
+        Needs to be called with the lock held.
+        """
+        while node is not None:
+            if node.links is not None:
+                if key in node.links:
+                    return node
+                node.links[key] = size
+
+            node.size += size
+            node = node.parent
+
+        return None
+
+    @staticmethod
+    def _propagate(node, size, pending):
+        """Add `size` and `pending` to `node` and all nodes above it.
+        Needs to be called with the lock held.
+        """
+        while node is not None:
+            node.size += size
+            node.pending += pending
+            node = node.parent
+
+    def _work(self):
+        """Worker thread: walk queued directories until idle."""
+        while True:
+            try:
+                path, stat, node = self._tasks.get(
+                    timeout=DIR_SIZE_IDLE_TIMEOUT
+                )
+            except queue.Empty:
+                with self._lock:
+                    if self._tasks.empty():
+                        self._n_workers -= 1
+                        return
+                continue
+
+            # The directory itself takes some space too:
+            size = stat.st_blocks * 512
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        size += self._visit(entry, node)
+            except OSError as err:
+                LOGGER.debug('Cannot walk %s: %s', path, err)
+
+            with self._lock:
+                self._propagate(node, size, -1)
+
+    def _visit(self, entry, parent):
+        """Queue directory entries, return the size of others."""
+        try:
+            stat = entry.stat(follow_symlinks=False)
+            if entry.is_dir(follow_symlinks=False):
+                self._enqueue(entry.path, stat, parent)
+                return 0
+        except OSError:
+            return 0
+
+        # Count hardlinked files only once per location, like du -s does:
+        if stat.st_nlink > 1:
+            with self._lock:
+                self._count_link(
+                    parent, (stat.st_dev, stat.st_ino), stat.st_blocks * 512
+                )
+            return 0
+
+        return stat.st_blocks * 512
+
+    def _report_progress(self):
+        """Hand out the current estimates of all running requests."""
+        finished = []
+        with self._lock:
+            states = [
+                (request, request[1].size, request[1].pending == 0)
+                for request in self._requests
+            ]
+
+        for request, size, done in states:
+            if not done and request[4] is not None:
+                size = max(size, request[4])
+
+            for callback in request[3]:
+                callback(size, done)
+
+            if done:
+                finished.append(request)
+
+        for request in finished:
+            self._requests.remove(request)
+            self._store_disk_cache(request[0], request[2], request[1].size)
+
+        if finished:
+            self._write_disk_cache()
+
+        if self._requests:
+            return True
+
+        # Everything walked; do not keep the directories around.
+        with self._lock:
+            self._nodes = {}
+
+        self._timeout_id = None
+        return False
+
+    def _load_disk_cache(self):
+        """Load the cached sizes, if not done yet."""
+        if self._disk_cache is not None:
+            return self._disk_cache
+
+        self._disk_cache = {}
+        try:
+            with open(size_cache_file_path(), "r") as fd:
+                self._disk_cache = json.loads(fd.read())
+        except OSError as exc:
+            LOGGER.debug("No cached directory sizes: {}".format(exc))
+        except ValueError:
+            LOGGER.exception("Failed to read cached directory sizes")
+
+        return self._disk_cache
+
+    def _lookup_disk_cache(self, path, stat):
+        """Cached size of `path` or None if outdated or unknown."""
+        entry = self._load_disk_cache().get(path)
+        if entry is None:
+            return None
+
+        if [entry.get('dev'), entry.get('ino'), entry.get('mtime')] != \
+                [stat.st_dev, stat.st_ino, stat.st_mtime]:
+            return None
+
+        if time.time() - entry.get('time', 0) > DIR_SIZE_CACHE_MAX_AGE:
+            return None
+
+        return entry.get('size')
+
+    def _store_disk_cache(self, path, stat, size):
+        self._load_disk_cache()[path] = {
+            'dev': stat.st_dev,
+            'ino': stat.st_ino,
+            'mtime': stat.st_mtime,
+            'size': size,
+            'time': time.time()
+        }
+
+    def _write_disk_cache(self):
+        try:
+            cache_path = size_cache_file_path()
+            os.makedirs(os.path.dirname(cache_path), mode=0o700, exist_ok=True)
+            with open(cache_path, "w") as fd:
+                fd.write(json.dumps(self._disk_cache))
+        except OSError:
+            LOGGER.exception("Failed to write directory size cache")
+
+
+# Shared by all locations:
+DIR_SIZE_SERVICE = DirSizeService()
+
+
 class DeferSizeLabel(Gtk.Bin):
     """Recursively calculates the size of a directory in a non-blocking way.
 
-    While calculating the widget will look like a spinner, when done the size
-    is displayed as normal text label.
+    While calculating the widget will look like a spinner, until the first
+    estimate arrives. When done the size is displayed as normal text label.
     """
     def __init__(self, path):
         Gtk.Bin.__init__(self)
@@ -41,28 +361,28 @@ class DeferSizeLabel(Gtk.Bin):
         spinner = Gtk.Spinner()
         spinner.start()
         self.add(spinner)
+        self._label = None
 
-        # `du` still seems to be the fastest way to do the job.
-        # All self-implemented ways in python were way slower.
-        du_proc = Gio.Subprocess.new(
-            ['du', '-s', path],
-            Gio.SubprocessFlags.STDERR_SILENCE |
-            Gio.SubprocessFlags.STDOUT_PIPE
-        )
-        du_proc.communicate_utf8_async(None, None, self._du_finished)
-
-    def _du_finished(self, du_proc, result):
-        """Called when the coreutil du finished running. Harvest results."""
-        result, du_data, _ = du_proc.communicate_utf8_finish(result)
-        if du_data:
-            kbytes = int(''.join([num for num in du_data if num.isdigit()]))
-            text = size_to_human_readable(kbytes * 1024)
-        else:
+        DIR_SIZE_SERVICE.request(path, self._on_size)
+
+    def _on_size(self, size, done):
+        """Called with estimates of the size and the final size."""
+        if size is None:
             text = ''
+        else:
+            text = size_to_human_readable(size)
+            if not done:
+                text = '≥ ' + text
+
+        if self._label is None:
+            self._label = Gtk.Label(text)
+            self.remove(self.get_child())
+            self.add(self._label)
+            self.show_all()
+        else:
+            self._label.set_text(text)
 
-        self.remove(self.get_child())
-        self.add(Gtk.Label(text))
-        self.show_all()
+        return False
 
 
 class LocationEntry(Gtk.ListBoxRow):
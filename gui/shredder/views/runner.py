@@ -9,23 +9,34 @@ Shows the chart and a treeview of suspicious files.
 
 # Stdlib:
 import logging
+import threading
 
 # External:
 from gi.repository import Gtk
+from gi.repository import Gio
 from gi.repository import GLib
 from gi.repository import GObject
 
 # Internal:
 from shredder.util import View, IconButton, NodeState
+from shredder.util import size_to_human_readable
 from shredder.util import MultipleChoiceButton, scrolled
 from shredder.chart import ChartStack
-from shredder.tree import PathTreeView, PathTreeModel, Column
+from shredder.tree import PathTreeView, PathTreeModel, CompactPathTrie, Column
+from shredder.tree import FilteredPathTreeModel
 from shredder.runner import Runner
+from shredder.snapshot import find_snapshot, save_snapshot
+from shredder.query import Query
 
 
 LOGGER = logging.getLogger('runview')
 RENDER_CHOICES = ['All', 'Selected', 'Filtered']
 
+# Wait this much ms after the last key press before searching.
+SEARCH_DEBOUNCE_MS = 150
+
+GROUP_LABEL = '''<b>{n}</b> twins, {s} in total, <b>{r}</b> can be removed'''
+
 
 class ResultActionBar(Gtk.ActionBar):
     """Down right bar with the controls"""
@@ -117,6 +128,14 @@ class ResultActionBar(Gtk.ActionBar):
         return self.script_btn.is_sensitive()
 
 
+def _show_model(view, model):
+    """Show `model` in `view`; a filtered model shown before is destroyed."""
+    old_model = view.get_model()
+    view.set_model(model)
+    if isinstance(old_model, FilteredPathTreeModel) and old_model is not model:
+        old_model.destroy()
+
+
 class RunnerView(View):
     """Main action View.
 
@@ -132,6 +151,9 @@ class RunnerView(View):
         # Public: The runner.
         self.runner = None
 
+        # Runner checking the results of a snapshot again, if any:
+        self._refresher = None
+
         self.last_paths = []
 
         # Disable scrolling for the main view:
@@ -144,6 +166,9 @@ class RunnerView(View):
         self._script_generated = False
         self._is_filtered = False
 
+        # Pending search timeout and the cancellable of the running search:
+        self._search_timeout_id = self._search_cancellable = None
+
         self.model = PathTreeModel([])
 
         self.treeview = PathTreeView()
@@ -157,6 +182,13 @@ class RunnerView(View):
         self.group_treeview.set_vexpand(True)
         self.group_treeview.set_valign(Gtk.Align.FILL)
 
+        # (model, checksum, count) of the group shown in group_treeview;
+        # its model is reused while the group stays the same.
+        self._group_key = None
+        self.group_label = Gtk.Label()
+        self.group_label.set_margin_top(3)
+        self.group_label.set_margin_bottom(3)
+
         # This is needed to make sure operations on the one update
         # the other. Internally the same nodes are updated, but it has
         # to be made sure that the models get updated.
@@ -164,6 +196,7 @@ class RunnerView(View):
         self.treeview.set_twin(self.group_treeview)
 
         group_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        group_box.pack_start(self.group_label, False, False, 0)
         group_box.pack_start(scrolled(self.group_treeview), True, True, 0)
         group_box.pack_start(Gtk.HSeparator(), False, False, 0)
 
@@ -233,40 +266,90 @@ class RunnerView(View):
 
     def reset(self):
         """Reset internally to freshly initialized."""
+        self._cancel_search()
         self.is_running = False
         self._script_generated = False
-        self.runner = None
+        self.runner = self._refresher = None
+        self._group_key = None
         self.last_paths = []
 
         self.chart_stack.set_visible_child_name(ChartStack.LOADING)
         self.actionbar.set_sensitive(False)
 
-    def trigger_run(self, untagged_paths, tagged_paths):
-        """Trigger a new run on all paths in `paths`"""
+    def trigger_run(self, untagged_paths, tagged_paths, use_snapshot=True):
+        """Trigger a new run on all paths in `paths`
+
+        If `use_snapshot` is True and the same paths were scanned with the
+        same settings before, the results of back then are shown instead.
+        """
         # Remember last paths for rerun()
         self.reset()
         self.last_paths = (untagged_paths, tagged_paths)
+        self.runner = Runner(self.app.settings, untagged_paths, tagged_paths)
+
+        snapshot = None
+        if use_snapshot:
+            snapshot = find_snapshot(self.runner.snapshot_key())
+
+        if snapshot is not None:
+            self._show_snapshot(snapshot)
+            return
 
         # Make sure it looks busy:
         self.sub_title = 'Running…'
 
         # Fork off the rmlint process:
-        self.runner = Runner(self.app.settings, untagged_paths, tagged_paths)
-        self.runner.connect('lint-added', self.on_add_elem)
+        self.runner.connect('lints-added', self.on_add_elems)
         self.runner.connect('process-finished', self.on_process_finish)
         self.runner.run()
 
         # Make sure the previous run is not visible anymore:
-        self.model = PathTreeModel(untagged_paths + tagged_paths)
-        self.treeview.set_model(self.model)
+        self._set_model()
 
         # Indicate that we're in a fresh run:
         self.is_running = True
         self.show_progress(0)
 
     def rerun(self):
-        """Rerun with last given paths."""
-        self.trigger_run(*self.last_paths)
+        """Rerun with last given paths, ignoring any snapshot."""
+        self.trigger_run(*self.last_paths, use_snapshot=False)
+
+    def _runner_paths(self):
+        """Return all paths given to the current runner."""
+        return self.runner.untagged_paths + self.runner.tagged_paths
+
+    def _set_model(self, trie=None):
+        """Show a new model of the current runner's results in `trie`."""
+        # Results might be huge, use the memory efficient trie:
+        paths = self._runner_paths()
+        if trie is None:
+            trie = CompactPathTrie(paths)
+
+        old_model, self.model = self.model, PathTreeModel(paths, trie)
+        _show_model(self.treeview, self.model)
+        old_model.destroy()
+        self.chart_stack.clear_cache()
+
+    def _show_snapshot(self, snapshot):
+        """Show the results stored in `snapshot` and check them again."""
+        LOGGER.info('Showing results of the last run from a snapshot.')
+        self.runner.restore(snapshot)
+        self._set_model(snapshot.load_trie())
+
+        self.is_running = True
+        self._show_results(None)
+        self.sub_title = 'Refreshing results of the last run…'
+
+        # Let rmlint drop everything that vanished or changed since:
+        untagged, tagged = self.last_paths
+        refresher = Runner(self.app.settings, untagged, tagged)
+        refresher.scan_time = snapshot.scan_time
+        refresher.connect('process-finished', self.on_refresh_finish)
+
+        replay_path = refresher.get_replay_path()
+        snapshot.write_replay_input(replay_path)
+        refresher.run(replay_path=replay_path)
+        self._refresher = refresher
 
     ###########################
     #     SIGNAL CALLBACKS    #
@@ -283,27 +366,130 @@ class RunnerView(View):
 
         self.actionbar.set_choice(choice)
 
-        sub_model = self.model.filter_model(text)
-        if sub_model is not self.treeview.get_model():
+        # Only search once the user stopped typing for a moment:
+        self._cancel_search()
+        self._search_timeout_id = GLib.timeout_add(
+            SEARCH_DEBOUNCE_MS, self._start_search, text
+        )
+
+    def _cancel_search(self):
+        """Drop a pending search and cancel a running one."""
+        if self._search_timeout_id is not None:
+            GLib.source_remove(self._search_timeout_id)
+            self._search_timeout_id = None
+
+        if self._search_cancellable is not None:
+            self._search_cancellable.cancel()
+            self._search_cancellable = None
+
+    def _start_search(self, text):
+        """Run the search for `text` in a separate thread."""
+        self._search_timeout_id = None
+
+        if len(text) < 2:
+            LOGGER.debug('too short, showing full model')
+            self._show_search_result(self.model, None, True)
+            return False
+
+        query = Query.parse(text.lower())
+        model, cancellable = self.model, Gio.Cancellable()
+        self._search_cancellable = cancellable
+
+        def _deliver(nodes, final):
+            GLib.idle_add(
+                self._on_search_result, model, cancellable, nodes, final
+            )
+
+        def _search():
+            nodes = model.search(
+                query,
+                cancelled=cancellable.is_cancelled,
+                partial=lambda nodes: _deliver(nodes, False)
+            )
+
+            if nodes is not None:
+                _deliver(nodes, True)
+
+        threading.Thread(target=_search, daemon=True).start()
+        return False
+
+    def _on_search_result(self, model, cancellable, nodes, final):
+        """Called in the main loop with (partial) results of a search."""
+        if cancellable.is_cancelled() or model is not self.model:
+            # A newer search or run superseded this one.
+            return False
+
+        self._show_search_result(
+            FilteredPathTreeModel(model, nodes), cancellable, final
+        )
+        return False
+
+    def _show_search_result(self, sub_model, cancellable, final):
+        """Show `sub_model`; the chart is only updated for final results."""
+        if final and self._search_cancellable is cancellable:
+            self._search_cancellable = None
+
+        if sub_model is self.treeview.get_model():
+            return
+
+        _show_model(self.treeview, sub_model)
+        if final:
+            self.chart_stack.clear_cache()
             self.chart_stack.render(sub_model.trie.root)
-            self.treeview.set_model(sub_model)
 
-    def on_add_elem(self, runner):
-        """Called once the runner found a new element."""
-        elem = runner.element
-        self.model.add_path(elem['path'], Column.make_row(elem))
+    def on_add_elems(self, runner, elems):
+        """Called once the runner found a batch of new elements."""
+        self.model.add_paths(
+            [(elem['path'], Column.make_row(elem)) for elem in elems]
+        )
 
         # Decide how much progress to show (or just move a bit)
-        tick = (elem.get('progress', 0) / 100.0) or None
+        tick = (elems[-1].get('progress', 0) / 100.0) or None
         self.show_progress(tick)
 
-    def on_process_finish(self, _, error_msg):
+    def on_process_finish(self, runner, error_msg):
         """Called once self.runner finished running."""
         # Make sure we end up at 100% progress and show
         # the progress for a short time after (for the nice cozy feeling)
         LOGGER.info('`rmlint` finished.')
         self.show_progress(100)
         GLib.timeout_add(300, self.hide_progress)
+
+        self._show_results(error_msg)
+        if error_msg is None:
+            save_snapshot(runner)
+
+    def on_refresh_finish(self, refresher, error_msg):
+        """Called once the results of a snapshot were checked again."""
+        if refresher is not self._refresher:
+            # Another run was started in the meantime.
+            return
+
+        self._refresher = None
+        if error_msg is not None:
+            LOGGER.warning('Could not refresh snapshot: %s', error_msg)
+            self.sub_title = 'Finished scanning.'
+            return
+
+        if refresher.lint_paths() == self.runner.lint_paths():
+            LOGGER.info('Snapshot is still up to date.')
+            self.sub_title = 'Finished scanning.'
+            return
+
+        # Some lint vanished; show what is left:
+        LOGGER.info('Snapshot changed; showing refreshed results.')
+        self.runner = refresher
+        self._set_model()
+        self.model.add_paths([
+            (doc['path'], Column.make_row(doc)) for doc in refresher.objects
+            if doc.get('path') is not None
+        ])
+
+        self._show_results(None)
+        save_snapshot(refresher)
+
+    def _show_results(self, error_msg):
+        """Show the results of the current runner once they are complete."""
         GLib.timeout_add(350, self.treeview.expand_all)
 
         self.sub_title = 'Finished scanning.'
@@ -366,37 +552,43 @@ class RunnerView(View):
 
         self.actionbar.set_choice("Selected")
 
-        if not node.children:
+        if node.is_leaf:
             # It is a single file.
             # Show a chart containing all twins of this file.
             # This is helpful to see quickly where those lie.
-
-            cksum = node[Column.CKSUM]
-            group = self.model.trie.group(cksum)
-
-            paths = []
-            if len(self.last_paths) > 1:
-                paths = self.last_paths[0] + self.last_paths[1]
-
-            group_model = PathTreeModel(paths)
-
-            for twin_node in group or []:
-                group_model.add_path(
-                    twin_node.build_path(),
-                    twin_node.row,
-                    immediately=True
-                )
-
-            self.group_treeview.set_model(group_model)
+            self._show_group(node[Column.CKSUM])
             self.group_revealer.show()
             self.group_revealer.get_child().show_all()
             self.group_revealer.set_reveal_child(True)
-            self.chart_stack.render(group_model.trie.root)
+            self.chart_stack.render(self.group_treeview.get_model().trie.root)
         else:
             self.group_revealer.hide()
             self.group_revealer.set_reveal_child(False)
             self.chart_stack.render(node)
 
+    def _show_group(self, cksum):
+        """Show all files with the checksum `cksum` in group_treeview."""
+        trie = self.model.trie
+        stats = trie.group_stats(cksum) or (0, 0, 0)
+        size, count, reclaimable = stats
+
+        self.group_label.set_markup(GROUP_LABEL.format(
+            n=count,
+            s=size_to_human_readable(size),
+            r=size_to_human_readable(reclaimable)
+        ))
+
+        # Twins only change when new ones are found while running:
+        group_key = (self.model, cksum, count)
+        if group_key == self._group_key:
+            return
+
+        self._group_key = group_key
+        _show_model(
+            self.group_treeview,
+            FilteredPathTreeModel(self.model, trie.group(cksum))
+        )
+
     def _generate_script(self, trie, nodes):
         """Do the actual generation work, starting at `node` in `trie`."""
         self._script_generated = True
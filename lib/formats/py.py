@@ -23,7 +23,7 @@ Authors:
 """
 
 # This is the python remover utility shipped inside the rmlint binary.
-# The 200 lines source presented below is meant to be clean and hackable.
+# The source presented below is meant to be clean and hackable.
 # It is intended to be used for corner cases where the built-in sh formatter
 # is not enough or as an alternative to it. By default it works the same.
 #
@@ -34,14 +34,31 @@ Authors:
 # Python2 compat:
 from __future__ import print_function
 
+import io
 import os
 import sys
 import pwd
 import json
+import array
+import errno
+import fcntl
+import signal
+import struct
+import hashlib
+import itertools
+import time
 import shutil
-import filecmp
 import argparse
+import threading
 import subprocess
+import collections
+import multiprocessing
+import multiprocessing.pool
+
+try:
+    import queue
+except ImportError:  # Python2
+    import Queue as queue
 
 CURRENT_UID = os.geteuid()
 CURRENT_GID = pwd.getpwuid(CURRENT_UID).pw_gid
@@ -55,49 +72,385 @@ COLORS = {
     'reset':  "\x1b[0m" if USE_COLOR else "",
 }
 
+# Output of operations running on a worker thread (see --jobs) is collected
+# per operation, so that it can be printed in the order of the report.
+THREAD_STATE = threading.local()
+
+
+class Output(object):
+    # Collects everything printed for the entries and writes it out in
+    # batches, at most RATE times per second. In 'progress' mode a single
+    # status line is updated instead of printing a line per entry, in
+    # 'quiet' mode only errors and the final tally are printed.
+    RATE = 10.0
+
+    # Clears the current terminal line, to redraw the status line.
+    ERASE_LINE = '\x1b[2K\x1b[1G'
+
+    def __init__(self, mode='lines'):
+        self.mode, self.buffer, self.last_flush = mode, [], 0.0
+        self.status, self.shown_status = None, ''
+        self.progress_prefixes = {}
+        self.counts = collections.Counter()
+
+    def entry(self, progress, prefix, path, kind):
+        self.counts[kind] += 1
+        if self.mode == 'lines':
+            progress_prefix = self.progress_prefixes.get(progress)
+            if progress_prefix is None:
+                progress_prefix = '{c[blue]}[{p:3}%]{c[reset]} '.format(
+                    c=COLORS, p=progress)
+                self.progress_prefixes[progress] = progress_prefix
+            self.buffer.append(progress_prefix + prefix + path)
+        else:
+            self.status = (progress, path)
+
+        if time.time() - self.last_flush >= 1.0 / self.RATE:
+            self.flush()
+
+    def write(self, text, file=None):
+        if file is sys.stderr:
+            self.flush()
+            if self.shown_status:
+                sys.stdout.write(self.ERASE_LINE)
+                sys.stdout.flush()
+            print(text, file=file)
+        elif self.mode != 'quiet':
+            self.buffer.append(text)
+
+    def flush(self):
+        self.last_flush = time.time()
+        lines, self.buffer = self.buffer, []
+        if self.status is not None:
+            progress, path = self.status
+            self.status = None
+            if self.mode == 'progress':
+                status = '{c[blue]}[{p:3}%]{c[reset]} {n} entries, at: {path}'
+                status = status.format(
+                    c=COLORS, p=progress, n=sum(self.counts.values()),
+                    path=path)
+                if sys.stdout.isatty():
+                    self.shown_status = status
+                else:
+                    lines.append(status)
+
+        if self.shown_status:
+            # Print above the status line and redraw it afterwards:
+            sys.stdout.write(self.ERASE_LINE + ''.join(
+                line + '\n' for line in lines) + self.shown_status)
+        elif lines:
+            sys.stdout.write(''.join(line + '\n' for line in lines))
+        sys.stdout.flush()
+
+    def finish(self):
+        # The final tally replaces the status line.
+        if self.shown_status:
+            sys.stdout.write(self.ERASE_LINE)
+        self.status, self.shown_status = None, ''
+        self.flush()
+
+        if self.mode != 'lines':
+            print('{c[blue]}#{c[reset]} Handled {n} entries: {k}'.format(
+                c=COLORS, n=sum(self.counts.values()),
+                k=', '.join('{n} {t}'.format(n=n, t=t)
+                            for t, n in sorted(self.counts.items()))))
+        sys.stdout.flush()
+
+
+OUTPUT = Output()
+
+
+def report(text, file=None):
+    lines = getattr(THREAD_STATE, 'lines', None)
+    if lines is None:
+        OUTPUT.write(text, file=file)
+    else:
+        lines.append((text, file))
+
+
+class StatCache(object):
+    # Remembers the stat() results of recently seen paths, so that the
+    # original of a group is stat'ed once, not once per duplicate. Paths
+    # we modified are replaced by a tombstone: They are stat'ed again
+    # when needed, but late prefetch results may not revive them.
+    TOMBSTONE = object()
+
+    def __init__(self, capacity=64 * 1024):
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def _insert(self, path, result):
+        self.entries[path] = result
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def stat(self, path):
+        with self.lock:
+            result = self.entries.pop(path, None)
+            if result is not None and result is not self.TOMBSTONE:
+                self.entries[path] = result
+                return result
+
+        result = os.stat(path)
+        with self.lock:
+            self._insert(path, result)
+        return result
+
+    def prefetch(self, path):
+        try:
+            result = os.stat(path)
+        except OSError:
+            return  # reported once the entry is handled.
+
+        with self.lock:
+            if path not in self.entries:
+                self._insert(path, result)
+
+    def invalidate(self, path):
+        with self.lock:
+            self.entries.pop(path, None)
+            self._insert(path, self.TOMBSTONE)
+
+
+STAT_CACHE = StatCache()
+
+
+def iter_prefetched(items, depth, threads=8):
+    # Stat entries up to `depth` items ahead of the current one, so that
+    # metadata latency (e.g. of network filesystems) overlaps with the work.
+    pool = multiprocessing.pool.ThreadPool(threads)
+    window = collections.deque()
+    try:
+        for item in items:
+            pool.apply_async(STAT_CACHE.prefetch, (item['path'],))
+            window.append(item)
+            if len(window) > depth:
+                yield window.popleft()
+
+        while window:
+            yield window.popleft()
+    finally:
+        pool.terminate()
 
-def original_check(path, original, be_paranoid=True):
+
+def original_check(path, original, be_paranoid=True, verified=False):
     try:
-        stat_p, stat_o = os.stat(path), os.stat(original)
+        stat_p, stat_o = STAT_CACHE.stat(path), STAT_CACHE.stat(original)
         if (stat_p.st_dev, stat_p.st_ino) == (stat_o.st_dev, stat_o.st_ino):
-            print('{c[red]}Same inode; ignoring:{c[reset]} {o} <=> {p}'.format(
+            report('{c[red]}Same inode; ignoring:{c[reset]} {o} <=> {p}'.format(
                 c=COLORS, o=original, p=path))
             return False
 
         if stat_p.st_size != stat_o.st_size:
-            print('{c[red]}Size differs; ignoring:{c[reset]} '
-                  '{o} <=> {p}'.format(c=COLORS, o=original, p=path))
+            report('{c[red]}Size differs; ignoring:{c[reset]} '
+                   '{o} <=> {p}'.format(c=COLORS, o=original, p=path))
             return False
 
-        if be_paranoid and not filecmp.cmp(path, original):
-            print('{c[red]}Content differs; ignoring:{c[reset]} '
-                  '{o} <=> {p}'.format(c=COLORS, o=original, p=path))
+        if be_paranoid and not verified:
+            report('{c[red]}Content differs; ignoring:{c[reset]} '
+                   '{o} <=> {p}'.format(c=COLORS, o=original, p=path))
             return False
 
         return True
     except OSError as exc:
-        print('{c[red]}{exc}{c[reset]}'.format(c=COLORS, exc=exc))
+        report('{c[red]}{exc}{c[reset]}'.format(c=COLORS, exc=exc))
         return False
 
 
-def handle_duplicate_dir(path, original, **kwargs):
-    if not args.dry_run:
-        shutil.rmtree(path)
+# ioctl to share the data of one file with another (aka reflink), see
+# ioctl_ficlone(2). Works on btrfs, xfs and other CoW filesystems.
+FICLONE = 0x40049409
+
+# Errors telling that a handler is not possible for this file,
+# so the next handler in the list should be tried instead.
+FALLBACK_ERRNOS = {
+    errno.EXDEV, errno.EPERM, errno.EINVAL, errno.ENOTTY,
+    errno.EOPNOTSUPP, errno.EMLINK,
+}
+
+
+def temp_path(path):
+    return '{p}.{pid}.rmlint-tmp'.format(p=path, pid=os.getpid())
+
+
+def replace_by(path, make_replacement):
+    # Create the replacement next to the duplicate and rename it over the
+    # duplicate, so the path is never missing, not even after a crash.
+    tmp = temp_path(path)
+    make_replacement(tmp)
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        os.rename(tmp, path)
+    except OSError:
+        os.remove(tmp)
+        raise
 
 
-def handle_duplicate_file(path, original, args, **kwargs):
-    if original_check(path, original['path'], be_paranoid=args.paranoid):
-        if not args.dry_run:
+def link_remove(path, original, dry_run):
+    if not dry_run:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
             os.remove(path)
 
 
+def link_hardlink(path, original, dry_run):
+    stat_p, stat_o = STAT_CACHE.stat(path), STAT_CACHE.stat(original)
+    if stat_p.st_dev != stat_o.st_dev:
+        return False
+
+    if not dry_run:
+        try:
+            replace_by(path, lambda tmp: os.link(original, tmp))
+        except (IOError, OSError) as err:
+            if err.errno in FALLBACK_ERRNOS:
+                return False
+            raise
+
+
+def link_symlink(path, original, dry_run):
+    def make_symlink(tmp):
+        os.symlink(os.path.abspath(original), tmp)
+        # Give the symlink the mtime of the original, like the sh script:
+        if os.utime in getattr(os, 'supports_follow_symlinks', ()):
+            stat_o = STAT_CACHE.stat(original)
+            os.utime(tmp, (stat_o.st_atime, stat_o.st_mtime),
+                     follow_symlinks=False)
+
+    if not dry_run:
+        replace_by(path, make_symlink)
+
+
+def link_reflink(path, original, dry_run):
+    stat_p, stat_o = STAT_CACHE.stat(path), STAT_CACHE.stat(original)
+
+    def make_reflink(tmp):
+        # Clone the original's data, but keep the duplicate's owner,
+        # permissions and mtime, like `cp --reflink --preserve` would.
+        with open(original, 'rb') as src:
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            try:
+                fcntl.ioctl(fd, FICLONE, src.fileno())
+                owner, stat_t = (stat_p.st_uid, stat_p.st_gid), os.fstat(fd)
+                if (stat_t.st_uid, stat_t.st_gid) != owner:
+                    os.fchown(fd, *owner)
+                # After chown, which might clear the setuid/setgid bits:
+                os.fchmod(fd, stat_p.st_mode & 0o7777)
+            except (IOError, OSError):
+                os.close(fd)
+                os.remove(tmp)
+                raise
+
+            os.close(fd)
+            os.utime(tmp, (stat_p.st_atime, stat_p.st_mtime))
+
+    if not dry_run:
+        try:
+            replace_by(path, make_reflink)
+        except (IOError, OSError) as err:
+            if err.errno in FALLBACK_ERRNOS:
+                return False
+            raise
+
+
+LINK_HANDLERS = {
+    'remove': link_remove,
+    'hardlink': link_hardlink,
+    'symlink': link_symlink,
+    'reflink': link_reflink,
+}
+
+LINK_MESSAGES = {
+    'remove': '{c[yellow]}Deleting duplicate:',
+    'hardlink': '{c[yellow]}Hardlinking to original:',
+    'symlink': '{c[yellow]}Symlinking to original:',
+    'reflink': '{c[yellow]}Reflinking to original:',
+}
+
+
+def duplicate_handlers(item_type, handlers):
+    if item_type == 'duplicate_dir':
+        # Directories can neither be hardlinked nor reflinked.
+        return [h for h in handlers if h in ('remove', 'symlink')]
+    return handlers
+
+
+def handle_duplicate(path, original, args, item_type):
+    # Try the handlers in the order given by --handler, until one applies.
+    handlers = duplicate_handlers(item_type, args.handlers)
+    for idx, handler in enumerate(handlers):
+        if idx > 0:
+            report('{m}{c[reset]} {p}'.format(
+                m=LINK_MESSAGES[handler].format(c=COLORS), c=COLORS, p=path))
+
+        if LINK_HANDLERS[handler](path, original, args.dry_run) is not False:
+            return True
+
+    report('{c[red]}No handler applies; leaving as-is:{c[reset]} {p}'.format(
+        c=COLORS, p=path))
+    return False
+
+
+# Operations return False if they left the item as-is (e.g. because the
+# original changed), so it is not journaled and tried again on --resume.
+def handle_duplicate_dir(path, original, args, **kwargs):
+    return handle_duplicate(path, original['path'], args, 'duplicate_dir')
+
+
+def handle_duplicate_file(path, original, args, verified=False, **kwargs):
+    if not original_check(path, original['path'],
+                          be_paranoid=args.verify is not None,
+                          verified=verified):
+        return False
+
+    return handle_duplicate(path, original['path'], args, 'duplicate_file')
+
+
 def handle_unique_file(path, **kwargs):
     pass  # doesn't need any handling.
 
 
+class DirRemover(object):
+    # Removes directories relative to an open fd of their parent, so that
+    # siblings share one lookup of the (possibly deep) parent path instead
+    # of resolving the full path for every single rmdir().
+    def __init__(self):
+        self.parent, self.fd = None, None
+
+    def rmdir(self, path):
+        if os.rmdir not in getattr(os, 'supports_dir_fd', ()):
+            os.rmdir(path)  # Python2
+            return
+
+        parent, name = os.path.split(os.path.abspath(path))
+        if parent != self.parent:
+            self.close()
+            self.fd = os.open(parent, os.O_RDONLY | os.O_DIRECTORY)
+            self.parent = parent
+
+        os.rmdir(name, dir_fd=self.fd)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+        self.parent, self.fd = None, None
+
+
+DIR_REMOVER = DirRemover()
+
+
+def sort_empty_dirs(group):
+    # Deepest directories first (their parents might become empty only
+    # by removing them), siblings next to each other to share parent fds.
+    return sorted(group, key=lambda item: (
+        -item['path'].count(os.sep), os.path.dirname(item['path'])))
+
+
 def handle_empty_dir(path, **kwargs):
     if not args.dry_run:
-        os.rmdir(path)
+        DIR_REMOVER.rmdir(path)
 
 
 def handle_empty_file(path, **kwargs):
@@ -144,14 +497,90 @@ OPERATIONS = {
 }
 
 
-def exec_operation(item, original=None, args=None):
+def exec_operation(item, original=None, args=None, verified=False):
     try:
-        OPERATIONS[item['type']](
-            item['path'], original=original, item=item, args=args)
+        return OPERATIONS[item['type']](
+            item['path'], original=original, item=item, args=args,
+            verified=verified) is not False
     except OSError as err:
-        print('{c[red]}# {err}{c[reset]}'.format(
+        report('{c[red]}# {err}{c[reset]}'.format(
             err=err, c=COLORS
         ), file=sys.stderr)
+        return False
+    finally:
+        STAT_CACHE.invalidate(item['path'])
+
+
+class Journal(object):
+    # Append-only log of the entries that were handled already, so that an
+    # interrupted run can be continued with --resume. Entries are keyed by
+    # path, inode and mtime as given in the report; checking them needs no
+    # syscalls at all. Writes are fsync'ed in batches, not per entry.
+    SYNC_EVERY = 1024
+    SYNC_INTERVAL = 1.0
+
+    def __init__(self, path, resume=False, write=True):
+        self.path, self.done, self.skipped = path, set(), 0
+        self.resume, self.write = resume, write
+        if resume and os.path.exists(path):
+            with open(path) as handle:
+                self.done = set(line.strip() for line in handle)
+
+        # Opened by start() once the run was confirmed; opening it before
+        # would truncate the journal of an interrupted run on CTRL-C.
+        self.handle = None
+        self.lock = threading.Lock()
+        self.unsynced, self.last_sync = 0, time.time()
+
+    def start(self):
+        if self.write:
+            self.handle = open(self.path, 'a' if self.resume else 'w')
+
+    @staticmethod
+    def key(item):
+        return json.dumps([item['path'], item.get('inode'), item.get('mtime')])
+
+    def filter(self, items):
+        for item in items:
+            if not item['is_original'] and self.key(item) in self.done:
+                self.skipped += 1
+                continue
+
+            yield item
+
+    def record(self, item):
+        line = self.key(item) + '\n'
+        with self.lock:
+            if self.handle is None:
+                return
+
+            self.handle.write(line)
+            self.unsynced += 1
+            since_sync = time.time() - self.last_sync
+            if (self.unsynced >= self.SYNC_EVERY or
+                    since_sync >= self.SYNC_INTERVAL):
+                self._sync()
+
+    def _sync(self):
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+        self.unsynced, self.last_sync = 0, time.time()
+
+    def close(self, finished=False):
+        with self.lock:
+            if self.handle is not None:
+                self._sync()
+                self.handle.close()
+                self.handle = None
+
+                # Nothing left to resume:
+                if finished:
+                    os.remove(self.path)
+
+
+def run_operation(item, original, args, verified, journal):
+    if exec_operation(item, original, args, verified) and journal is not None:
+        journal.record(item)
 
 
 MESSAGES = {
@@ -173,15 +602,565 @@ ORIGINAL_MESSAGES = {
 }
 
 
-def main(args, data):
+class ParanoidVerifier(object):
+    # Compares all duplicates of a group against their original in one go:
+    # The original is read only once per group (or per MAX_OPEN_FILES
+    # duplicates), into buffers that are reused for the whole run.
+    # Files that diverge are dropped as soon as the first chunk differs.
+    CHUNK_SIZE = 1024 * 1024
+    MAX_OPEN_FILES = 512
+
+    def __init__(self):
+        self.original_buf = bytearray(self.CHUNK_SIZE)
+        self.member_buf = bytearray(self.CHUNK_SIZE)
+        self.bytes_read, self.seconds = 0, 0.0
+
+    def _read_chunk(self, handle, buf):
+        view, size = memoryview(buf), 0
+        while size < len(buf):
+            n_read = handle.readinto(view[size:])
+            if not n_read:
+                break
+            size += n_read
+
+        self.bytes_read += size
+        return size
+
+    def verify_groups(self, checks):
+        return [
+            self.verify(original['path'], [d['path'] for d in dupes])
+            for original, dupes in checks
+        ]
+
+    def verify(self, original, paths):
+        start, equal = time.time(), set()
+        for idx in range(0, len(paths), self.MAX_OPEN_FILES):
+            equal.update(self._verify_batch(
+                original, paths[idx:idx + self.MAX_OPEN_FILES]))
+
+        self.seconds += time.time() - start
+        return equal
+
+    def _verify_batch(self, original, paths):
+        handles = {}
+        try:
+            for path in paths:
+                try:
+                    handles[path] = io.open(path, 'rb', buffering=0)
+                except (IOError, OSError):
+                    pass  # reported by original_check() later on.
+
+            with io.open(original, 'rb', buffering=0) as original_handle:
+                while handles:
+                    size = self._read_chunk(original_handle, self.original_buf)
+                    chunk = memoryview(self.original_buf)[:size]
+                    for path, handle in list(handles.items()):
+                        n_read = self._read_chunk(handle, self.member_buf)
+                        member = memoryview(self.member_buf)[:n_read]
+                        if n_read != size or member != chunk:
+                            handles.pop(path).close()
+
+                    if size == 0:
+                        return set(handles)
+        except (IOError, OSError):
+            pass  # original vanished; reported by original_check() as well.
+        finally:
+            for handle in handles.values():
+                handle.close()
+
+        return set()
+
+    def close(self):
+        pass
+
+    def summary(self):
+        mbytes = self.bytes_read / (1024.0 * 1024.0)
+        return (
+            '{c[blue]}#{c[reset]} Paranoid check read {m:.1f} MiB '
+            'in {s:.2f}s ({r:.1f} MiB/s)'.format(
+                c=COLORS, m=mbytes, s=self.seconds,
+                r=mbytes / max(self.seconds, 1e-6)))
+
+
+# checksum_type of the json header => name of the algorithm in hashlib.
+HASHLIB_ALGORITHMS = {
+    'md5': 'md5',
+    'sha1': 'sha1',
+    'sha256': 'sha256',
+    'sha512': 'sha512',
+    'sha3-256': 'sha3_256',
+    'sha3-384': 'sha3_384',
+    'sha3-512': 'sha3_512',
+    'blake2b': 'blake2b',
+    'blake2s': 'blake2s',
+}
+
+
+def init_hash_worker():
+    # CTRL-C is handled by the main process.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def hash_file(job):
+    path, algorithm, seed = job
+    digest, size = hashlib.new(algorithm), 0
+    if seed:
+        # rmlint feeds the seed into the digest before the file contents.
+        digest.update(struct.pack('=Q', seed))
+
+    try:
+        with io.open(path, 'rb') as handle:
+            for block in iter(lambda: handle.read(1024 * 1024), b''):
+                digest.update(block)
+                size += len(block)
+    except (IOError, OSError):
+        return path, None, size
+
+    return path, digest.hexdigest(), size
+
+
+class ChecksumVerifier(object):
+    # Re-hashes files with the algorithm rmlint used and compares against
+    # the checksum stored in the report. Files of many groups are hashed
+    # together in a process pool; every file is read exactly once.
+    def __init__(self, header, jobs):
+        self.algorithm = HASHLIB_ALGORITHMS.get(header.get('checksum_type'))
+        self.seed = header.get('hash_seed', 0)
+        self.bytes_read, self.seconds = 0, 0.0
+        self.pool = multiprocessing.Pool(jobs, init_hash_worker)
+
+    @staticmethod
+    def supports(header):
+        try:
+            hashlib.new(HASHLIB_ALGORITHMS[header.get('checksum_type')])
+            return True
+        except (KeyError, ValueError):
+            return False
+
+    def verify_groups(self, checks):
+        start, paths = time.time(), set()
+        for original, dupes in checks:
+            paths.add(original['path'])
+            paths.update(d['path'] for d in dupes)
+
+        digests = {}
+        jobs = [(path, self.algorithm, self.seed) for path in paths]
+        for path, digest, size in self.pool.imap_unordered(
+                hash_file, jobs, chunksize=16):
+            digests[path] = digest
+            self.bytes_read += size
+
+        results = []
+        for original, dupes in checks:
+            if digests[original['path']] != original.get('checksum'):
+                results.append(set())
+                continue
+
+            results.append(set(
+                d['path'] for d in dupes
+                if digests[d['path']] == d.get('checksum')
+            ))
+
+        self.seconds += time.time() - start
+        return results
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def summary(self):
+        mbytes = self.bytes_read / (1024.0 * 1024.0)
+        return (
+            '{c[blue]}#{c[reset]} Checksum check read {m:.1f} MiB '
+            'in {s:.2f}s ({r:.1f} MiB/s)'.format(
+                c=COLORS, m=mbytes, s=self.seconds,
+                r=mbytes / max(self.seconds, 1e-6)))
+
+
+def u64_array():
+    try:
+        return array.array('Q')
+    except ValueError:  # Python2
+        return array.array('L')
+
+
+class GroupIndex(object):
+    # Compact representation of a whole report, for decisions that need
+    # to see complete duplicate groups (--original, --same-device) without
+    # keeping every json object alive: Directories are interned, file names
+    # are packed into one buffer and all other fields live in typed arrays.
+    # After building, every group is a contiguous range of `order`.
+    def __init__(self):
+        self.dirs, self.dir_ids = [], {}
+        self.kinds, self.kind_ids = [], {}
+        self.names, self.name_offsets = bytearray(), u64_array()
+        self.name_offsets.append(0)
+
+        self.dir_of, self.group_of = array.array('l'), array.array('l')
+        self.sizes, self.inodes, self.devices = (
+            u64_array(), u64_array(), u64_array())
+        self.mtimes = array.array('d')
+        self.kind_of, self.progress = array.array('B'), array.array('B')
+        self.is_original = array.array('B')
+
+        self.checksums, self.group_ids = [], {}
+        self.order, self.group_starts = array.array('l'), array.array('l')
+        self.group_sizes = array.array('l')
+
+    def _intern(self, values, ids, value):
+        idx = ids.get(value)
+        if idx is None:
+            idx = ids[value] = len(values)
+            values.append(value)
+        return idx
+
+    def add(self, item):
+        dirname, name = os.path.split(item['path'])
+        self.dir_of.append(self._intern(self.dirs, self.dir_ids, dirname))
+        self.names.extend(name.encode('utf-8', 'surrogatepass'))
+        self.name_offsets.append(len(self.names))
+
+        self.kind_of.append(
+            self._intern(self.kinds, self.kind_ids, item['type']))
+        self.sizes.append(item.get('size', 0))
+        self.inodes.append(item.get('inode', 0))
+        self.devices.append(item.get('disk_id', 0))
+        self.mtimes.append(item.get('mtime', 0.0))
+        self.progress.append(int(item.get('progress', 0)))
+        self.is_original.append(bool(item['is_original']))
+
+        group = -1
+        checksum = item.get('checksum')
+        if item['type'] == 'duplicate_file' and checksum is not None:
+            group = self.group_ids.get(checksum)
+            if group is None:
+                group = self.group_ids[checksum] = len(self.checksums)
+                self.checksums.append(checksum)
+                self.group_sizes.append(0)
+            self.group_sizes[group] += 1
+
+        self.group_of.append(group)
+
+    def build(self, items):
+        for item in items:
+            self.add(item)
+
+        # Place all members of a group at the spot of its first member,
+        # keeping the report order otherwise (counting sort, O(n)):
+        self.group_ids = {}
+        self.group_starts = array.array('l', [-1]) * len(self.checksums)
+        fill = array.array('l', [0]) * len(self.checksums)
+        self.order = array.array('l', [0]) * len(self.group_of)
+
+        cursor = 0
+        for idx, group in enumerate(self.group_of):
+            if group < 0:
+                self.order[cursor] = idx
+                cursor += 1
+                continue
+
+            if self.group_starts[group] < 0:
+                self.group_starts[group] = cursor
+                cursor += self.group_sizes[group]
+
+            self.order[self.group_starts[group] + fill[group]] = idx
+            fill[group] += 1
+
+    def item(self, idx, is_original=None):
+        start, end = self.name_offsets[idx], self.name_offsets[idx + 1]
+        name = bytes(self.names[start:end]).decode('utf-8', 'surrogatepass')
+        group = self.group_of[idx]
+        if is_original is None:
+            is_original = bool(self.is_original[idx])
+
+        item = {
+            'type': self.kinds[self.kind_of[idx]],
+            'path': os.path.join(self.dirs[self.dir_of[idx]], name),
+            'size': self.sizes[idx],
+            'inode': self.inodes[idx],
+            'disk_id': self.devices[idx],
+            'mtime': self.mtimes[idx],
+            'progress': self.progress[idx],
+            'is_original': is_original,
+        }
+        if group >= 0:
+            item['checksum'] = self.checksums[group]
+        return item
+
+    def iter_items(self, original='report', same_device=False):
+        pos = 0
+        while pos < len(self.order):
+            group = self.group_of[self.order[pos]]
+            if group < 0:
+                yield self.item(self.order[pos])
+                pos += 1
+                continue
+
+            members = list(self.order[pos:pos + self.group_sizes[group]])
+            pos += len(members)
+
+            if same_device and len(set(self.devices[m] for m in members)) > 1:
+                OUTPUT.write(
+                    '{c[yellow]}Group spans several devices; ignoring:'
+                    '{c[reset]} {p}'.format(
+                        c=COLORS, p=self.item(members[0])['path']))
+                continue
+
+            if original == 'report':
+                for member in members:
+                    yield self.item(member)
+                continue
+
+            pick = (min if original == 'oldest' else max)(
+                members, key=lambda m: self.mtimes[m])
+            yield self.item(pick, is_original=True)
+            for member in members:
+                if member != pick:
+                    yield self.item(member, is_original=False)
+
+
+# Maximum number of consecutive empty directories removed as one batch.
+EMPTYDIR_BATCH_SIZE = 4096
+
+
+def same_group(group, item):
+    last = group[-1]
+    if item['type'] != last['type']:
+        return False
+
+    if item['type'] == 'emptydir':
+        return len(group) < EMPTYDIR_BATCH_SIZE
+
+    return (
+        item.get('checksum') == last.get('checksum') and
+        not (item['is_original'] and not last['is_original'])
+    )
+
+
+def iter_groups(items):
+    # Yield duplicate files of the same group together and runs of empty
+    # directories as one batch, everything else one by one.
+    # Groups are contiguous in the report, originals first.
+    group = []
+    for item in items:
+        if group and not same_group(group, item):
+            yield group
+            group = []
+
+        group.append(item)
+        if item['type'] not in ('duplicate_file', 'emptydir'):
+            yield group
+            group = []
+
+    if group:
+        yield group
+
+
+def iter_batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+
+        yield batch
+
+
+def iter_verified_groups(groups, verifier, batch_size=64):
+    # Yield every group together with the paths of its duplicates that
+    # are still identical to their original. Groups are verified in
+    # batches, so that the checksum verifier can keep its pool busy.
+    last_original = None
+    for batch in iter_batches(groups, batch_size):
+        checks, check_idxs = [], []
+        for idx, group in enumerate(batch):
+            originals = [i for i in group if i['is_original']]
+            original = originals[-1] if originals else last_original
+            last_original = original
+
+            dupes = [i for i in group if not i['is_original']]
+            if group[0]['type'] == 'duplicate_file' and original and dupes:
+                checks.append((original, dupes))
+                check_idxs.append(idx)
+
+        verified = [set() for _ in batch]
+        for idx, paths in zip(check_idxs, verifier.verify_groups(checks)):
+            verified[idx] = paths
+
+        for group, paths in zip(batch, verified):
+            yield group, paths
+
+
+# Operations that depend on everything before them being finished,
+# e.g. empty directories can only be removed once their contents are gone.
+BARRIER_TYPES = {'duplicate_dir', 'emptydir'}
+
+
+class Job(object):
+    def __init__(self, entry, func=None, *args):
+        self.entry, self.lines = entry, []
+        self.func, self.args = func, args
+        self.done = threading.Event()
+        if func is None:
+            self.done.set()
+
+    def run(self):
+        THREAD_STATE.lines = self.lines
+        try:
+            self.func(*self.args)
+        except Exception as err:  # pylint: disable=broad-except
+            report('{c[red]}# {err!r}{c[reset]}'.format(
+                err=err, c=COLORS), file=sys.stderr)
+        finally:
+            THREAD_STATE.lines = None
+            self.done.set()
+
+
+class DevicePool(object):
+    # Runs operations on worker threads. Every device gets its own set of
+    # `jobs` workers, so slow devices do not stall fast ones and no
+    # device (e.g. a spinning disk) gets thrashed by too many requests.
+    def __init__(self, jobs, window=4096):
+        self.jobs, self.window = jobs, window
+        self.queues, self.workers = {}, []
+        self.pending = collections.deque()
+
+    def _work(self, job_queue):
+        # None is the signal to stop, see close().
+        while True:
+            job = job_queue.get()
+            if job is None:
+                return
+            job.run()
+
+    def submit(self, device, job):
+        if job.func is not None:
+            job_queue = self.queues.get(device)
+            if job_queue is None:
+                job_queue = self.queues[device] = queue.Queue()
+                for _ in range(self.jobs):
+                    worker = threading.Thread(
+                        target=self._work, args=(job_queue,))
+                    worker.daemon = True
+                    worker.start()
+                    self.workers.append(worker)
+
+            job_queue.put(job)
+
+        self.pending.append(job)
+        self.flush(keep=self.window)
+
+    def flush(self, keep=0):
+        # Print the output of finished jobs in report order and
+        # wait until no more than `keep` jobs are left pending.
+        while self.pending:
+            job = self.pending[0]
+            if len(self.pending) <= keep and not job.done.is_set():
+                break
+
+            # Waiting with a timeout keeps CTRL-C working on Python2.
+            while not job.done.wait(0.1):
+                pass
+
+            self.pending.popleft()
+            OUTPUT.entry(*job.entry)
+            for text, file in job.lines:
+                OUTPUT.write(text, file=file)
+
+    def close(self):
+        # Finish all jobs and stop the workers of every device.
+        self.flush()
+        for job_queue in self.queues.values():
+            for _ in range(self.jobs):
+                job_queue.put(None)
+
+        for worker in self.workers:
+            worker.join()
+
+        self.queues, self.workers = {}, []
+
+
+# Size of the chunks read while parsing pretty-printed json documents.
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+def iter_json_incremental(handle, buf=''):
+    # Parse one object after the other, only keeping a small window in memory.
+    decoder = json.JSONDecoder()
+    idx = 0
+    while True:
+        while idx < len(buf) and (buf[idx].isspace() or buf[idx] in ',['):
+            idx += 1
+
+        if buf[idx:idx + 1] == ']':
+            return
+
+        try:
+            item, idx = decoder.raw_decode(buf, idx)
+        except ValueError:
+            chunk = handle.read(JSON_CHUNK_SIZE)
+            if not chunk:
+                if buf[idx:].strip():
+                    raise
+                return
+
+            buf, idx = buf[idx:] + chunk, 0
+            continue
+
+        yield item
+
+
+def iter_json_items(handle):
+    # rmlint writes .rmlint.json with one object per line (json:oneline),
+    # which can be decoded line by line without loading the whole report.
+    for line in iter(handle.readline, ''):
+        text = line.strip().rstrip(',')
+        if text in ('', '[', ']'):
+            continue
+
+        try:
+            item = json.loads(text)
+        except ValueError:
+            # Pretty printed json; parse the rest object by object.
+            for item in iter_json_incremental(handle, line):
+                yield item
+            return
+
+        if isinstance(item, list):
+            # Whole report on a single line.
+            for entry in item:
+                yield entry
+            continue
+
+        yield item
+
+
+def entry_prefixes(args):
+    # Format the message of every entry type once, not once per entry.
+    prefixes = {}
+    for kind, msg in MESSAGES.items():
+        if kind in ORIGINAL_MESSAGES:
+            handlers = duplicate_handlers(kind, args.handlers)
+            if handlers and handlers[0] != 'remove':
+                msg = LINK_MESSAGES[handlers[0]]
+        prefixes[kind] = msg.format(c=COLORS, u=args.user, g=args.group)
+
+    for kind, msg in ORIGINAL_MESSAGES.items():
+        prefixes[(kind, True)] = msg.format(c=COLORS)
+
+    return dict((k, v + COLORS['reset'] + ' ') for k, v in prefixes.items())
+
+
+def main(args, items, journal=None):
     last_original_item = None
+    pool = DevicePool(args.jobs) if args.jobs > 1 else None
+    prefixes = entry_prefixes(args)
 
-    # Process header and footer, if present
-    header, footer = [], []
-    if data[0].get('description'):
-        header = data.pop(0)
-    if data[-1].get('total_files'):
-        footer = data.pop(-1)
+    # Process header, if present. The footer is skipped when it comes by.
+    header = next(items, {})
+    if not header.get('description'):
+        items = itertools.chain([header], items)
+        header = {}
 
     if not args.no_ask and not args.dry_run:
         print('rmlint was executed in the following way:\n',
@@ -192,25 +1171,90 @@ def main(args, data):
               file=sys.stderr)
         sys.stdin.read(1)
 
-    for item in data:
-        progress_prefix = '{c[blue]}[{p:3}%]{c[reset]} '.format(
-            c=COLORS, p=item['progress'])
+    if journal is not None:
+        try:
+            journal.start()
+        except IOError as err:
+            print('{c[yellow]}# Not journaling: {err}{c[reset]}'.format(
+                c=COLORS, err=err), file=sys.stderr)
+            journal = None
 
-        if item['is_original']:
-            msg = ORIGINAL_MESSAGES[item['type']].format(c=COLORS)
-            print('{prog}{v}{c[reset]} {path}'.format(
-                c=COLORS, prog=progress_prefix, v=msg, path=item['path']))
-            last_original_item = item
-            # Do not handle originals.
-            continue
+    # Skip the footer and the empty placeholder of json:no_footer.
+    items = (i for i in items if i and i.get('total_files') is None)
+    if journal is not None:
+        items = journal.filter(items)
+    if args.original != 'report' or args.same_device:
+        index = GroupIndex()
+        index.build(items)
+        items = index.iter_items(args.original, args.same_device)
+    if args.prefetch > 0:
+        STAT_CACHE.capacity = max(STAT_CACHE.capacity, 4 * args.prefetch)
+        items = iter_prefetched(items, args.prefetch)
+
+    verifier = None
+    if args.verify == 'checksum':
+        if ChecksumVerifier.supports(header):
+            # Hashing is CPU bound; use all cores unless told otherwise.
+            verifier = ChecksumVerifier(
+                header, args.jobs if args.jobs > 1 else None)
+        else:
+            OUTPUT.write(
+                '{c[yellow]}#{c[reset]} Cannot recompute {t} checksums; '
+                'falling back to paranoid compare.'.format(
+                    c=COLORS, t=header.get('checksum_type')))
+
+    if args.verify is not None and verifier is None:
+        verifier = ParanoidVerifier()
 
-        msg = MESSAGES[item['type']].format(
-            c=COLORS, u=args.user, g=args.group)
-        print('{prog}{v}{c[reset]} {path}'.format(
-            c=COLORS, prog=progress_prefix, v=msg, path=item['path']))
-        exec_operation(item, original=last_original_item, args=args)
+    groups = iter_groups(items)
+    if verifier is None:
+        groups = ((group, set()) for group in groups)
+    else:
+        groups = iter_verified_groups(groups, verifier)
 
-    print('{c[blue]}[100%] Done!{c[reset]}'.format(c=COLORS))
+    for group, verified in groups:
+        if group[0]['type'] == 'emptydir':
+            group = sort_empty_dirs(group)
+
+        for item in group:
+            if item['is_original']:
+                entry = (item['progress'], prefixes[(item['type'], True)],
+                         item['path'], 'original')
+                last_original_item = item
+                # Do not handle originals.
+                job = Job(entry)
+            else:
+                entry = (item['progress'], prefixes[item['type']],
+                         item['path'], item['type'])
+                job = Job(entry, run_operation, item, last_original_item,
+                          args, item['path'] in verified, journal)
+
+            if pool is None or item['type'] in BARRIER_TYPES:
+                if pool is not None:
+                    pool.flush()
+
+                OUTPUT.entry(*entry)
+                if job.func is not None:
+                    run_operation(*job.args)
+            else:
+                pool.submit(item.get('disk_id'), job)
+
+        DIR_REMOVER.close()
+
+    if pool is not None:
+        pool.close()
+
+    if verifier is not None:
+        OUTPUT.write(verifier.summary())
+        verifier.close()
+
+    if journal is not None and journal.skipped:
+        OUTPUT.write('{c[blue]}#{c[reset]} Skipped {n} entries that were '
+                     'handled by a previous run.'.format(
+                         c=COLORS, n=journal.skipped))
+
+    OUTPUT.write('{c[blue]}[100%] Done!{c[reset]}'.format(c=COLORS))
+    OUTPUT.finish()
 
 
 if __name__ == '__main__':
@@ -232,9 +1276,40 @@ if __name__ == '__main__':
         help='Do not ask for confirmation before running.'
     )
     parser.add_argument(
-        '-p', '--paranoid', action='store_true', default=False,
+        '-p', '--paranoid', action='store_const', dest='verify',
+        const='paranoid',
         help='Recheck that files are still identical before removing '
-             'duplicates.'
+             'duplicates. (same as --verify=paranoid)'
+    )
+    parser.add_argument(
+        '--verify', choices=['paranoid', 'checksum'], default=None,
+        help='How to recheck duplicates before removing them: paranoid '
+             'compares them byte by byte, checksum rehashes them and '
+             'compares against the checksum in the report.'
+    )
+    parser.add_argument(
+        '--handler', dest='handlers', default='remove', metavar='LIST',
+        help='Comma separated list of ways to handle duplicates, tried in '
+             'order until one works: remove, reflink, hardlink or symlink. '
+             '(default: remove)'
+    )
+    parser.add_argument(
+        '-l', '--link', dest='handlers', action='store_const',
+        const='reflink,hardlink,symlink',
+        help='Replace duplicates by links to their original instead of '
+             'removing them. (same as --handler=reflink,hardlink,symlink)'
+    )
+    parser.add_argument(
+        '--original', choices=['report', 'oldest', 'newest'],
+        default='report',
+        help='Which file of a duplicate group to keep: the original(s) given '
+             'in the report, or the one with the oldest or newest mtime. '
+             '(Reads the whole report before starting.)'
+    )
+    parser.add_argument(
+        '--same-device', action='store_true', default=False,
+        help='Leave duplicate groups alone that span several devices. '
+             '(Reads the whole report before starting.)'
     )
     parser.add_argument(
         '-u', '--user', type=int, default=CURRENT_UID,
@@ -244,20 +1319,46 @@ if __name__ == '__main__':
         '-g', '--group', type=int, default=CURRENT_GID,
         help='Numerical gid for chgrp operations'
     )
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='Number of operations to run in parallel per device '
+             '(default: 1, i.e. strictly serial)'
+    )
+    parser.add_argument(
+        '--prefetch', type=int, default=0, metavar='N',
+        help='Stat up to N upcoming entries in the background, which hides '
+             'the latency of network filesystems (default: 0, disabled)'
+    )
+    parser.add_argument(
+        '-r', '--resume', action='store_true', default=False,
+        help='Continue an interrupted run: Skip everything recorded in '
+             '<json_file>.journal, which is kept until a run completes.'
+    )
+
+    parser.add_argument(
+        '-q', '--quiet', dest='output', action='store_const', const='quiet',
+        default='lines',
+        help='Only print errors and a final tally, not every entry.'
+    )
+    parser.add_argument(
+        '--progress', dest='output', action='store_const', const='progress',
+        help='Print a short progress line ten times a second and a final '
+             'tally, instead of every entry.'
+    )
 
     args = parser.parse_args()
-    json_docs = []
+    OUTPUT.mode = args.output
+    args.handlers = args.handlers.split(',')
+    for handler in args.handlers:
+        if handler not in LINK_HANDLERS:
+            parser.error('invalid handler: {}'.format(handler))
+    json_handles = []
     for json_file in args.json_files:
         try:
-            with open(json_file) as f:
-                j = json.load(f)
-            json_docs.append(j)
+            json_handles.append(open(json_file))
         except IOError as err:      # Cannot open file
             print(err, file=sys.stderr)
             sys.exit(-1)
-        except ValueError as err:   # File is not valid JSON
-            print('{}: {}'.format(err, json_file), file=sys.stderr)
-            sys.exit(-1)
 
     try:
         if args.dry_run:
@@ -268,8 +1369,27 @@ if __name__ == '__main__':
                 )
             )
 
-        for json_doc in json_docs:
-            main(args, json_doc)
+        for json_file, handle in zip(args.json_files, json_handles):
+            try:
+                journal = Journal(
+                    json_file + '.journal', resume=args.resume,
+                    write=not args.dry_run)
+            except IOError as err:
+                print('{c[yellow]}# Not journaling: {err}{c[reset]}'.format(
+                    c=COLORS, err=err), file=sys.stderr)
+                journal = None
+
+            finished = False
+            try:
+                with handle:
+                    main(args, iter_json_items(handle), journal)
+                finished = True
+            except ValueError as err:   # File is not valid JSON
+                print('{}: {}'.format(err, json_file), file=sys.stderr)
+                sys.exit(-1)
+            finally:
+                if journal is not None:
+                    journal.close(finished=finished)
 
         if args.dry_run:
             print(
@@ -279,5 +1399,6 @@ if __name__ == '__main__':
                 )
             )
     except KeyboardInterrupt:
+        OUTPUT.flush()
         print('\ncanceled.')
 
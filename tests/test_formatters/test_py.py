@@ -82,3 +82,264 @@ def test_paranoia(usual_setup_usual_teardown, interpreter):
     assert footer['total_lint_size'] == 0
     assert footer['total_files'] == 4 # + 1
     assert footer['duplicates'] == 1
+
+
+def test_paranoia_group(usual_setup_usual_teardown):
+    # Larger than one chunk of the verifier, so the group is compared
+    # against the original in several rounds:
+    content = 'x' * (3 * 1024 * 1024 + 17)
+    for name in 'abcde':
+        create_file(content, name)
+
+    head, *data, footer = run_rmlint(
+        '-S a -o py:{t}/rmlint.py'.format(t=TESTDIR_NAME)
+    )
+    assert footer['duplicate_sets'] == 1
+    assert footer['duplicates'] == 4
+
+    # Same size, different content; in the first and in the last chunk:
+    with open(os.path.join(TESTDIR_NAME, 'c'), 'r+') as handle:
+        handle.write('y')
+
+    with open(os.path.join(TESTDIR_NAME, 'e'), 'r+') as handle:
+        handle.seek(len(content) - 1)
+        handle.write('y')
+
+    text = subprocess.check_output([
+        'python3',
+        os.path.join(TESTDIR_NAME, 'rmlint.py'),
+        '-d',
+        '-p'
+    ]).decode('utf-8')
+
+    assert text.count('Content differs') == 2
+    for name in 'abcde':
+        path = os.path.join(TESTDIR_NAME, name)
+        assert os.path.exists(path) == (name in 'ace')
+
+
+def test_pretty_json(usual_setup_usual_teardown):
+    create_file('xxx', 'a')
+    create_file('xxx', 'b')
+    create_file('xxx', 'c')
+
+    head, *data, footer = run_rmlint(
+        '-S a -o py:{t}/rmlint.py'.format(t=TESTDIR_NAME)
+    )
+    assert footer['duplicates'] == 2
+
+    # The remover is usually fed json:oneline, but should
+    # also be able to stream pretty printed documents.
+    pretty_path = os.path.join(TESTDIR_NAME, 'pretty.json')
+    with open(pretty_path, 'w') as handle:
+        json.dump([head] + data + [footer], handle, indent=4)
+
+    subprocess.check_output([
+        'python3',
+        os.path.join(TESTDIR_NAME, 'rmlint.py'),
+        '-d',
+        pretty_path
+    ])
+
+    assert os.path.exists(os.path.join(TESTDIR_NAME, 'a'))
+    assert not os.path.exists(os.path.join(TESTDIR_NAME, 'b'))
+    assert not os.path.exists(os.path.join(TESTDIR_NAME, 'c'))
+
+
+@pytest.mark.parametrize("extra_args", [
+    ['-j', '4'],
+    ['-j', '4', '--prefetch', '16'],
+    ['--prefetch', '16'],
+])
+def test_jobs(usual_setup_usual_teardown, extra_args):
+    for idx in range(10):
+        create_file('xxx', 'dupe_{}'.format(idx))
+        create_file('yyy', 'sub/dupe_{}'.format(idx))
+
+    head, *data, footer = run_rmlint(
+        '-S a -o py:{t}/rmlint.py'.format(t=TESTDIR_NAME)
+    )
+    assert footer['duplicate_sets'] == 2
+    assert footer['duplicates'] == 20
+
+    text = subprocess.check_output([
+        'python3',
+        os.path.join(TESTDIR_NAME, 'rmlint.py'),
+        '-d',
+    ] + extra_args).decode('utf-8')
+
+    # Output has to stay in the order of the report:
+    lines = [line for line in text.splitlines() if TESTDIR_NAME in line]
+    assert [line.split()[-1] for line in lines] == [e['path'] for e in data]
+
+    remaining = [e['path'] for e in data if os.path.exists(e['path'])]
+    assert remaining == [e['path'] for e in data if e['is_original']]
+
+
+@pytest.mark.parametrize("algorithm", ["sha256", "blake2b", "metro"])
+def test_verify_checksum(usual_setup_usual_teardown, algorithm):
+    create_file('xxx', 'a')
+    create_file('xxx', 'b')
+    create_file('xxx', 'c')
+
+    head, *data, footer = run_rmlint(
+        '-S a -a {a} -o py:{t}/rmlint.py'.format(a=algorithm, t=TESTDIR_NAME)
+    )
+    assert footer['duplicates'] == 2
+
+    # Same size, different content; only noticed when rehashing.
+    with open(os.path.join(TESTDIR_NAME, 'b'), 'w') as handle:
+        handle.write('yyy')
+
+    text = subprocess.check_output([
+        'python3',
+        os.path.join(TESTDIR_NAME, 'rmlint.py'),
+        '-d',
+        '--verify=checksum'
+    ]).decode('utf-8')
+
+    if algorithm == 'metro':
+        assert 'falling back to paranoid compare' in text
+
+    assert 'Content differs' in text
+    assert os.path.exists(os.path.join(TESTDIR_NAME, 'a'))
+    assert os.path.exists(os.path.join(TESTDIR_NAME, 'b'))
+    assert not os.path.exists(os.path.join(TESTDIR_NAME, 'c'))
+
+
+def test_resume(usual_setup_usual_teardown):
+    for idx in range(4):
+        create_file('xxx', 'dupe_{}'.format(idx))
+
+    head, *data, footer = run_rmlint(
+        '-S a -o py:{t}/rmlint.py'.format(t=TESTDIR_NAME)
+    )
+    assert footer['duplicates'] == 3
+
+    # Pretend a previous run was interrupted after handling two duplicates:
+    dupes = [e for e in data if not e['is_original']]
+    journal_path = '.rmlint.json.journal'
+    with open(journal_path, 'w') as handle:
+        for entry in dupes[:2]:
+            handle.write(json.dumps(
+                [entry['path'], entry['inode'], entry['mtime']]
+            ) + '\n')
+
+    text = subprocess.check_output([
+        'python3',
+        os.path.join(TESTDIR_NAME, 'rmlint.py'),
+        '-d',
+        '--resume'
+    ]).decode('utf-8')
+
+    assert 'Skipped 2 entries' in text
+    assert all(os.path.exists(e['path']) for e in dupes[:2])
+    assert not any(os.path.exists(e['path']) for e in dupes[2:])
+
+    # The journal is not needed anymore after a complete run:
+    assert not os.path.exists(journal_path)
+
+
+@pytest.mark.parametrize("original", ["oldest", "newest"])
+def test_original(usual_setup_usual_teardown, original):
+    for idx in range(3):
+        create_file('xxx', 'dupe_{}'.format(idx))
+        path = os.path.join(TESTDIR_NAME, 'dupe_{}'.format(idx))
+        os.utime(path, (1000 * (idx + 1), 1000 * (idx + 1)))
+
+    # Let rmlint pick the opposite of what the script is told to keep:
+    head, *data, footer = run_rmlint(
+        '-S {s} -o py:{t}/rmlint.py'.format(
+            s='M' if original == 'oldest' else 'm', t=TESTDIR_NAME
+        )
+    )
+    assert footer['duplicates'] == 2
+
+    subprocess.check_call([
+        'python3',
+        os.path.join(TESTDIR_NAME, 'rmlint.py'),
+        '-d',
+        '--original', original
+    ])
+
+    kept = 'dupe_0' if original == 'oldest' else 'dupe_2'
+    for idx in range(3):
+        name = 'dupe_{}'.format(idx)
+        path = os.path.join(TESTDIR_NAME, name)
+        assert os.path.exists(path) == (name == kept)
+
+
+@pytest.mark.parametrize("handler", ["hardlink", "symlink"])
+def test_link_handlers(usual_setup_usual_teardown, handler):
+    create_file('xxx', 'a')
+    create_file('xxx', 'b')
+    create_file('xxx', 'c')
+
+    head, *data, footer = run_rmlint(
+        '-S a -o py:{t}/rmlint.py'.format(t=TESTDIR_NAME)
+    )
+    assert footer['duplicates'] == 2
+
+    subprocess.check_output([
+        'python3',
+        os.path.join(TESTDIR_NAME, 'rmlint.py'),
+        '-d',
+        '--handler', handler
+    ])
+
+    orig_path = os.path.join(TESTDIR_NAME, 'a')
+    for name in 'bc':
+        path = os.path.join(TESTDIR_NAME, name)
+        if handler == 'symlink':
+            assert os.readlink(path) == orig_path
+        else:
+            assert os.stat(path).st_ino == os.stat(orig_path).st_ino
+
+        with open(path) as handle:
+            assert handle.read() == 'xxx'
+
+    # No temporary files should be left behind:
+    assert not [p for p in os.listdir(TESTDIR_NAME) if 'rmlint-tmp' in p]
+
+
+def test_empty_dirs(usual_setup_usual_teardown):
+    for parent in ['a', 'b']:
+        for child in ['x', 'y', 'z']:
+            create_dirs(os.path.join('empty', parent, child, 'deep'))
+
+    head, *data, footer = run_rmlint(
+        '-T "none +ed" -o py:{t}/rmlint.py'.format(t=TESTDIR_NAME)
+    )
+    assert len(data) == 15
+
+    subprocess.check_output([
+        'python3',
+        os.path.join(TESTDIR_NAME, 'rmlint.py'),
+        '-d',
+    ])
+
+    assert not os.path.exists(os.path.join(TESTDIR_NAME, 'empty'))
+
+
+@pytest.mark.parametrize("mode", ["--quiet", "--progress"])
+def test_output_modes(usual_setup_usual_teardown, mode):
+    for idx in range(5):
+        create_file('xxx', 'dupe_{}'.format(idx))
+
+    head, *data, footer = run_rmlint(
+        '-S a -o py:{t}/rmlint.py'.format(t=TESTDIR_NAME)
+    )
+    assert footer['duplicates'] == 4
+
+    text = subprocess.check_output([
+        'python3',
+        os.path.join(TESTDIR_NAME, 'rmlint.py'),
+        '-d',
+        mode
+    ]).decode('utf-8')
+
+    lines = text.splitlines()
+    assert 'Deleting duplicate' not in text
+    assert lines[-1] == '# Handled 5 entries: 4 duplicate_file, 1 original'
+    if mode == '--quiet':
+        assert len(lines) == 1
@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+# Tests of the Shredder GUI logic that do not need a display.
+# They are skipped if PyGObject with Gtk 3 is not available.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'gui'
+))
+
+try:
+    import shredder.tree
+except (ImportError, ValueError):
+    collect_ignore_glob = ['test_*.py']
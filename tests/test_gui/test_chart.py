@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import math
+import random
+
+import pytest
+
+from shredder.tree import Column, CompactPathTrie
+
+pytest.importorskip('cairo')
+from shredder.chart import RingGeometry
+
+
+def _make_trie():
+    rand = random.Random(42)
+    trie = CompactPathTrie(['/root'])
+    for idx in range(1000):
+        dirs = [
+            'dir_{}'.format(rand.randrange(4))
+            for _ in range(rand.randrange(1, 5))
+        ]
+        path = '/root/{}/file_{}'.format('/'.join(dirs), idx)
+        trie.insert(path, Column.make_row({'size': rand.randrange(1, 10000)}))
+
+    trie.flush()
+    return trie
+
+
+def test_ring_geometry_hit():
+    geometry = RingGeometry(_make_trie().root)
+    assert geometry.max_layers > 2
+
+    rand = random.Random(23)
+    for _ in range(5000):
+        layer = rand.randrange(geometry.max_layers + 2)
+        deg = rand.uniform(0, 2 * math.pi)
+
+        # Test each segment, like the chart did before the layers were indexed:
+        expected = [
+            segment for segment in geometry.segments
+            if segment.layer == layer and
+            segment.degree <= deg <= segment.degree + segment.size
+        ]
+
+        segment = geometry.hit(layer, deg)
+        if expected:
+            assert segment in expected
+        else:
+            assert segment is None
+
+
+def test_ring_geometry_layers_cover_root():
+    trie = _make_trie()
+    geometry = RingGeometry(trie.root)
+
+    # The root, /root and the directories below it all fill the circle:
+    for layer in range(1, 4):
+        segments = geometry.layers[layer][1]
+        assert math.isclose(sum(seg.size for seg in segments), 2 * math.pi)
+
+    assert geometry.total_size == trie.root[Column.SIZE]
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import os
+import time
+
+import pytest
+
+from gi.repository import GLib
+
+from shredder.views import locations
+from shredder.views.locations import DirSizeService
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        locations, 'size_cache_file_path',
+        lambda: str(tmp_path / 'cache' / 'dir-sizes.json')
+    )
+
+    top = tmp_path / 'top'
+    for sub_dir in ['a/deep', 'b']:
+        os.makedirs(str(top / sub_dir))
+
+    (top / 'a' / 'x').write_bytes(b'x' * 10000)
+    (top / 'b' / 'z').write_bytes(b'z' * 5000)
+    (top / 'a' / 'deep' / 'w').write_bytes(b'w' * 3000)
+
+    # Hardlinks within one directory, across directories and to outside:
+    os.link(str(top / 'a' / 'x'), str(top / 'a' / 'x_link'))
+    os.link(str(top / 'a' / 'x'), str(top / 'b' / 'x_link'))
+    os.link(str(top / 'b' / 'z'), str(tmp_path / 'z_outside'))
+    return top
+
+
+def _du(path):
+    """Disk usage of `path` like `du -s`, counting hardlinks once."""
+    seen, size = set(), 0
+    for dir_path, dir_names, file_names in os.walk(path):
+        size += os.lstat(dir_path).st_blocks * 512
+        for name in file_names:
+            stat = os.lstat(os.path.join(dir_path, name))
+            if (stat.st_dev, stat.st_ino) not in seen:
+                seen.add((stat.st_dev, stat.st_ino))
+                size += stat.st_blocks * 512
+
+    return size
+
+
+def _request_sizes(service, paths):
+    """Request the size of all `paths`; return the reported (size, done)."""
+    results = {path: [] for path in paths}
+    for path in paths:
+        service.request(
+            path, lambda size, done, path=path: results[path].append(
+                (size, done)
+            )
+        )
+
+    context, deadline = GLib.MainContext.default(), time.time() + 30
+    while not all(sizes and sizes[-1][1] for sizes in results.values()):
+        assert time.time() < deadline
+        if not context.iteration(False):
+            time.sleep(0.01)
+
+    return results
+
+
+@pytest.mark.parametrize('sub_paths', [
+    ['.', 'a', 'b', 'a/deep'],
+    ['a/deep', 'b', 'a', '.'],
+    ['b', '.'],
+])
+def test_dir_sizes_count_hardlinks_once(tree, sub_paths):
+    paths = [os.path.normpath(str(tree / path)) for path in sub_paths]
+    results = _request_sizes(DirSizeService(), paths)
+
+    for path in paths:
+        sizes = [size for size, _ in results[path]]
+        assert sizes[-1] == _du(path)
+
+        # Estimates only grow while walking:
+        assert sizes == sorted(sizes)
+
+
+def test_dir_size_unreadable(tree):
+    path = str(tree / 'missing')
+    assert _request_sizes(DirSizeService(), [path])[path] == [(None, True)]
+
+
+def test_dir_size_cache_is_estimate(tree):
+    path = str(tree)
+    first = _request_sizes(DirSizeService(), [path])[path]
+    assert first[-1] == (_du(path), True)
+
+    # Not visible in the mtime of `tree`, so the cache cannot tell:
+    (tree / 'a' / 'deep' / 'new').write_bytes(b'n' * 50000)
+
+    second = _request_sizes(DirSizeService(), [path])[path]
+    assert second[0] == (first[-1][0], False)
+    assert second[-1] == (_du(path), True)
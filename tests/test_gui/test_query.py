@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import random
+
+import pytest
+
+from shredder.tree import Column, CompactPathTrie, PathTrie
+from shredder.query import NameIndex, RangeIndex, Query
+
+
+QUERIES = [
+    'file_1', 'dir_2', 'FILE', 'x', 'le_', 'zzz', 'ir_1/fi',
+    'size:100-200', 'size:1K-1M', 'mtime:1000-5000', 'count:2',
+    'count:2-3 size:0-500', 'dir_0 size:500-1000', 'size:12345',
+]
+
+
+def _make_trie(trie_type):
+    rand = random.Random(42)
+    trie = trie_type(['/root'])
+    for idx in range(500):
+        path = '/root/dir_{}/sub_{}/file_{}'.format(
+            rand.randrange(4), rand.randrange(3), idx
+        )
+        trie.insert(path, Column.make_row({
+            'size': rand.randrange(2000),
+            'mtime': rand.randrange(10000),
+            'twins': rand.randrange(1, 4),
+            'checksum': 'abc'
+        }))
+
+    trie.flush()
+    return trie
+
+
+def _matching_paths(trie, query):
+    """Evaluate `query` leaf by leaf, like the search did before the index."""
+    return sorted(
+        node.build_path() for node in trie.iterate()
+        if node.is_leaf and query.matches(
+            node, node[Column.SIZE], node[Column.MTIME], -node[Column.COUNT]
+        )
+    )
+
+
+@pytest.mark.parametrize('query_text', QUERIES)
+@pytest.mark.parametrize('trie_type', [PathTrie, CompactPathTrie])
+def test_search_matches_query(trie_type, query_text):
+    query = Query.parse(query_text)
+    expected = _matching_paths(_make_trie(PathTrie), query)
+
+    found = _make_trie(trie_type).search(query)
+    assert sorted(node.build_path() for node in found) == expected
+
+
+def test_search_is_ordered():
+    trie = _make_trie(CompactPathTrie)
+    found = trie.search(Query.parse('file'))
+    iter_paths = [node.build_iter_path() for node in found]
+    assert iter_paths == sorted(iter_paths)
+
+
+def test_search_generation_ignores_later_nodes():
+    trie = _make_trie(CompactPathTrie)
+    generation = trie.search_index.generation()
+    trie.insert('/root/new/file_new', Column.make_row({'size': 1}))
+    trie.flush()
+
+    query = Query.parse('file_new')
+    assert trie.search(query, generation=generation) == []
+    assert len(trie.search(query)) == 1
+
+
+def test_name_index():
+    index = NameIndex()
+    names = ['abc', 'abcd', 'xbcx', 'ab', 'bcd']
+    ids = [index.add(name) for name in names]
+    assert index.add('abcd') == ids[1]
+
+    for term in ['bc', 'bcd', 'abc', 'x', 'zzz', '']:
+        assert sorted(index.find(term)) == [
+            ids[idx] for idx, name in enumerate(names) if term in name
+        ]
+
+    # Names added after `limit` are not looked at:
+    assert index.find('bcd', limit=2) == [ids[1]]
+
+
+def test_range_index():
+    values = {handle: handle % 7 for handle in range(50)}
+    index = RangeIndex(values.__getitem__, int_handles=True)
+    for handle in values:
+        index.add(handle)
+
+    matches = [[3], [5, 6]]
+    assert index.find(matches) == {
+        handle for handle, value in values.items() if value in (3, 5, 6)
+    }
+
+    # Sorting only happens again after invalidate():
+    values[0] = 3
+    assert 0 not in index.find([[3]])
+    index.invalidate()
+    assert 0 in index.find([[3]])
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import time
+
+import pytest
+
+from shredder import runner
+from shredder.runner import ScriptMap
+
+
+RED, RESET = '\x1b[0;31m', '\x1b[0m'
+
+
+@pytest.fixture
+def script_map(tmp_path, monkeypatch):
+    # Small chunks, so lines and matches cross chunk borders:
+    monkeypatch.setattr(runner, 'SCRIPT_SCAN_CHUNK_SIZE', 97)
+
+    lines = []
+    for idx in range(300):
+        lines.append('{}remove_cmd{} /päth/Öfile_{}{}{} ab'.format(
+            RED, RESET, idx, RED if idx % 2 else '', RESET if idx % 2 else ''
+        ))
+
+    path = tmp_path / 'rmlint.sh'
+    path.write_bytes(
+        '\n'.join(lines).encode('utf-8') + b'\n\xff last line ab'
+    )
+
+    script_map = ScriptMap(str(path))
+    deadline = time.time() + 10
+    while not script_map.is_indexed and time.time() < deadline:
+        time.sleep(0.01)
+
+    yield script_map
+    script_map.close()
+
+
+def _shown_lines(script_map):
+    return script_map.lines(0, script_map.n_lines).split('\n')
+
+
+def _find_all(script_map, query):
+    """(line, column) of all matches, like the editor steps through them."""
+    found, offset = [], script_map.find(query)
+    while offset >= 0:
+        found.append(
+            (script_map.line_of(offset), script_map.column_of(offset))
+        )
+        offset = script_map.find(query, offset + 1)
+
+    return found
+
+
+def test_script_map_lines(script_map):
+    assert script_map.is_indexed
+    assert script_map.n_lines == 301
+
+    shown = _shown_lines(script_map)
+    assert shown[7] == 'remove_cmd /päth/Öfile_7 ab'
+    assert shown[-1] == ' last line ab'
+    assert script_map.lines(299, 1000) == shown[299] + '\n' + shown[300]
+    assert script_map.lines(5, 5) == ''
+
+
+def test_script_map_line_of(script_map):
+    offsets = script_map.offsets
+    for line in [0, 1, 150, 300]:
+        assert script_map.line_of(offsets[line]) == line
+        assert script_map.column_of(offsets[line]) == 0
+        assert script_map.line_of(offsets[line + 1] - 1) == line
+
+    assert script_map.is_line_indexed(offsets[-1] - 1)
+
+
+@pytest.mark.parametrize('query', [
+    # Spans color codes, needs unicode case folding or is at the end:
+    'cmd /', 'öFILE_12', 'PÄTH', 'file_13 ab', 'ab', 'last line',
+    'remove', 'zzz', '0;31m',
+])
+def test_script_map_find(script_map, query):
+    expected = []
+    for line, text in enumerate(_shown_lines(script_map)):
+        column = text.lower().find(query.lower())
+        while column >= 0:
+            expected.append((line, column))
+            column = text.lower().find(query.lower(), column + 1)
+
+    assert _find_all(script_map, query) == expected
+
+
+def test_script_map_find_cancelled(script_map):
+    assert script_map.find('ab', cancelled=lambda: True) == -1
+
+
+def test_script_map_close(script_map):
+    script_map.close()
+    assert script_map.find('ab') == -1
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import os
+import json
+import time
+
+import pytest
+
+from shredder import snapshot
+from shredder.tree import Column, CompactPathTrie
+from shredder.query import Query
+
+
+@pytest.fixture
+def roots(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        snapshot, 'snapshot_dir_path', lambda: str(tmp_path / 'snapshots')
+    )
+
+    paths = [str(tmp_path / 'a'), str(tmp_path / 'b' / 'c')]
+    for path in paths:
+        os.makedirs(path)
+
+    return paths
+
+
+def _make_documents(roots):
+    documents = []
+    for idx in range(300):
+        # Paths do not need to be valid utf-8:
+        path = '{}/dir_{}/file_{}\udcff'.format(roots[idx % 2], idx % 7, idx)
+        documents.append({
+            'type': 'duplicate_file', 'path': path, 'size': idx,
+            'twins': 3, 'mtime': 1.5 * idx, 'is_original': idx % 3 == 0,
+            'checksum': '{:08x}'.format(idx // 3)
+        })
+
+    documents.append({'type': 'emptydir', 'path': None})
+    return documents
+
+
+def _describe(trie):
+    return [
+        (node.build_path(), node.is_leaf, node.build_iter_path(),
+         [node[column] for column in range(Column.PATH)])
+        for node in trie.iterate()
+    ]
+
+
+def test_snapshot_round_trip(roots, tmp_path):
+    documents = _make_documents(roots)
+    header, footer = {'description': 'header'}, {'aborted': False}
+    snapshot.write_snapshot(
+        'key', time.time(), roots, header, footer, documents
+    )
+
+    snap = snapshot.find_snapshot('key')
+    assert snap is not None
+    assert (snap.header, snap.footer) == (header, footer)
+    assert list(snap.documents) == documents
+    assert snap.path_index()[documents[7]['path']] == 7
+
+    expected = CompactPathTrie(roots)
+    for doc in documents[:-1]:
+        expected.insert(doc['path'], Column.make_row(doc))
+    expected.flush()
+
+    trie = snap.load_trie()
+    assert _describe(trie) == _describe(expected)
+    assert len(trie.group('00000005')) == 3
+    for query_text in ['file_1', 'dir_3', 'size:100-200']:
+        query = Query.parse(query_text)
+        assert [node.key for node in trie.search(query)] == \
+            [node.key for node in expected.search(query)]
+
+    replay_path = str(tmp_path / 'replay.json')
+    snap.write_replay_input(replay_path)
+    with open(replay_path) as handle:
+        assert json.load(handle) == [header] + documents + [footer]
+
+
+def test_snapshot_outdated(roots):
+    documents = _make_documents(roots)[:5]
+    too_old = time.time() - snapshot.SNAPSHOT_MAX_AGE - 1
+    snapshot.write_snapshot('old', too_old, roots, {}, {}, documents)
+    assert snapshot.find_snapshot('old') is None
+
+    snapshot.write_snapshot('new', time.time(), roots, {}, {}, documents)
+    assert snapshot.find_snapshot('new') is not None
+    assert snapshot.find_snapshot('other') is None
+
+    # A changed root path invalidates the snapshot:
+    os.utime(roots[0], (1, 1))
+    assert snapshot.find_snapshot('new') is None
+
+
+def test_snapshot_pruning(roots):
+    documents = _make_documents(roots)[:5]
+    for idx in range(snapshot.SNAPSHOT_MAX_COUNT + 3):
+        snapshot.write_snapshot(
+            'key_{}'.format(idx), time.time(), roots, {}, {}, documents
+        )
+
+    names = os.listdir(snapshot.snapshot_dir_path())
+    assert len(names) == snapshot.SNAPSHOT_MAX_COUNT
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import gc
+import weakref
+
+from shredder.tree import (
+    Column, CompactPathTrie, PathTreeModel, FilteredPathTreeModel
+)
+from shredder.query import Query
+
+
+def _make_model(n_files=10):
+    model = PathTreeModel(['/root'], CompactPathTrie(['/root']))
+    for idx in range(n_files):
+        model.add_path('/root/dir/file_{}'.format(idx), Column.make_row({
+            'size': idx, 'mtime': 1, 'checksum': 'abc'
+        }), immediately=True)
+
+    return model
+
+
+def test_filtered_model_is_freed():
+    model = _make_model()
+
+    refs = []
+    for _ in range(3):
+        sub_model = FilteredPathTreeModel(
+            model, model.search(Query.parse('file_1'))
+        )
+        refs.append(weakref.ref(sub_model))
+        refs.append(weakref.ref(sub_model.trie))
+        del sub_model
+
+    gc.collect()
+    assert all(ref() is None for ref in refs)
+
+
+def test_destroyed_models_are_freed():
+    model = _make_model()
+    sub_model = FilteredPathTreeModel(model, model.search(Query.parse('file')))
+
+    # Updates of shared nodes still reach the filtered model:
+    node = model.trie.find('/root/dir/file_1')
+    model.trie.update_node(node, Column.TAG, node[Column.TAG])
+    assert sub_model._update_timeout_id is not None
+
+    refs = [weakref.ref(sub_model), weakref.ref(model)]
+    sub_model.destroy()
+    model.destroy()
+    del sub_model, model, node
+
+    gc.collect()
+    assert all(ref() is None for ref in refs)
+
+
+def _describe(trie):
+    return [
+        (node.build_path(), node.is_leaf, node.build_iter_path(),
+         [node[column] for column in range(Column.PATH)])
+        for node in trie.iterate()
+    ]
+
+
+def test_compact_trie_dump_load():
+    trie = _make_model(n_files=50).trie
+    trie.insert('/root/other/file_0', Column.make_row({
+        'size': 3, 'mtime': 2, 'checksum': 'def', 'type': 'duplicate_file'
+    }))
+    trie.flush()
+
+    loaded = CompactPathTrie.load(trie.paths, trie.dump())
+    assert _describe(loaded) == _describe(trie)
+    assert loaded.max_depth == trie.max_depth
+    assert loaded.group_stats('abc') == trie.group_stats('abc')
+    assert [node.key for node in loaded.group('def')] == \
+        [node.key for node in trie.group('def')]
+
+    query = Query.parse('file_1')
+    assert [node.key for node in loaded.search(query)] == \
+        [node.key for node in trie.search(query)]
+
+    # The loaded trie keeps growing like any other.
+    # It shares the dumped arrays, so do not look at `trie` anymore:
+    dir_size = loaded.find('/root/dir')[Column.SIZE]
+    loaded.insert('/root/dir/file_new', Column.make_row({'size': 1}))
+    loaded.flush()
+    assert loaded.find('/root/dir/file_new').is_leaf
+    assert loaded.find('/root/dir')[Column.SIZE] == dir_size + 1